@@ -5,8 +5,7 @@ Auteur : Marc Francescon
 Date : Avril 2025
 """
 
-import os
-from download_function import telecharger_fichier  # Importer la fonction de téléchargement
+from download_function import telecharger_fichiers  # Importer la fonction de téléchargement
 
 #  Fichier texte contenant les URLs des fichiers à télécharger
 url_file = "/Users/marcfrancescon/Desktop/lien_chla_2003_2013.txt"
@@ -18,14 +17,11 @@ download_folder = "/Users/marcfrancescon/Desktop/chla_2003_2013"
 with open(url_file, "r") as file:
     urls = [line.strip() for line in file if line.strip()]
 
-#  Télécharger chaque fichier
-for url in urls:
-    # Extraire le nom du fichier à partir de l'URL
-    filename = os.path.basename(url)
-    destination = os.path.join(download_folder, filename)
-
-    # Appel de la fonction de téléchargement
-    telecharger_fichier(url, destination)
+#  Télécharger les fichiers en parallèle (reprise automatique des transferts interrompus)
+bilan = telecharger_fichiers(urls, download_folder, workers=4)
+for filename, ok, octets, duree in bilan:
+    if not ok:
+        print(f" Échec : {filename}")
 
 print("Téléchargement terminé.")
 
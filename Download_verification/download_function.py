@@ -1,12 +1,18 @@
 # download_function.py
 """
 Script de la fonction de telechargement des fichiers chlorophylle (chlor_a) dans le dossier spécifié.
+Téléchargements concurrents (pool de threads, pool de connexions borné), reprise des transferts
+interrompus par requêtes HTTP Range dans des fichiers .part, renommage atomique une fois complets.
 Auteur : Marc Francescon
 Date : Avril 2025
 """
 
 import os
+import time
+import random
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 #  Dossier de téléchargement
@@ -17,31 +23,143 @@ Path(download_folder).mkdir(parents=True, exist_ok=True)
 session = requests.Session()
 session.trust_env = True  # autorise l'utilisation de .netrc et variables d'environnement
 
-def telecharger_fichier(url, destination):
+TAILLE_BLOC = 1 << 20  # Octets lus par itération (1 Mo)
+TENTATIVES = 6  # Nombre maximal de tentatives par fichier
+DELAI_BASE = 1.0  # Délai (s) avant la 2e tentative, doublé ensuite (avec gigue)
+DELAI_MAX = 60.0
+TIMEOUT = (10, 60)  # (connexion, lecture) en secondes
+TYPES_ACCEPTES = ("netcdf", "application/octet-stream")
+
+
+def configurer_session(connexions):
     """
-    Fonction de téléchargement d'un fichier. 
-    Vérifie si le fichier existe déjà et si le fichier est valide avant de télécharger.
+    Pool de connexions borné à `connexions` : au-delà, les threads attendent une connexion libre.
     """
+    adaptateur = HTTPAdapter(pool_connections=4, pool_maxsize=connexions, pool_block=True)
+    session.mount("https://", adaptateur)
+    session.mount("http://", adaptateur)
+
+
+def _taille_totale(r):
+    """
+    Taille complète du fichier d'après la réponse (Content-Range en 206, Content-Length en 200).
+    """
+    if r.status_code == 206 and "/" in r.headers.get("Content-Range", ""):
+        total = r.headers["Content-Range"].rsplit("/", 1)[1]
+        return int(total) if total.isdigit() else None
+    longueur = r.headers.get("Content-Length")
+    return int(longueur) if longueur and longueur.isdigit() else None
+
+
+def _tentative(url, partiel):
+    """
+    Une tentative de transfert vers `partiel`, reprise à sa taille actuelle.
+    Retourne (complet, message).
+    """
+    deja = os.path.getsize(partiel) if os.path.exists(partiel) else 0
+    entetes = {"Range": f"bytes={deja}-"} if deja else {}
+    with session.get(url, stream=True, timeout=TIMEOUT, allow_redirects=True, headers=entetes) as r:
+        if r.status_code == 416:
+            # Plage non satisfaisable : le .part contient déjà tout le fichier (ou est invalide)
+            total = r.headers.get("Content-Range", "").rsplit("/", 1)[-1]
+            if total.isdigit() and int(total) == deja:
+                return True, ""
+            os.remove(partiel)
+            return False, "Fichier partiel invalide, reprise du début"
+        if r.status_code not in (200, 206):
+            raise requests.HTTPError(f"Erreur {r.status_code}", response=r)
+        content_type = r.headers.get("Content-Type", "")
+        if not any(t in content_type.lower() for t in TYPES_ACCEPTES):
+            raise ValueError(f"Mauvais type de fichier : {content_type}")
+
+        # 200 malgré le Range : le serveur renvoie tout le fichier, on repart de zéro
+        mode = "ab" if r.status_code == 206 else "wb"
+        total = _taille_totale(r)
+        with open(partiel, mode) as f:
+            for bloc in r.iter_content(TAILLE_BLOC):
+                f.write(bloc)
+    taille = os.path.getsize(partiel)
+    if total is not None and taille != total:
+        return False, f"Transfert interrompu ({taille}/{total} octets)"
+    return True, ""
+
+
+def telecharger_fichier(url, destination, tentatives=TENTATIVES, delai_base=DELAI_BASE, verbose=True):
+    """
+    Fonction de téléchargement d'un fichier.
+    Le transfert se fait dans `destination + ".part"`, repris par requête Range après une coupure
+    (y compris d'une exécution précédente), avec attente exponentielle entre les tentatives.
+    Le fichier n'apparaît sous son nom final qu'une fois complet : un fichier présent est valide.
+    Retourne True si le fichier est présent et complet (octets et durée : telecharger_fichier_bilan).
+    """
+    return telecharger_fichier_bilan(url, destination, tentatives, delai_base, verbose)[0]
+
+
+def telecharger_fichier_bilan(url, destination, tentatives=TENTATIVES, delai_base=DELAI_BASE, verbose=True):
+    """
+    Comme telecharger_fichier, mais retourne (succès, octets reçus, durée en secondes).
+    """
+    nom = os.path.basename(destination)
     # Vérification si le fichier existe déjà
     if os.path.exists(destination):
-        print(f" Déjà présent : {os.path.basename(destination)}")
-        return True
+        if verbose:
+            print(f" Déjà présent : {nom}")
+        return True, 0, 0.0
 
-    print(f" Téléchargement : {os.path.basename(destination)}")
-    try:
-        r = session.get(url, stream=True, timeout=30, allow_redirects=True)
-        content_type = r.headers.get("Content-Type", "")
+    partiel = destination + ".part"
+    # Octets déjà reçus lors d'une exécution précédente : exclus du débit
+    initial = os.path.getsize(partiel) if os.path.exists(partiel) else 0
+    t0 = time.perf_counter()
+    for essai in range(tentatives):
+        try:
+            complet, message = _tentative(url, partiel)
+            if complet:
+                os.replace(partiel, destination)
+                duree = time.perf_counter() - t0
+                recus = os.path.getsize(destination) - initial
+                if verbose:
+                    print(f" Fichier valide : {nom} ({recus / 1e6:.1f} Mo en {duree:.1f} s, "
+                          f"{recus / 1e6 / max(duree, 1e-9):.2f} Mo/s)")
+                return True, recus, duree
+        except requests.HTTPError as e:
+            message = str(e)
+            # Erreurs client définitives (404, 403...) : inutile d'insister
+            if e.response is not None and 400 <= e.response.status_code < 500 and e.response.status_code != 429:
+                break
+        except ValueError as e:
+            message = str(e)
+            break
+        except (requests.RequestException, OSError) as e:
+            message = str(e)
+        if essai + 1 < tentatives:
+            attente = min(DELAI_MAX, delai_base * 2 ** essai) * random.uniform(0.5, 1.5)
+            if verbose:
+                print(f" {nom} : {message} — nouvelle tentative dans {attente:.1f} s")
+            time.sleep(attente)
+
+    if verbose:
+        print(f" Problème avec {nom} → {message}")
+    recus = (os.path.getsize(partiel) if os.path.exists(partiel) else 0) - initial
+    return False, max(recus, 0), time.perf_counter() - t0
 
-        if r.status_code == 200 and ("netcdf" in content_type.lower() or "application/octet-stream" in content_type.lower()):
-            with open(destination, "wb") as f:
-                for chunk in r.iter_content(8192):
-                    f.write(chunk)
-            print(f" Fichier valide : {os.path.basename(destination)}")
-            return True
-        else:
-            print(f" Erreur {r.status_code} - Mauvais type de fichier : {content_type}")
-            return False
-
-    except Exception as e:
-        print(f" Problème avec {os.path.basename(destination)} → {e}")
-        return False
+
+def telecharger_fichiers(urls, dossier=download_folder, workers=4, tentatives=TENTATIVES,
+                         delai_base=DELAI_BASE, verbose=True):
+    """
+    Télécharge les `urls` dans `dossier` sur `workers` threads (autant de connexions au plus).
+    Retourne la liste des (nom de fichier, succès, octets reçus, durée).
+    """
+    configurer_session(workers)
+    bilan = []
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futurs = {pool.submit(telecharger_fichier_bilan, url, os.path.join(dossier, os.path.basename(url)),
+                              tentatives, delai_base, verbose): os.path.basename(url) for url in urls}
+        for futur in as_completed(futurs):
+            bilan.append((futurs[futur],) + tuple(futur.result()))
+    duree = time.perf_counter() - t0
+    octets = sum(b[2] for b in bilan)
+    n_ok = sum(b[1] for b in bilan)
+    print(f" {n_ok}/{len(bilan)} fichiers, {octets / 1e6:.1f} Mo en {duree:.0f} s "
+          f"({octets / 1e6 / max(duree, 1e-9):.2f} Mo/s)")
+    return bilan
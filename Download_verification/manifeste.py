@@ -0,0 +1,182 @@
+# manifeste.py
+"""
+Manifeste SQLite des fichiers vérifiés (taille, date de modification, empreinte, fraction de
+pixels valides, statut) : une nouvelle vérification n'inspecte que les fichiers nouveaux ou modifiés.
+Un fichier de même taille dont seule la date de modification a changé (copie, touch) garde son
+statut si son empreinte est inchangée.
+L'inspection lit les métadonnées et un échantillon de fenêtres, pas la grille complète ; avec un
+masque océan statique, les fenêtres entièrement à terre ne sont pas lues (comptées sans pixel
+valide). La fraction de pixels valides porte toujours sur tous les pixels de la grille.
+Auteur : Marc Francescon
+Date : Avril 2025
+"""
+
+import os
+import hashlib
+import sqlite3
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import netCDF4
+
+OCTETS_EMPREINTE = 1 << 16  # Début et fin du fichier hachés (64 Ko chacun)
+FENETRES = 8  # Échantillon : grille de 8 x 8 fenêtres ...
+TAILLE_FENETRE = 32  # ... de 32 x 32 pixels
+MARGE_ECHANTILLON = 5  # L'échantillon ne tranche seul qu'au-delà de 5 fois le seuil
+
+_MASQUE = {}  # Masque océan installé une fois par processus d'inspection
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fichiers (
+    nom TEXT PRIMARY KEY,
+    taille INTEGER,
+    mtime REAL,
+    empreinte TEXT,
+    fraction_valide REAL,
+    statut TEXT,
+    message TEXT,
+    verifie_le TEXT
+)
+"""
+
+
+def empreinte(chemin, taille):
+    """
+    Empreinte blake2b de la taille et des premiers / derniers octets du fichier.
+    """
+    h = hashlib.blake2b(str(taille).encode(), digest_size=16)
+    with open(chemin, "rb") as f:
+        h.update(f.read(OCTETS_EMPREINTE))
+        if taille > OCTETS_EMPREINTE:
+            f.seek(max(OCTETS_EMPREINTE, taille - OCTETS_EMPREINTE))
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def _valides(tableau):
+    tableau = np.ma.masked_invalid(tableau)
+    return tableau.size - np.ma.count_masked(tableau)
+
+
+def _installer_masque(masque):
+    _MASQUE["ocean"] = masque
+
+
+def fraction_echantillon(var, fenetres=FENETRES, taille=TAILLE_FENETRE, masque=None):
+    """
+    Fraction de pixels valides (ni _FillValue, ni NaN) sur une grille de fenêtres réparties sur
+    les deux dernières dimensions : quelques chunks lus au lieu de la grille entière.
+    Avec `masque` (nlat, nlon), les fenêtres sans aucun pixel du masque ne sont pas lues et
+    comptent comme sans pixel valide : l'estimation ne peut que baisser (lecture complète).
+    """
+    nlat, nlon = var.shape[-2:]
+    tete = (0,) * (var.ndim - 2)
+    i0s = np.unique(np.linspace(0, max(nlat - taille, 0), fenetres).astype(int))
+    j0s = np.unique(np.linspace(0, max(nlon - taille, 0), fenetres).astype(int))
+    n_valides = n_total = 0
+    for i0 in i0s:
+        for j0 in j0s:
+            fenetre = (slice(i0, i0 + taille), slice(j0, j0 + taille))
+            n_total += (min(i0 + taille, nlat) - i0) * (min(j0 + taille, nlon) - j0)
+            if masque is None or masque[fenetre].any():
+                n_valides += _valides(var[tete + fenetre])
+    return n_valides / max(n_total, 1)
+
+
+def inspecter_fichier(chemin, variables, ndim=None, taille_min=0, seuil=0.0, masque=None):
+    """
+    Vérifie un fichier NetCDF : taille minimale, ouverture, présence (et nombre de dimensions)
+    des `variables`, fraction de pixels valides. Le fichier est incomplet si la fraction est
+    strictement sous `seuil` ou nulle. Si l'échantillon n'est pas au-delà de MARGE_ECHANTILLON fois
+    le seuil (ou s'il est vide pour un seuil nul), la grille complète est lue pour trancher.
+    `masque` (masque océan de la grille, ou celui installé dans le processus) n'allège que
+    l'échantillon ; il est ignoré pour un fichier d'une autre grille.
+    Retourne (empreinte, fraction_valide, statut, message), statut parmi valide / incomplet / endommage.
+    """
+    if masque is None:
+        masque = _MASQUE.get("ocean")
+    taille = os.path.getsize(chemin)
+    signature = empreinte(chemin, taille)
+    if taille < taille_min:
+        return signature, None, "incomplet", "Taille insuffisante"
+    try:
+        with netCDF4.Dataset(chemin) as nc:
+            for nom in variables:
+                if nom not in nc.variables or (ndim is not None and nc[nom].ndim != ndim):
+                    return signature, None, "incomplet", f"Variable manquante ou mauvaise dimension : {nom}"
+            nc.set_auto_scale(False)
+            if masque is not None and masque.shape != nc[variables[0]].shape[-2:]:
+                masque = None
+            fraction = fraction_echantillon(nc[variables[0]], masque=masque)
+            if fraction <= seuil * MARGE_ECHANTILLON:
+                fraction = max(_valides(nc[nom][:]) / nc[nom].size for nom in variables)
+    except Exception as e:
+        return signature, None, "endommage", str(e)
+    if fraction == 0 or fraction < seuil:
+        return signature, fraction, "incomplet", "Pas assez de pixels valides"
+    return signature, fraction, "valide", ""
+
+
+def ouvrir_manifeste(chemin):
+    conn = sqlite3.connect(chemin)
+    conn.execute(SCHEMA)
+    return conn
+
+
+def verifier_dossier(dossier, chemin_manifeste, variables, ndim=None, taille_min=0, seuil=0.0,
+                     extension=".nc", workers=None, masque=None):
+    """
+    Met à jour le manifeste de `dossier` et retourne {nom: (taille, mtime, empreinte, fraction, statut, message)}.
+    Seuls les fichiers absents du manifeste, ou dont la taille ou la date de modification a changé,
+    sont inspectés (en parallèle sur `workers` processus) ; si seule la date a changé et que
+    l'empreinte est identique, le statut est conservé. Les fichiers disparus sont retirés.
+    `masque` : masque océan statique de la grille (voir inspecter_fichier).
+    """
+    presents = {e.name: (e.stat().st_size, e.stat().st_mtime)
+                for e in os.scandir(dossier) if e.is_file() and e.name.endswith(extension)}
+
+    with ouvrir_manifeste(chemin_manifeste) as conn:
+        connus = {nom: ligne for nom, *ligne in conn.execute(
+            "SELECT nom, taille, mtime, empreinte, fraction_valide, statut, message FROM fichiers")}
+        disparus = [nom for nom in connus if nom not in presents]
+        conn.executemany("DELETE FROM fichiers WHERE nom = ?", [(nom,) for nom in disparus])
+
+        modifies = [nom for nom, (taille, mtime) in presents.items()
+                    if nom not in connus or tuple(connus[nom][:2]) != (taille, mtime)]
+        # Même taille, date changée : empreinte comparée avant toute inspection
+        retouches = [nom for nom in modifies if nom in connus and connus[nom][0] == presents[nom][0]
+                     and empreinte(os.path.join(dossier, nom), presents[nom][0]) == connus[nom][2]]
+        conn.executemany("UPDATE fichiers SET mtime = ? WHERE nom = ?",
+                         [(presents[nom][1], nom) for nom in retouches])
+        a_inspecter = sorted(set(modifies) - set(retouches))
+        workers = workers or os.cpu_count() or 1
+        chemins = [os.path.join(dossier, nom) for nom in a_inspecter]
+        args = (variables, ndim, taille_min, seuil)
+        if workers == 1 or len(chemins) < 2:
+            resultats = [inspecter_fichier(c, *args, masque) for c in chemins]
+        else:
+            # Masque transmis une fois par processus, pas avec chaque fichier
+            with ProcessPoolExecutor(workers, initializer=_installer_masque, initargs=(masque,)) as pool:
+                resultats = list(pool.map(inspecter_fichier, chemins, *([a] * len(chemins) for a in args),
+                                          chunksize=16))
+
+        maintenant = datetime.now().isoformat(timespec="seconds")
+        conn.executemany(
+            "INSERT OR REPLACE INTO fichiers VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(nom,) + presents[nom] + res + (maintenant,) for nom, res in zip(a_inspecter, resultats)])
+        etat = {nom: tuple(ligne) for nom, *ligne in conn.execute(
+            "SELECT nom, taille, mtime, empreinte, fraction_valide, statut, message FROM fichiers")}
+    conn.close()
+    print(f" Manifeste : {len(a_inspecter)} fichiers inspectés, {len(presents) - len(a_inspecter)} inchangés "
+          f"(dont {len(retouches)} de même empreinte), {len(disparus)} disparus")
+    return etat
+
+
+def oublier(chemin_manifeste, noms):
+    """
+    Retire des fichiers du manifeste (après suppression ou régénération).
+    """
+    with ouvrir_manifeste(chemin_manifeste) as conn:
+        conn.executemany("DELETE FROM fichiers WHERE nom = ?", [(nom,) for nom in noms])
+    conn.close()
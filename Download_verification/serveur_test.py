@@ -0,0 +1,154 @@
+# serveur_test.py
+"""
+Serveur HTTP local simulant le serveur de données : fichiers NetCDF synthétiques, requêtes Range,
+coupures de connexion, réponses lentes et erreurs 503 injectées au hasard.
+Lancé directement, il vérifie le téléchargeur (download_function) contre ces pannes.
+Auteur : Marc Francescon
+Date : Avril 2025
+"""
+
+import os
+import sys
+import time
+import random
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+import xarray as xr
+
+BLOC_ENVOI = 64 * 1024
+
+
+def creer_fichiers_synthetiques(dossier, n=8, shape=(240, 480), graine=0):
+    """
+    Écrit `n` fichiers L3m chlor_a synthétiques dans `dossier` ; retourne leurs noms.
+    """
+    os.makedirs(dossier, exist_ok=True)
+    rng = np.random.default_rng(graine)
+    lat = np.linspace(90, -90, shape[0], dtype=np.float32)
+    lon = np.linspace(-180, 180, shape[1], dtype=np.float32)
+    noms = []
+    for k in range(n):
+        chla = rng.lognormal(-1.5, 1.0, shape).astype(np.float32)
+        chla[rng.random(shape) < 0.4] = np.nan
+        nom = f"AQUA_MODIS.2003{1 + k // 28:02d}{1 + k % 28:02d}.L3m.DAY.CHL.chlor_a.4km.nc"
+        xr.Dataset({"chlor_a": (("lat", "lon"), chla)}, coords={"lat": lat, "lon": lon}).to_netcdf(
+            os.path.join(dossier, nom))
+        noms.append(nom)
+    return noms
+
+
+def serveur(dossier, proba_coupure=0.3, proba_lent=0.2, proba_erreur=0.1, lenteur=0.02, graine=None):
+    """
+    Serveur (non démarré) des fichiers de `dossier` sur un port libre de 127.0.0.1.
+    Chaque réponse peut être une erreur 503, être ralentie (`lenteur` s par bloc) ou coupée
+    au milieu du transfert, selon les probabilités données.
+    """
+    rng = random.Random(graine)
+    verrou = threading.Lock()
+
+    def tirage():
+        with verrou:
+            return rng.random(), rng.random(), rng.random(), rng.random()
+
+    class Gestionnaire(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            chemin = os.path.join(dossier, os.path.basename(self.path))
+            if not os.path.isfile(chemin):
+                self.send_error(404)
+                return
+            p_erreur, p_lent, p_coupure, fraction = tirage()
+            if p_erreur < proba_erreur:
+                self.send_response(503)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            with open(chemin, "rb") as f:
+                donnees = f.read()
+            total = len(donnees)
+            debut = 0
+            plage = self.headers.get("Range")
+            if plage:
+                debut = int(plage.split("=")[1].split("-")[0])
+                if debut >= total:
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{total}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {debut}-{total - 1}/{total}")
+            else:
+                self.send_response(200)
+            self.send_header("Content-Type", "application/x-netcdf")
+            self.send_header("Content-Length", str(total - debut))
+            self.end_headers()
+
+            # Coupure : n'envoie qu'une fraction du reste puis ferme la connexion
+            fin = debut + int(fraction * (total - debut)) if p_coupure < proba_coupure else total
+            for i in range(debut, fin, BLOC_ENVOI):
+                self.wfile.write(donnees[i:min(i + BLOC_ENVOI, fin)])
+                if p_lent < proba_lent:
+                    time.sleep(lenteur)
+            if fin < total:
+                self.close_connection = True
+
+    return ThreadingHTTPServer(("127.0.0.1", 0), Gestionnaire)
+
+
+def verifier_telechargeur(n=8, workers=4, proba_coupure=0.5, proba_lent=0.3, proba_erreur=0.2):
+    """
+    Télécharge `n` fichiers depuis le serveur local avec pannes injectées et vérifie que
+    chaque fichier reçu est identique à l'original et qu'aucun .part ne subsiste.
+    Un transfert interrompu lors d'une exécution précédente (.part existant) doit être repris.
+    """
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from download_function import telecharger_fichiers
+
+    with tempfile.TemporaryDirectory() as source, tempfile.TemporaryDirectory() as cible:
+        noms = creer_fichiers_synthetiques(source, n)
+        # Transfert laissé à moitié par une exécution précédente
+        with open(os.path.join(source, noms[0]), "rb") as f:
+            moitie = f.read()
+        with open(os.path.join(cible, noms[0] + ".part"), "wb") as f:
+            f.write(moitie[:len(moitie) // 2])
+
+        httpd = serveur(source, proba_coupure, proba_lent, proba_erreur, graine=1)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{httpd.server_address[1]}/"
+        try:
+            bilan = telecharger_fichiers([base + nom for nom in noms], cible, workers=workers,
+                                         tentatives=20, delai_base=0.05, verbose=False)
+        finally:
+            httpd.shutdown()
+
+        echecs = [nom for nom, ok, _, _ in bilan if not ok]
+        differents = []
+        for nom in noms:
+            chemin = os.path.join(cible, nom)
+            if not os.path.exists(chemin):
+                differents.append(nom)
+                continue
+            with open(os.path.join(source, nom), "rb") as a, open(chemin, "rb") as b:
+                if a.read() != b.read():
+                    differents.append(nom)
+        restes = [f for f in os.listdir(cible) if f.endswith(".part")]
+        reprise = dict((nom, octets) for nom, _, octets, _ in bilan)[noms[0]] < len(moitie)
+
+    print(f" Échecs : {echecs or 'aucun'}")
+    print(f" Fichiers différents de l'original : {differents or 'aucun'}")
+    print(f" Fichiers .part restants : {restes or 'aucun'}")
+    print(f" Reprise du .part existant : {'oui' if reprise else 'non'}")
+    return not (echecs or differents or restes) and reprise
+
+
+if __name__ == "__main__":
+    sys.exit(0 if verifier_telechargeur() else 1)
@@ -7,19 +7,27 @@ Date : Avril 2025
 """
 import os
 import re
-import numpy as np
-import xarray as xr
 from datetime import datetime, timedelta
-from tqdm import tqdm
 from pathlib import Path
 import logging
+import sys
 from download_function import telecharger_fichier
+from manifeste import verifier_dossier, oublier
+
+sys.path.append(os.path.abspath(".."))
+
+from chlorindex.masque_ocean import lire_masque_ocean
 
 # === Paramètres ===
 download_folder = "/Users/marcfrancescon/Desktop/chla_2003_2013"
 url_file = "/Users/marcfrancescon/Desktop/lien_chla_2003_2013.txt"
 TAILLE_MIN = 1_000_000
 variable = "chlor_a"
+manifeste = os.path.join(download_folder, "manifeste_chla.sqlite")  # Fichiers déjà vérifiés
+# Masque océan de run_index.py --masque-ocean (optionnel, ex. <download_folder>/masque_ocean.nc) :
+# n'accélère que l'échantillonnage, la fraction valide porte sur toute la grille
+chemin_masque = None
+masque = lire_masque_ocean(chemin_masque)[0] if chemin_masque else None
 
 # === Logging ===
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
@@ -48,32 +56,17 @@ for f in fichiers:
         else:
             fichiers_par_date[d] = f
 
-# === Vérification des fichiers ===
-for f in tqdm(fichiers_par_date.values(), desc="Vérification des fichiers téléchargés"):
-    chemin = Path(download_folder) / f
-    try:
-        if os.path.getsize(chemin) < TAILLE_MIN:
-            incomplets.append(f)
-            continue
-
-        ds = xr.open_dataset(chemin, engine="netcdf4")
-        if variable not in ds:
-            incomplets.append(f)
-            ds.close()
-            continue
-
-        array = ds[variable].values
-        ds.close()
-        ratio_valid = 1 - np.isnan(array).mean()
-
-        if ratio_valid < 0.01:
-            incomplets.append(f)
-        else:
-            valides.append(f)
-
-    except Exception as e:
+# === Vérification des fichiers (seuls les fichiers nouveaux ou modifiés sont inspectés) ===
+etat = verifier_dossier(download_folder, manifeste, [variable], taille_min=TAILLE_MIN, seuil=0.01, masque=masque)
+for f in fichiers_par_date.values():
+    statut, message = etat[f][4], etat[f][5]
+    if statut == "valide":
+        valides.append(f)
+    elif statut == "incomplet":
+        incomplets.append(f)
+    else:
         endommages.append(f)
-        logging.error(f" Erreur lors de l'ouverture de {f} : {e}")
+        logging.error(f" Erreur lors de l'ouverture de {f} : {message}")
 
 # === Vérifier les dates manquantes ===
 dates_valides = []
@@ -104,6 +97,7 @@ for f in doublons + incomplets + endommages:
         logging.info(f"🗑 Fichier supprimé : {f}")
     except Exception as e:
         logging.warning(f"⚠️ Erreur lors de la suppression de {f} : {e}")
+oublier(manifeste, doublons + incomplets + endommages)
 
 # === Reconstruire l'état du dossier ===
 fichiers_restants = sorted([f for f in os.listdir(download_folder) if f.endswith(".nc")])
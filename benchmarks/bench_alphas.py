@@ -0,0 +1,129 @@
+# bench_alphas.py
+"""
+Banc d'essai de l'évaluation de plusieurs alpha en une passe : temps de calc_index_optim avec
+une liste d'alpha contre un appel par alpha, nombre de couples (r1, alpha) et de disques distincts
+réellement calculés, et identité des sorties avec le calcul alpha par alpha (champ synthétique).
+Vérifie d'abord, sur les trois moteurs, les alpha proches de 1 (disque r2 égal au disque r1,
+anneau vide) : sommes et effectifs comparés au moteur "cordes", exact.
+Auteur : Marc Francescon
+Date : Avril 2025
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chlorindex.core import (
+    _cordes,
+    _convolutions_cordes,
+    _convolutions_fft,
+    _convolutions_spectrales,
+    calc_index_optim,
+    precompute_masques,
+    precompute_spectres,
+)
+from chlorindex.config import ALPHA, R1_LIST
+from synthetique import champ_synthetique
+
+LISTES_ALPHA = {
+    "ALPHA": [ALPHA],
+    "1.5-2.0": [1.5, 1.8, 2.0],
+    "1.5-3.0": [1.5, 1.8, 2.0, 2.5, 3.0],
+}
+
+ALPHAS_PETITS = (1.0, 1.1, 1.15)  # Disque r2 égal au disque r1 pour tout ou partie de R1_LIST
+MOTEURS = ("cordes", "spectral", "fft")
+
+
+def verifier_petits_alpha(shape=(120, 240)):
+    """
+    Pour chaque alpha de ALPHAS_PETITS et chaque moteur : sommes et effectifs intérieurs et
+    extérieurs égaux (à l'arrondi des FFT près) à ceux du moteur "cordes", et calc_index_optim
+    exécuté avec cet alpha seul puis avec ALPHA. Retourne la liste des échecs (alpha, moteur, raison).
+    """
+    chla = champ_synthetique(shape, graine=0)
+    masque_valide = ~np.isnan(chla)
+    chla0 = np.where(masque_valide, chla, 0)
+    echecs = []
+    for alpha in ALPHAS_PETITS:
+        masques_cache = precompute_masques(R1_LIST, alpha)
+        reference = list(_convolutions_cordes(chla0, masque_valide, R1_LIST, masques_cache))
+        convolutions = {
+            "cordes": reference,
+            "spectral": _convolutions_spectrales(chla0, masque_valide.astype(chla.dtype), R1_LIST,
+                                                 precompute_spectres(shape, R1_LIST, alpha, masques_cache, chla.dtype)),
+            "fft": _convolutions_fft(chla0, masque_valide.astype(float), R1_LIST, masques_cache),
+        }
+        for moteur in MOTEURS:
+            try:
+                for ref, conv in zip(reference, convolutions[moteur]):
+                    sommes = all(np.allclose(ref[k], conv[k], atol=1e-2) for k in (1, 3))
+                    effectifs = all(np.array_equal(ref[k], np.rint(conv[k])) for k in (2, 4))
+                    if not (sommes and effectifs):
+                        echecs.append((alpha, moteur, f"convolutions du rayon {ref[0]:g}"))
+                        break
+                seul = calc_index_optim(chla, R1_LIST, alpha=alpha, moteur=moteur, reduction="flux")
+                ensemble = calc_index_optim(chla, R1_LIST, alpha=[alpha, ALPHA], moteur=moteur)
+                if moteur == "cordes" and not all(np.array_equal(x, y, equal_nan=True)
+                                                  for x, y in zip(seul, ensemble[alpha])):
+                    echecs.append((alpha, moteur, "passe multi-alpha différente du calcul seul"))
+            except Exception as e:
+                echecs.append((alpha, moteur, repr(e)))
+    return echecs
+
+
+def disques_distincts(r1_vals, alphas):
+    """
+    Nombre de disques discrets distincts (rayons r1 et alpha * r1) des couples (r1, alpha).
+    """
+    disques = set()
+    for a in alphas:
+        for masq_ext, masq_int in precompute_masques(r1_vals, a).values():
+            disques |= {tuple(_cordes(masq_int)), tuple(_cordes(masq_int + masq_ext))}
+    return len(disques)
+
+
+def banc(chla, r1_vals, alphas, moteur):
+    """
+    Temps d'une passe multi-alpha et d'un appel par alpha, et identité des sorties.
+    """
+    t0 = time.perf_counter()
+    ensemble = calc_index_optim(chla, r1_vals, alpha=alphas, moteur=moteur)
+    t_ensemble = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    separes = {a: calc_index_optim(chla, r1_vals, alpha=a, moteur=moteur, reduction="flux") for a in alphas}
+    t_separes = time.perf_counter() - t0
+    identique = all(np.array_equal(x, y, equal_nan=True)
+                    for a in alphas for x, y in zip(ensemble[a], separes[a]))
+    return t_ensemble, t_separes, identique
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--nlat", type=int, default=1080)
+    parser.add_argument("--nlon", type=int)
+    # Pas de "fft" : une liste d'alpha est calculée par le moteur de choix_moteur
+    parser.add_argument("--moteurs", nargs="+", default=["cordes", "spectral"], choices=["cordes", "spectral"])
+    args = parser.parse_args()
+
+    echecs = verifier_petits_alpha()
+    for alpha, moteur, raison in echecs:
+        print(f" Échec alpha = {alpha:g}, moteur {moteur} : {raison}")
+    if echecs:
+        sys.exit(1)
+    print(f" Alpha proches de 1 ({', '.join(f'{a:g}' for a in ALPHAS_PETITS)}) : moteurs {', '.join(MOTEURS)} corrects")
+    chla = champ_synthetique((args.nlat, args.nlon or 2 * args.nlat), graine=0)
+
+    print(f"{'alphas':>9} {'couples':>8} {'disques':>8} {'moteur':>9} {'une passe':>10} {'par alpha':>10} "
+          f"{'accel.':>7} {'identique':>10}")
+    for nom, alphas in LISTES_ALPHA.items():
+        n_disques = disques_distincts(R1_LIST, alphas)
+        for moteur in args.moteurs:
+            t_ensemble, t_separes, identique = banc(chla, R1_LIST, alphas, moteur)
+            print(f"{nom:>9} {len(R1_LIST) * len(alphas):>8} {n_disques:>8} {moteur:>9} {t_ensemble:9.2f}s "
+                  f"{t_separes:9.2f}s {t_separes / t_ensemble:6.2f}x {'oui' if identique else 'non':>10}")
@@ -0,0 +1,93 @@
+# bench_moteurs.py
+"""
+Banc d'essai des moteurs de convolution de calc_index_optim (fft, spectral, cordes)
+sur plusieurs tailles de grille et listes de rayons.
+Auteur : Marc Francescon
+Date : Avril 2025
+"""
+
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chlorindex.core import (
+    precompute_masques,
+    precompute_spectres,
+    choix_moteur,
+    _convolutions_fft,
+    _convolutions_spectrales,
+    _convolutions_cordes,
+)
+from chlorindex.config import ALPHA, R1_LIST
+from synthetique import champ_synthetique, GRILLE_9KM
+
+MOTEURS = ("fft", "spectral", "cordes")
+GRILLES = [(240, 480), (480, 960), (1080, 2160), GRILLE_9KM]
+LISTES_RAYONS = {
+    "R1_LIST": R1_LIST,
+    "pas 0.25": np.arange(2, 7, 0.25),
+    "grands": np.arange(8, 16, 2.0),
+}
+
+
+def chrono_moteur(moteur, chla, r1_vals, alpha=ALPHA):
+    """
+    Temps (s) du calcul des sommes et effectifs pour tous les rayons, hors préparation des caches.
+    """
+    masques_cache = precompute_masques(r1_vals, alpha)
+    masque_valide = ~np.isnan(chla)
+    chla0 = np.where(masque_valide, chla, 0)
+
+    if moteur == "fft":
+        convolutions = _convolutions_fft(chla0, masque_valide.astype(float), r1_vals, masques_cache)
+    elif moteur == "spectral":
+        spectres_cache = precompute_spectres(chla.shape, r1_vals, alpha, masques_cache, chla.dtype)
+        convolutions = _convolutions_spectrales(chla0, masque_valide.astype(chla.dtype), r1_vals, spectres_cache)
+    else:
+        convolutions = _convolutions_cordes(chla0, masque_valide, r1_vals, masques_cache)
+
+    t0 = time.perf_counter()
+    for _ in convolutions:
+        pass
+    return time.perf_counter() - t0
+
+
+def banc(shape, r1_vals, moteurs=MOTEURS):
+    """
+    Temps de chaque moteur pour une grille et une liste de rayons.
+    Un processus par moteur : les pics mémoire ne se cumulent pas.
+    """
+    chla = champ_synthetique(shape)
+    temps = {}
+    for moteur in moteurs:
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            temps[moteur] = executor.submit(chrono_moteur, moteur, chla, r1_vals).result()
+    return temps
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--nlat", type=int, help="Grille unique (par défaut : balayage de GRILLES)")
+    parser.add_argument("--nlon", type=int)
+    parser.add_argument("--n-rayons", type=int, default=len(R1_LIST),
+                        help="Nombre de rayons de R1_LIST en grille unique (mémoire limitée)")
+    parser.add_argument("--moteurs", nargs="+", default=list(MOTEURS), choices=MOTEURS)
+    args = parser.parse_args()
+
+    if args.nlat:
+        cas = [((args.nlat, args.nlon or 2 * args.nlat), "R1_LIST", R1_LIST[:args.n_rayons])]
+    else:
+        cas = [(shape, nom, r1_vals) for shape in GRILLES for nom, r1_vals in LISTES_RAYONS.items()]
+
+    print(f"{'grille':>12} {'rayons':>9} " + " ".join(f"{m:>9}" for m in args.moteurs) + "   plus rapide / choix_moteur")
+    for shape, nom, r1_vals in cas:
+        temps = banc(shape, r1_vals, args.moteurs)
+        meilleur = min(temps, key=temps.get)
+        print(f"{shape[0]:>5}x{shape[1]:<6} {nom:>9} " + " ".join(f"{temps[m]:8.2f}s" for m in args.moteurs)
+              + f"   {meilleur} / {choix_moteur(r1_vals)}")
@@ -0,0 +1,95 @@
+# bench_recherche.py
+"""
+Banc d'essai des modes de recherche du meilleur rayon (exhaustive, exacte, grossiere) :
+temps de calc_index_tuiles et accord avec la recherche exhaustive, sur des champs synthétiques
+(et un fichier L3m réel avec --fichier), pour des grilles de rayons de plus en plus fines.
+Auteur : Marc Francescon
+Date : Avril 2025
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import xarray as xr
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chlorindex.core import PAS_GROSSIER, rayons_utiles
+from chlorindex.tuiles import calc_index_tuiles
+from chlorindex.config import R1_LIST
+from synthetique import champ_synthetique
+
+RECHERCHES = ("exhaustive", "exacte", "grossiere")
+LISTES_RAYONS = {
+    "R1_LIST": R1_LIST,
+    "pas 0.25": np.arange(2, 7, 0.25),
+    "pas 0.1": np.round(np.arange(2, 7, 0.1), 2),
+}
+
+
+def champs(shape, fichier=None):
+    """
+    Champs de test : synthétique standard, synthétique très nuageux et côtier, et, si donné,
+    le coin nord-ouest d'un fichier L3m réel à la même forme.
+    """
+    sortie = {
+        "synthetique": champ_synthetique(shape, graine=0),
+        "nuageux": champ_synthetique(shape, frac_terre=0.45, frac_nuages=0.6, graine=1),
+    }
+    if fichier:
+        with xr.open_dataset(fichier) as ds:
+            sortie[os.path.basename(fichier)] = ds["chlor_a"].values[:shape[0], :shape[1]].astype(np.float32)
+    return sortie
+
+
+def accord(reference, resultat):
+    """
+    Fraction des pixels de même r1_best, perte relative maximale de l'index, et identité stricte.
+    """
+    index_ref, r1_ref = reference[:2]
+    index, r1 = resultat[:2]
+    valide = ~np.isnan(index_ref)
+    meme_r1 = np.mean(r1_ref[valide] == r1[valide]) if valide.any() else 1.0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        perte = np.nanmax((index_ref - index) / index_ref) if valide.any() else 0.0
+    identique = all(np.array_equal(a, b, equal_nan=True) for a, b in zip(reference, resultat))
+    return meme_r1, perte, identique
+
+
+def banc(chla, r1_vals, pas_grossier=PAS_GROSSIER):
+    """
+    Temps et accord de chaque mode de recherche pour un champ et une liste de rayons.
+    """
+    resultats = {}
+    reference = None
+    for recherche in RECHERCHES:
+        t0 = time.perf_counter()
+        sortie = calc_index_tuiles(chla, r1_vals, recherche=recherche, pas_grossier=pas_grossier)
+        duree = time.perf_counter() - t0
+        if reference is None:
+            reference = sortie
+        resultats[recherche] = (duree,) + accord(reference, sortie)
+    return resultats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--nlat", type=int, default=1080)
+    parser.add_argument("--nlon", type=int)
+    parser.add_argument("--fichier", help="Fichier L3m chlor_a réel (optionnel)")
+    parser.add_argument("--pas-grossier", type=int, default=PAS_GROSSIER)
+    args = parser.parse_args()
+    shape = (args.nlat, args.nlon or 2 * args.nlat)
+
+    print(f"{'champ':>14} {'rayons':>9} {'utiles':>7} {'recherche':>11} {'temps':>8} {'accel.':>7} "
+          f"{'même r1':>9} {'perte max':>10} {'identique':>10}")
+    for nom_champ, chla in champs(shape, args.fichier).items():
+        for nom, r1_vals in LISTES_RAYONS.items():
+            resultats = banc(chla, r1_vals, args.pas_grossier)
+            t_ref = resultats["exhaustive"][0]
+            for recherche, (duree, meme_r1, perte, identique) in resultats.items():
+                print(f"{nom_champ:>14} {nom:>9} {len(rayons_utiles(r1_vals)):>7} {recherche:>11} {duree:7.2f}s "
+                      f"{t_ref / duree:6.2f}x {100 * meme_r1:8.3f}% {perte:10.2e} {'oui' if identique else 'non':>10}")
@@ -0,0 +1,69 @@
+# precision_float32.py
+"""
+Rapport de précision du calcul en float32 face au calcul de référence en float64,
+sur des champs synthétiques à la taille réelle de la grille L3m 4 km.
+Auteur : Marc Francescon
+Date : Avril 2025
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chlorindex.tuiles import calc_index_tuiles
+from synthetique import champ_synthetique, GRILLE_4KM
+
+SORTIES = ("index", "r1_best", "moy_int", "moy_ext")
+
+
+def ecart_relatif(ref, test, masque=True):
+    """
+    Écarts relatifs |test - ref| / |ref| sur les pixels valides des deux côtés (et dans `masque`).
+    """
+    ok = ~np.isnan(ref) & ~np.isnan(test) & (ref != 0) & masque
+    return np.abs(test[ok].astype(np.float64) - ref[ok]) / np.abs(ref[ok])
+
+
+def rapport(chla, moteur, workers=1):
+    """
+    Compare float32 et float64 pour un moteur ; affiche temps et accords sortie par sortie.
+    """
+    t0 = time.perf_counter()
+    ref = calc_index_tuiles(chla, moteur=moteur, precision="float64", workers=workers)
+    t_ref = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    test = calc_index_tuiles(chla, moteur=moteur, precision="float32", workers=workers)
+    t_test = time.perf_counter() - t0
+
+    print(f"\n Moteur {moteur} : float64 {t_ref:.1f} s, float32 {t_test:.1f} s (x{t_ref / t_test:.2f})")
+    # Les moyennes ne sont comparables qu'à rayon identique
+    meme_r1 = ref[1] == test[1]
+    for nom, r, t in zip(SORTIES, ref, test):
+        meme_nan = np.array_equal(np.isnan(r), np.isnan(t))
+        if nom == "r1_best":
+            ok = ~np.isnan(r) & ~np.isnan(t)
+            print(f"  {nom:>8} : NaN identiques {meme_nan}, r1 identique sur {100 * np.mean(r[ok] == t[ok]):.4f} % des pixels")
+        else:
+            e = ecart_relatif(r, t, meme_r1 if nom.startswith("moy") else True)
+            print(f"  {nom:>8} : NaN identiques {meme_nan}, écart relatif médian {np.median(e):.1e}, "
+                  f"p99.9 {np.quantile(e, 0.999):.1e}, max {e.max():.1e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--nlat", type=int, default=GRILLE_4KM[0])
+    parser.add_argument("--nlon", type=int, default=GRILLE_4KM[1])
+    parser.add_argument("--moteurs", nargs="+", default=["fft", "cordes", "spectral"],
+                        choices=["fft", "cordes", "spectral"])
+    parser.add_argument("--workers", type=int, default=1, help="Threads FFT")
+    args = parser.parse_args()
+
+    chla = champ_synthetique((args.nlat, args.nlon))
+    print(f"Grille {args.nlat}x{args.nlon}, {100 * np.mean(~np.isnan(chla)):.0f} % de pixels valides")
+    for moteur in args.moteurs:
+        rapport(chla, moteur, args.workers)
@@ -0,0 +1,219 @@
+# suite.py
+"""
+Suite de bancs d'essai reproductible : champs L3m synthétiques (9 km, 4 km, régions découpées),
+temps de precompute_masques, calc_index_optim et sauvegarde_index_netcdf_standard mesurés
+séparément, pic de mémoire résidente, résultats en JSON pour comparer deux commits.
+Ni réseau, ni archive MODIS : tout est généré à partir de graines fixes.
+
+Exemple :
+    python benchmarks/suite.py --sortie bench_avant.json
+    python benchmarks/suite.py --sortie bench_apres.json --comparer bench_avant.json
+Auteur : Marc Francescon
+Date : Avril 2025
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import resource
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chlorindex.core import calc_index_optim, precompute_masques, sauvegarde_index_netcdf_standard
+from chlorindex.config import ALPHA, R1_LIST
+from synthetique import GRILLE_4KM, GRILLE_9KM, champ_l3m, coordonnees_l3m, decoupe_region, tranches_region
+
+# Cas : (grille globale, région découpée ou None)
+CAS = {
+    "9km": (GRILLE_9KM, None),
+    "9km_atlantique_nord": (GRILLE_9KM, "atlantique_nord"),
+    "4km_mediterranee": (GRILLE_4KM, "mediterranee"),
+    "4km_benguela": (GRILLE_4KM, "benguela"),
+    "4km": (GRILLE_4KM, None),
+}
+ETAPES = ("precompute_masques", "calc_index_optim", "sauvegarde")
+JOUR = 15  # Jour de l'année des champs (hiver boréal : nuit polaire au nord)
+SEUIL_REGRESSION = 1.10  # Ralentissement relatif signalé par --comparer
+TEMPS_MIN = 0.01  # Durée (s) en deçà de laquelle une étape n'est pas comparée
+
+
+def pic_rss_mo():
+    """
+    Pic de mémoire résidente du processus depuis son démarrage, en Mo
+    (ru_maxrss est en octets sous macOS, en kilo-octets sous Linux).
+    """
+    pic = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pic / 1e6 if sys.platform == "darwin" else pic / 1e3
+
+
+def commit_git():
+    """
+    Commit courant du dépôt (suffixé de "+modifs" si l'arbre est modifié), ou None hors git.
+    """
+    racine = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=racine, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        modifie = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=racine,
+                                 capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("+modifs" if modifie else "")
+
+
+def preparer_champs(cas, dossier, graine=0):
+    """
+    Génère une fois par grille le champ global et enregistre le champ de chaque cas en .npy
+    (hors mesures). Retourne {nom: chemin}.
+    """
+    chemins = {}
+    globaux = {}
+    for nom, (grille, region) in cas.items():
+        if grille not in globaux:
+            globaux[grille] = champ_l3m(grille, jour=JOUR, graine=graine)
+        chla = globaux[grille] if region is None else decoupe_region(globaux[grille], region)
+        chemins[nom] = os.path.join(dossier, f"{nom}.npy")
+        np.save(chemins[nom], np.ascontiguousarray(chla))
+    return chemins
+
+
+def mesurer_cas(chemin, grille, region, options, repetitions):
+    """
+    Mesures d'un cas dans un processus neuf : temps (minimum sur les répétitions) et pic de
+    mémoire résidente après chaque étape.
+    """
+    chla = np.load(chemin)
+    lat, lon = coordonnees_l3m(grille)
+    if region is not None:
+        sl_lat, sl_lon = tranches_region(grille, region)
+        lat, lon = lat[sl_lat], lon[sl_lon]
+    r1_vals = np.asarray(options["r1_vals"])
+    mesures = {"shape": list(chla.shape), "fraction_valide": float(np.mean(~np.isnan(chla))),
+               "rss_initial_mo": pic_rss_mo(), "temps_s": {}, "pic_rss_mo": {}}
+
+    def calcul(x, masques_cache):
+        return calc_index_optim(x, r1_vals=r1_vals, masques_cache=masques_cache, moteur=options["moteur"],
+                                reduction=options["reduction"], precision=options["precision"],
+                                recherche=options["recherche"])
+
+    # Mise en route sur un petit extrait : imports paresseux et initialisations hors mesures
+    with tempfile.TemporaryDirectory() as dossier:
+        extrait = calcul(chla[:64, :64], precompute_masques(r1_vals, ALPHA))
+        sauvegarde_index_netcdf_standard(*extrait, lat[:64], lon[:64], "20030115", dossier)
+
+    def chrono(etape, fonction):
+        durees = []
+        for _ in range(repetitions):
+            t0 = time.perf_counter()
+            resultat = fonction()
+            durees.append(time.perf_counter() - t0)
+        mesures["temps_s"][etape] = min(durees)
+        mesures["pic_rss_mo"][etape] = pic_rss_mo()
+        return resultat
+
+    masques_cache = chrono("precompute_masques", lambda: precompute_masques(r1_vals, ALPHA))
+    resultats = chrono("calc_index_optim", lambda: calcul(chla, masques_cache))
+    with tempfile.TemporaryDirectory() as dossier:
+        chrono("sauvegarde", lambda: sauvegarde_index_netcdf_standard(
+            *resultats, lat, lon, "AQUA_MODIS.20030115.L3m.DAY.CHL.chlor_a.nc", dossier))
+        mesures["taille_fichier_mo"] = os.path.getsize(os.path.join(dossier, "Word_index_r1_20030115.nc")) / 1e6
+    return mesures
+
+
+def lancer_suite(cas=CAS, options=None, repetitions=3, graine=0):
+    """
+    Exécute tous les cas, chacun dans son propre processus (pics mémoire indépendants).
+    Retourne le dictionnaire écrit en JSON.
+    """
+    options = dict(dict(moteur="auto", reduction="flux", precision=None, recherche="exhaustive",
+                        r1_vals=[float(r) for r in R1_LIST]), **(options or {}))
+    rapport = {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit_git(),
+        "machine": {"plateforme": platform.platform(), "processeur": platform.processor(),
+                    "coeurs": os.cpu_count(), "python": platform.python_version(), "numpy": np.__version__},
+        "options": dict(options, repetitions=repetitions, graine=graine, jour=JOUR),
+        "cas": {},
+    }
+    with tempfile.TemporaryDirectory() as dossier:
+        chemins = preparer_champs(cas, dossier, graine)
+        for nom, (grille, region) in cas.items():
+            try:
+                with ProcessPoolExecutor(max_workers=1) as executor:
+                    mesures = executor.submit(mesurer_cas, chemins[nom], grille, region, options, repetitions).result()
+            except BrokenProcessPool:
+                # Processus tué (mémoire insuffisante le plus souvent) : le cas est noté, la suite continue
+                rapport["cas"][nom] = {"erreur": "processus interrompu (mémoire insuffisante ?)"}
+                print(f" {nom:>20} interrompu (mémoire insuffisante ?)")
+                continue
+            rapport["cas"][nom] = mesures
+            print(f" {nom:>20} {mesures['shape'][0]:>5}x{mesures['shape'][1]:<5} "
+                  + " ".join(f"{e} {mesures['temps_s'][e]:7.3f}s" for e in ETAPES)
+                  + f"  pic {max(mesures['pic_rss_mo'].values()):7.0f} Mo")
+    return rapport
+
+
+def comparer(ancien, nouveau, seuil=SEUIL_REGRESSION):
+    """
+    Compare deux rapports cas par cas et étape par étape ; retourne la liste des régressions
+    (nom, étape, rapport des temps) au-delà de `seuil`.
+    """
+    print(f" Comparaison {ancien.get('commit')} -> {nouveau.get('commit')}")
+    if ancien.get("machine") != nouveau.get("machine"):
+        print(" Attention : machines différentes")
+    regressions = []
+    for nom, mesures in nouveau["cas"].items():
+        ref = ancien["cas"].get(nom)
+        if ref is None or "erreur" in ref or "erreur" in mesures:
+            continue
+        for etape in ETAPES:
+            rapport = mesures["temps_s"][etape] / max(ref["temps_s"][etape], 1e-9)
+            pic = max(mesures["pic_rss_mo"].values()) / max(max(ref["pic_rss_mo"].values()), 1e-9)
+            # Étapes de quelques millisecondes : écarts dominés par le bruit, jamais signalés
+            regression = rapport > seuil and mesures["temps_s"][etape] > TEMPS_MIN
+            marque = "  <-- régression" if regression else ""
+            print(f" {nom:>20} {etape:>18} {ref['temps_s'][etape]:8.3f}s -> {mesures['temps_s'][etape]:8.3f}s "
+                  f"({rapport:5.2f}x, pic mémoire {pic:4.2f}x){marque}")
+            if regression:
+                regressions.append((nom, etape, rapport))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sortie", help="Fichier JSON des résultats (défaut : bench_<commit>.json)")
+    parser.add_argument("--cas", nargs="+", choices=list(CAS), default=list(CAS))
+    parser.add_argument("--repetitions", type=int, default=3)
+    parser.add_argument("--graine", type=int, default=0)
+    parser.add_argument("--moteur", default="auto", choices=["auto", "cordes", "spectral", "fft"])
+    parser.add_argument("--reduction", default="flux", choices=["pile", "flux"])
+    parser.add_argument("--precision", choices=["float32", "float64"])
+    parser.add_argument("--recherche", default="exhaustive", choices=["exhaustive", "exacte", "grossiere"])
+    parser.add_argument("--comparer", help="Rapport JSON de référence : signale les régressions")
+    parser.add_argument("--seuil", type=float, default=SEUIL_REGRESSION)
+    args = parser.parse_args()
+
+    options = dict(moteur=args.moteur, reduction=args.reduction, precision=args.precision, recherche=args.recherche)
+    rapport = lancer_suite({nom: CAS[nom] for nom in args.cas}, options, args.repetitions, args.graine)
+    sortie = args.sortie or f"bench_{rapport['commit'] or 'hors_git'}.json"
+    with open(sortie, "w") as f:
+        json.dump(rapport, f, indent=2)
+    print(f" Résultats écrits dans {sortie}")
+
+    if args.comparer:
+        with open(args.comparer) as f:
+            ancien = json.load(f)
+        if {k: v for k, v in ancien["options"].items() if k != "repetitions"} != \
+                {k: v for k, v in rapport["options"].items() if k != "repetitions"}:
+            print(" Attention : options de calcul différentes")
+        sys.exit(1 if comparer(ancien, rapport, args.seuil) else 0)
@@ -0,0 +1,113 @@
+# synthetique.py
+"""
+Génération de champs de chlorophylle synthétiques pour les bancs d'essai.
+Auteur : Marc Francescon
+Date : Avril 2025
+"""
+
+import numpy as np
+
+GRILLE_4KM = (4320, 8640)  # Grille L3m MODIS 4 km
+GRILLE_9KM = (2160, 4320)  # Grille L3m MODIS 9 km
+
+# Régions découpées dans la grille globale : (lat_min, lat_max, lon_min, lon_max)
+REGIONS = {
+    "mediterranee": (30.0, 46.0, -6.0, 36.0),
+    "benguela": (-35.0, -15.0, 5.0, 20.0),
+    "atlantique_nord": (40.0, 65.0, -60.0, -10.0),
+}
+ORBITES_PAR_JOUR = 14.5  # Passages MODIS Aqua par jour : bandes sans données entre fauchées
+ZENITH_MAX = 75.0  # Angle zénithal solaire (°) au-delà duquel la couleur de l'eau n'est pas restituée
+
+
+def _bruit_lisse(shape, echelle, rng):
+    """
+    Bruit gaussien filtré passe-bas (échelle de corrélation en pixels), normalisé.
+    """
+    ky = np.fft.fftfreq(shape[0])[:, None]
+    kx = np.fft.rfftfreq(shape[1])[None, :]
+    filtre = np.exp(-0.5 * (ky**2 + kx**2) * (2 * np.pi * echelle)**2).astype(np.float32)
+    bruit = rng.standard_normal(shape, dtype=np.float32)
+    champ = np.fft.irfft2(np.fft.rfft2(bruit) * filtre, s=shape).astype(np.float32)
+    champ -= champ.mean()
+    champ /= champ.std()
+    return champ
+
+
+def champ_synthetique(shape=GRILLE_4KM, frac_terre=0.3, frac_nuages=0.4, graine=0):
+    """
+    Champ de chlorophylle log-normal spatialement corrélé, avec terres et nuages en NaN.
+    """
+    rng = np.random.default_rng(graine)
+    chla = np.exp(0.8 * _bruit_lisse(shape, 20, rng) - 1.5).astype(np.float32)
+    terre = _bruit_lisse(shape, 200, rng)
+    nuages = _bruit_lisse(shape, 15, rng)
+    chla[terre > np.quantile(terre, 1 - frac_terre)] = np.nan
+    chla[nuages > np.quantile(nuages, 1 - frac_nuages)] = np.nan
+    return chla
+
+
+def coordonnees_l3m(shape=GRILLE_4KM):
+    """
+    Latitudes (90 -> -90) et longitudes (-180 -> 180) des centres de pixels d'une grille L3m.
+    """
+    nlat, nlon = shape
+    lat = (90 - (np.arange(nlat) + 0.5) * 180 / nlat).astype(np.float32)
+    lon = (-180 + (np.arange(nlon) + 0.5) * 360 / nlon).astype(np.float32)
+    return lat, lon
+
+
+def champ_l3m(shape=GRILLE_4KM, jour=180, frac_terre=0.3, frac_nuages=0.45, graine=0):
+    """
+    Champ journalier de chlorophylle imitant un L3m MODIS : structures multi-échelles et
+    enrichissement vers les hautes latitudes, terres fixes (même `graine`, tout `jour`),
+    nuit polaire selon le jour de l'année, bandes sans passage entre fauchées aux basses
+    latitudes et nuages de plusieurs échelles. Les échelles suivent la résolution :
+    un champ 9 km et un champ 4 km de même graine se ressemblent.
+    """
+    nlat, nlon = shape
+    echelle = nlon / 4320  # 1 à 9 km, ~2 à 4 km
+    lat, lon = coordonnees_l3m(shape)
+    rng_carte = np.random.default_rng(graine)
+    rng_jour = np.random.default_rng([graine, jour])
+
+    terre = _bruit_lisse(shape, 60 * echelle, rng_carte) + 0.5 * _bruit_lisse(shape, 12 * echelle, rng_carte)
+    log_chla = (0.6 * _bruit_lisse(shape, 25 * echelle, rng_jour) + 0.4 * _bruit_lisse(shape, 4 * echelle, rng_jour)
+                - 1.8 + 1.5 * np.abs(lat[:, None]) / 90)
+    chla = np.exp(log_chla).astype(np.float32)
+    del log_chla
+    chla[terre > np.quantile(terre[::8, ::8], 1 - frac_terre)] = np.nan
+    del terre
+
+    # Nuit polaire : soleil de midi trop bas
+    declinaison = 23.44 * np.sin(2 * np.pi * (jour - 80) / 365)
+    chla[np.abs(lat - declinaison) > ZENITH_MAX] = np.nan
+
+    # Bandes entre fauchées, larges à l'équateur, refermées vers 30° de latitude
+    periode = 360 / ORBITES_PAR_JOUR
+    largeur = np.maximum(0, 0.35 * periode * (1 - np.abs(lat) / 30))
+    phase = (lon[None, :] + 0.3 * lat[:, None] + jour * 7.3) % periode
+    chla[phase < largeur[:, None]] = np.nan
+
+    nuages = _bruit_lisse(shape, 15 * echelle, rng_jour) + 0.6 * _bruit_lisse(shape, 3 * echelle, rng_jour)
+    chla[nuages > np.quantile(nuages[::8, ::8], 1 - frac_nuages)] = np.nan
+    return chla
+
+
+def tranches_region(shape, region):
+    """
+    Tranches (lat, lon) d'une région (lat_min, lat_max, lon_min, lon_max), ou d'un nom de REGIONS,
+    dans une grille L3m globale de forme `shape`.
+    """
+    lat_min, lat_max, lon_min, lon_max = REGIONS[region] if isinstance(region, str) else region
+    lat, lon = coordonnees_l3m(shape)
+    i = np.flatnonzero((lat >= lat_min) & (lat <= lat_max))
+    j = np.flatnonzero((lon >= lon_min) & (lon <= lon_max))
+    return slice(i[0], i[-1] + 1), slice(j[0], j[-1] + 1)
+
+
+def decoupe_region(chla, region):
+    """
+    Sous-grille d'un champ global sur une région (voir tranches_region).
+    """
+    return chla[(Ellipsis,) + tranches_region(chla.shape[-2:], region)]
@@ -0,0 +1,171 @@
+# cache_rayons.py
+"""
+Cache disque des intermédiaires par rayon (moyennes intérieure/extérieure et effectifs valides)
+et balayage des paramètres de classement (PENAL_LAMBDA, R_CRIT, SEUIL_COUVERTURE) depuis ce cache.
+Auteur : Marc Francescon
+Date : Avril 2025
+"""
+
+import os
+import itertools
+
+import numpy as np
+
+from .core import precompute_masques, indice_rayon, _etat_flux, _maj_flux, _fin_flux
+from .config import ALPHA, R1_LIST, SEUIL_COUVERTURE, PENAL_LAMBDA, R_CRIT
+
+TAILLE_MAX_CACHE = 200e9  # Taille maximale du cache sur disque (octets)
+
+
+class CacheRayons:
+    """
+    Cache des intermédiaires par (date, alpha, r1), sous `racine/<date>/a<alpha>/r<r1>.npz`.
+    Seuls les pixels où une moyenne existe sont stockés (masque binaire compacté dans chaque
+    fichier), dans le type d'origine des tableaux pour que la relecture redonne exactement
+    le calcul direct. Au-delà de `taille_max` octets, les fichiers de rayon les moins récemment
+    utilisés sont supprimés.
+    """
+
+    def __init__(self, racine, taille_max=TAILLE_MAX_CACHE):
+        self.racine = racine
+        self.taille_max = taille_max
+        os.makedirs(racine, exist_ok=True)
+        # Inventaire {chemin: (taille, date d'utilisation)} des fichiers de rayon
+        self._fichiers = {}
+        for dossier, _, noms in os.walk(racine):
+            for nom in noms:
+                if nom.startswith("r") and nom.endswith(".npz"):
+                    chemin = os.path.join(dossier, nom)
+                    st = os.stat(chemin)
+                    self._fichiers[chemin] = (st.st_size, st.st_mtime)
+
+    def _dossier(self, date, alpha):
+        return os.path.join(self.racine, str(date), f"a{alpha:g}")
+
+    def _chemin(self, date, alpha, r1):
+        return os.path.join(self._dossier(date, alpha), f"r{r1:g}.npz")
+
+    def taille(self):
+        """
+        Taille totale (octets) des fichiers de rayon du cache.
+        """
+        return sum(taille for taille, _ in self._fichiers.values())
+
+    def contient(self, date, alpha, r1):
+        return self._chemin(date, alpha, r1) in self._fichiers
+
+    def ecrire(self, date, alpha, r1, moy_int, moy_ext, norm_int, norm_ext, evincer=True):
+        """
+        Enregistre les moyennes et effectifs (NaN si nuls) d'un rayon pour une date.
+        Avec `evincer=False`, la taille du cache n'est pas ramenée sous `taille_max` (voir completer).
+        """
+        os.makedirs(self._dossier(date, alpha), exist_ok=True)
+        valide = ~np.isnan(moy_int) | ~np.isnan(moy_ext)
+        chemin = self._chemin(date, alpha, r1)
+        _sauve_atomique(chemin, shape=np.array(valide.shape), bits=np.packbits(valide),
+                        moy_int=moy_int[valide], moy_ext=moy_ext[valide],
+                        n_int=norm_int[valide], n_ext=norm_ext[valide])
+        self._fichiers[chemin] = (os.path.getsize(chemin), os.path.getmtime(chemin))
+        if evincer:
+            self.evincer()
+
+    def lire(self, date, alpha, r1):
+        """
+        Relit (moy_int, moy_ext, norm_int, norm_ext) d'un rayon sur la grille complète.
+        """
+        chemin = self._chemin(date, alpha, r1)
+        sorties = []
+        with np.load(chemin) as z:
+            shape = tuple(z["shape"])
+            valide = np.unpackbits(z["bits"], count=int(np.prod(shape))).view(bool).reshape(shape)
+            for nom in ("moy_int", "moy_ext", "n_int", "n_ext"):
+                vecteur = z[nom]
+                grille = np.full(valide.shape, np.nan, dtype=vecteur.dtype)
+                grille[valide] = vecteur
+                sorties.append(grille)
+        os.utime(chemin)  # Date d'utilisation pour l'éviction
+        self._fichiers[chemin] = (self._fichiers.get(chemin, (os.path.getsize(chemin), 0))[0],
+                                  os.path.getmtime(chemin))
+        return tuple(sorties)
+
+    def evincer(self):
+        """
+        Supprime les fichiers de rayon les moins récemment utilisés jusqu'à repasser sous `taille_max`.
+        """
+        total = self.taille()
+        if total <= self.taille_max:
+            return
+        for chemin, (taille, _) in sorted(self._fichiers.items(), key=lambda kv: kv[1][1]):
+            if total <= self.taille_max:
+                break
+            try:
+                os.remove(chemin)
+            except FileNotFoundError:
+                pass
+            del self._fichiers[chemin]
+            total -= taille
+            # Dossiers alpha puis date vidés
+            dossier = os.path.dirname(chemin)
+            for d in (dossier, os.path.dirname(dossier)):
+                if not os.listdir(d):
+                    os.rmdir(d)
+
+    def completer(self, moyennes, r1_vals, a_calculer, date, alpha, masques_cache):
+        """
+        Parcourt les rayons de `r1_vals` dans l'ordre : les rayons de `a_calculer` sont pris du
+        générateur `moyennes` (et mis en cache), les autres relus depuis le cache.
+        Produit les mêmes tuples que core._moyennes.
+        L'éviction n'a lieu qu'une fois tous les rayons parcourus : elle ne peut pas supprimer
+        un rayon du jour qui reste à relire.
+        """
+        calcules = iter(moyennes)
+        for r1 in r1_vals:
+            masq_ext, masq_int = masques_cache[r1]
+            if r1 in a_calculer:
+                r1, moy_int, moy_ext, norm_int, norm_ext, n_int, n_ext = next(calcules)
+                self.ecrire(date, alpha, r1, moy_int, moy_ext, norm_int, norm_ext, evincer=False)
+                yield r1, moy_int, moy_ext, norm_int, norm_ext, n_int, n_ext
+            else:
+                moy_int, moy_ext, norm_int, norm_ext = self.lire(date, alpha, r1)
+                yield r1, moy_int, moy_ext, norm_int, norm_ext, np.sum(masq_int), np.sum(masq_ext)
+        self.evincer()
+
+
+def _sauve_atomique(chemin, **tableaux):
+    """
+    np.savez vers un fichier temporaire puis renommage : pas de fichier de cache tronqué.
+    """
+    temporaire = chemin + ".tmp.npz"
+    np.savez(temporaire, **tableaux)
+    os.replace(temporaire, chemin)
+
+
+def balayage_parametres(cache, date, penal_lambdas=(PENAL_LAMBDA,), r_crits=(R_CRIT,),
+                        seuils_couv=(SEUIL_COUVERTURE,), r1_vals=R1_LIST, alpha=ALPHA, masques_cache=None,
+                        dtype=None):
+    """
+    Reclasse les rayons pour toutes les combinaisons (penal_lambda, r_crit, seuil_couv)
+    directement depuis le cache, sans aucune convolution. Chaque rayon n'est lu qu'une fois.
+    Retourne {(penal_lambda, r_crit, seuil_couv): (index, r1_best, moy_int, moy_ext)}.
+    `dtype` est le type des sorties (celui de la chlorophylle d'entrée pour retrouver exactement
+    calc_index_optim) ; par défaut, celui des moyennes en cache.
+    """
+    if masques_cache is None:
+        masques_cache = precompute_masques(r1_vals, alpha)
+    manquants = [r1 for r1 in r1_vals if not cache.contient(date, alpha, r1)]
+    if manquants:
+        raise KeyError(f" Rayons absents du cache pour {date} (alpha={alpha:g}) : {manquants}")
+
+    combinaisons = list(itertools.product(penal_lambdas, r_crits, seuils_couv))
+    etats = {}
+    for r1 in r1_vals:
+        masq_ext, masq_int = masques_cache[r1]
+        moy_int, moy_ext, norm_int, norm_ext = cache.lire(date, alpha, r1)
+        for combinaison in combinaisons:
+            penal_lambda, r_crit, seuil_couv = combinaison
+            if combinaison not in etats:
+                etats[combinaison] = _etat_flux(moy_int.shape, dtype or moy_int.dtype, r1_vals)
+            idx_cand = indice_rayon(r1, moy_int, moy_ext, norm_int, norm_ext, np.sum(masq_int), np.sum(masq_ext),
+                                    seuil_couv, penal_lambda, r_crit)
+            _maj_flux(etats[combinaison], r1, idx_cand, moy_int, moy_ext)
+    return {combinaison: _fin_flux(etat) for combinaison, etat in etats.items()}
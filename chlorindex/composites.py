@@ -0,0 +1,292 @@
+# composites.py
+"""
+Composites temporels de l'indice spatial (8 jours, mensuels, climatologie mensuelle) construits
+en flux sur l'archive journalière ou annuelle : chaque jour n'est lu qu'une fois et replié dans
+des accumulateurs compacts par pixel (effectif, moyenne et variance de l'index par Welford,
+histogramme de r1_best, moyennes de moy_int et moy_ext). Le calcul est parallèle sur des blocs
+spatiaux ; les fichiers de composites contiennent les accumulateurs eux-mêmes et la liste des
+jours repliés par bloc, si bien qu'un jour nouveau s'ajoute sans recalculer la climatologie.
+
+Exemple :
+    python chlorindex/composites.py --archive ~/Monde_IE_2003_2013 --sortie ~/Monde_IE_composites
+Auteur : Marc Francescon
+Date : Avril 2025
+"""
+
+import os
+import sys
+import fcntl
+import argparse
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import netCDF4
+import xarray as xr
+from xarray.backends.locks import HDF5_LOCK
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chlorindex.extraction import lister_sources, _lire_source, _coordonnees
+from chlorindex.stockage import VARIABLES, NIVEAU_ZLIB, FILL_R1, code_r1
+from chlorindex.config import R1_LIST
+
+PERIODES = ("8jours", "mensuel", "climatologie")
+TAILLE_BLOC = (540, 1080)  # Bloc spatial d'un processus (~25 Mo par période ouverte sur la grille 4 km)
+
+
+def cle_periode(date_str, periode):
+    """
+    Clé du composite contenant le jour `date_str` (YYYYMMDD) : "2003J009" (8 jours, découpage
+    NASA recommençant au 1er janvier), "200301" (mensuel), "M01" (climatologie du mois).
+    """
+    if periode == "8jours":
+        jour = datetime.strptime(date_str, "%Y%m%d").timetuple().tm_yday
+        return f"{date_str[:4]}J{1 + 8 * ((jour - 1) // 8):03d}"
+    if periode == "mensuel":
+        return date_str[:6]
+    if periode == "climatologie":
+        return f"M{date_str[4:6]}"
+    raise ValueError(f" Période inconnue : {periode}")
+
+
+def chemin_composite(sortie, periode, cle):
+    return os.path.join(sortie, periode, f"Word_index_r1_{periode}_{cle}.nc")
+
+
+def replier(acc, jour, r1_vals=R1_LIST):
+    """
+    Ajoute un jour {index, r1_best, moy_int, moy_ext} (tableaux du bloc) aux accumulateurs.
+    Seuls les pixels où l'index existe comptent (les autres variables y existent aussi).
+    """
+    valide = np.isfinite(jour["index"])
+    n = acc["n"][valide] + np.uint16(1)
+    acc["n"][valide] = n
+    x = jour["index"][valide]
+    moyenne = acc["index"][valide]
+    ecart = x - moyenne
+    moyenne += ecart / n
+    acc["index"][valide] = moyenne
+    acc["index_m2"][valide] += ecart * (x - moyenne)
+    for nom in ("moy_int", "moy_ext"):
+        moyenne = acc[nom][valide]
+        acc[nom][valide] = moyenne + (jour[nom][valide] - moyenne) / n
+
+    # Histogramme : un seul incrément par pixel, l'indexation plate suffit
+    codes = code_r1(jour["r1_best"], np.asarray(r1_vals, dtype=jour["r1_best"].dtype))
+    pixels = np.flatnonzero(valide.ravel() & (codes.ravel() != FILL_R1))
+    acc["r1_compte"].reshape(-1)[codes.ravel()[pixels].astype(np.intp) * codes.size + pixels] += 1
+
+
+def _creer_composite(path, periode, cle, lat, lon, r1_vals, taille_bloc):
+    """
+    Crée le fichier d'un composite : accumulateurs nuls chunkés comme les blocs, et table des
+    jours repliés par bloc (dimension jour illimitée).
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    n_blocs = (-(-len(lat) // taille_bloc[0]), -(-len(lon) // taille_bloc[1]))
+    chunks = (min(taille_bloc[0], len(lat)), min(taille_bloc[1], len(lon)))
+    with netCDF4.Dataset(path + ".tmp", "w", format="NETCDF4") as nc:
+        nc.periode, nc.cle, nc.taille_bloc = periode, cle, np.asarray(taille_bloc, dtype=np.int32)
+        nc.createDimension("lat", len(lat))
+        nc.createDimension("lon", len(lon))
+        nc.createDimension("r1", len(r1_vals))
+        nc.createDimension("jour", None)
+        nc.createDimension("bloc_lat", n_blocs[0])
+        nc.createDimension("bloc_lon", n_blocs[1])
+        nc.createVariable("lat", lat.dtype, ("lat",))[:] = lat
+        nc.createVariable("lon", lon.dtype, ("lon",))[:] = lon
+        nc.createVariable("r1", "f8", ("r1",))[:] = np.asarray(r1_vals, dtype=np.float64)
+        nc.createVariable("date", "i4", ("jour",))
+        nc.createVariable("inclus", "u1", ("jour", "bloc_lat", "bloc_lon"), fill_value=0)
+
+        # Accumulateurs nuls tant qu'un bloc n'est pas écrit (aucun chunk alloué)
+        options = dict(zlib=True, complevel=NIVEAU_ZLIB, shuffle=True, fill_value=0)
+        nc.createVariable("n", "u2", ("lat", "lon"), chunksizes=chunks, **options)
+        for nom in ("index", "index_m2", "moy_int", "moy_ext"):
+            nc.createVariable(nom, "f4", ("lat", "lon"), chunksizes=chunks, **options)
+        nc.createVariable("r1_compte", "u2", ("r1", "lat", "lon"), chunksizes=(len(r1_vals),) + chunks, **options)
+        nc["index_m2"].comment = "Somme des carrés des écarts à la moyenne : variance = index_m2 / (n - 1)"
+    os.replace(path + ".tmp", path)
+
+
+class _Composite:
+    """
+    Fichier d'un composite ouvert sous verrou (plusieurs processus écrivent des blocs différents
+    du même fichier) : verrou fichier entre processus, verrou HDF5 de xarray entre threads.
+    """
+
+    def __init__(self, path, periode, cle, lat, lon, r1_vals, taille_bloc):
+        self.path, self.args = path, (periode, cle, lat, lon, r1_vals, taille_bloc)
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.verrou = open(self.path + ".lock", "w")
+        fcntl.flock(self.verrou, fcntl.LOCK_EX)
+        HDF5_LOCK.acquire()
+        if not os.path.exists(self.path):
+            _creer_composite(self.path, *self.args)
+        self.nc = netCDF4.Dataset(self.path, "a")
+        self.nc.set_auto_maskandscale(False)
+        if tuple(self.nc.taille_bloc) != tuple(self.args[-1]) or len(self.nc["r1"]) != len(self.args[-2]):
+            self.__exit__()
+            raise ValueError(f" {os.path.basename(self.path)} a été construit avec d'autres blocs ou rayons")
+        return self.nc
+
+    def __exit__(self, *exc):
+        self.nc.close()
+        HDF5_LOCK.release()
+        self.verrou.close()
+
+
+def _charger_bloc(fichier, bloc):
+    """
+    Accumulateurs d'un bloc lus dans le fichier du composite, et dates déjà repliées dans ce bloc.
+    """
+    (i0, i1, j0, j1), (bi, bj) = bloc
+    with fichier as nc:
+        acc = {nom: nc[nom][..., i0:i1, j0:j1] for nom in ("n", "index", "index_m2", "moy_int", "moy_ext",
+                                                         "r1_compte")}
+        dates = nc["date"][:]
+        inclus = nc["inclus"][:, bi, bj] if len(dates) else np.zeros(0, dtype=np.uint8)
+    return acc, {str(d) for d, k in zip(dates, inclus) if k}
+
+
+def _ecrire_bloc(fichier, bloc, acc, dates):
+    """
+    Réécrit les accumulateurs d'un bloc et marque `dates` comme repliées dans ce bloc.
+    """
+    (i0, i1, j0, j1), (bi, bj) = bloc
+    with fichier as nc:
+        for nom, valeurs in acc.items():
+            nc[nom][..., i0:i1, j0:j1] = valeurs
+        connues = {str(d): k for k, d in enumerate(nc["date"][:])}
+        for d in sorted(dates):
+            if d not in connues:
+                connues[d] = len(connues)
+                nc["date"][connues[d]] = int(d)
+            nc["inclus"][connues[d], bi, bj] = 1
+
+
+def _composer_bloc(bloc, jours, sortie, periodes, lat, lon, r1_vals, taille_bloc):
+    """
+    Replie les `jours` [(date, chemin, indice temps)] dans les composites d'un bloc spatial.
+    Un composite n'est gardé en mémoire que tant que ses jours défilent (les climatologies
+    jusqu'à la fin) ; un jour déjà replié dans tous ses composites n'est pas relu.
+    Retourne le nombre de jours lus.
+    """
+    (i0, i1, j0, j1), _ = bloc
+    ouverts = {}  # (periode, cle) -> [fichier, accumulateurs, dates repliées, dates nouvelles]
+    n_lus = 0
+
+    def fermer(cle):
+        fichier, acc, _, nouvelles = ouverts.pop(cle)
+        if nouvelles:
+            _ecrire_bloc(fichier, bloc, acc, nouvelles)
+
+    for date_str, chemin, k in jours:
+        cles = [(p, cle_periode(date_str, p)) for p in periodes]
+        # Composites terminés (les jours sont triés) : écrits et libérés
+        for cle in [c for c in ouverts if c[0] != "climatologie" and c not in cles]:
+            fermer(cle)
+        for periode, cle in cles:
+            if (periode, cle) not in ouverts:
+                fichier = _Composite(chemin_composite(sortie, periode, cle), periode, cle, lat, lon, r1_vals,
+                                     taille_bloc)
+                ouverts[(periode, cle)] = [fichier, *_charger_bloc(fichier, bloc), set()]
+        cibles = [ouverts[c] for c in cles if date_str not in ouverts[c][2]]
+        if not cibles:
+            continue
+
+        jour = {nom: v[0] for nom, v in _lire_source(chemin, [(date_str, k)], VARIABLES,
+                                                     boites=[(i0, i1, [(j0, j1)])])[0].items()}
+        n_lus += 1
+        for _, acc, repliees, nouvelles in cibles:
+            replier(acc, jour, r1_vals)
+            repliees.add(date_str)
+            nouvelles.add(date_str)
+
+    for cle in list(ouverts):
+        fermer(cle)
+    return n_lus
+
+
+def decoupe_blocs(shape, taille_bloc=TAILLE_BLOC):
+    """
+    Blocs spatiaux [((i0, i1, j0, j1), (bi, bj))] couvrant la grille.
+    """
+    return [((i0, min(i0 + taille_bloc[0], shape[0]), j0, min(j0 + taille_bloc[1], shape[1])),
+             (i0 // taille_bloc[0], j0 // taille_bloc[1]))
+            for i0 in range(0, shape[0], taille_bloc[0]) for j0 in range(0, shape[1], taille_bloc[1])]
+
+
+def composer(archive_dir, sortie, periodes=PERIODES, debut=None, fin=None, r1_vals=R1_LIST,
+             taille_bloc=TAILLE_BLOC, workers=None):
+    """
+    Construit ou complète les composites `periodes` des jours [debut, fin] de l'archive, un bloc
+    spatial par tâche sur `workers` processus. Les jours déjà repliés (d'après les fichiers de
+    composites) sont ignorés : relancer après l'ajout d'un jour ne lit que ce jour.
+    Retourne le nombre de (bloc, jour) lus.
+    """
+    sources = lister_sources(archive_dir, debut, fin)
+    if not sources:
+        raise FileNotFoundError(f" Aucun fichier d'indice entre {debut} et {fin} dans {archive_dir}")
+    lat, lon = _coordonnees(sources)
+    for periode in periodes:
+        cle_periode("20000101", periode)
+    jours = sorted((d, chemin, k) for chemin, js in sources for d, k in js)
+    blocs = decoupe_blocs((len(lat), len(lon)), taille_bloc)
+    args = (jours, sortie, tuple(periodes), lat, lon, r1_vals, taille_bloc)
+
+    workers = min(workers or os.cpu_count() or 1, len(blocs))
+    if workers == 1:
+        n_lus = sum(_composer_bloc(b, *args) for b in blocs)
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            n_lus = sum(pool.map(_composer_bloc, blocs, *([a] * len(blocs) for a in args)))
+    print(f" Composites {', '.join(periodes)} : {len(jours)} jours, {len(blocs)} blocs, "
+          f"{n_lus} lectures de bloc")
+    return n_lus
+
+
+def lire_composite(path):
+    """
+    Composite en valeurs physiques : nombre de jours, moyenne et écart-type de l'index, fréquence
+    de chaque rayon parmi les jours valides, rayon le plus fréquent, moyennes de moy_int et moy_ext
+    (NaN sans jour valide).
+    """
+    with xr.open_dataset(path, mask_and_scale=False) as ds:
+        ds = ds.load()
+    n = ds["n"].astype(np.float32)
+    vide = n == 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ecart_type = np.sqrt(ds["index_m2"] / (n - 1)).where(n > 1)
+        frequence = (ds["r1_compte"] / n).where(~vide)
+    mode = ds["r1"][ds["r1_compte"].argmax("r1")].drop_vars("r1").where(~vide)
+    return xr.Dataset(
+        {
+            "n": ds["n"],
+            "index": ds["index"].where(~vide),
+            "index_ecart_type": ecart_type,
+            "r1_frequence": frequence,
+            "r1_mode": mode,
+            "moy_int": ds["moy_int"].where(~vide),
+            "moy_ext": ds["moy_ext"].where(~vide),
+        },
+        coords={"date": ds["date"]},
+        attrs={"periode": ds.attrs["periode"], "cle": ds.attrs["cle"]},
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Composites 8 jours, mensuels et climatologiques de l'indice.")
+    parser.add_argument("--archive", required=True, help="Dossier de l'archive Word_index_r1_*.nc")
+    parser.add_argument("--sortie", required=True, help="Dossier des composites (un sous-dossier par période)")
+    parser.add_argument("--periodes", nargs="+", choices=PERIODES, default=list(PERIODES))
+    parser.add_argument("--debut", help="Premier jour (YYYYMMDD)")
+    parser.add_argument("--fin", help="Dernier jour (YYYYMMDD)")
+    parser.add_argument("--workers", type=int, help="Processus (un bloc spatial par tâche)")
+    parser.add_argument("--taille-bloc", nargs=2, type=int, default=list(TAILLE_BLOC), metavar=("NLAT", "NLON"))
+    args = parser.parse_args()
+    composer(args.archive, args.sortie, args.periodes, args.debut, args.fin,
+             taille_bloc=tuple(args.taille_bloc), workers=args.workers)
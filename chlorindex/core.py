@@ -8,13 +8,16 @@ Date : Avril 2025
 import numpy as np
 import xarray as xr
 from scipy.signal import fftconvolve
+from scipy import fft as sp_fft
 from datetime import datetime
 import os
 import re
 from collections import OrderedDict
+from functools import partial
 
 #  Paramètres globaux importés depuis config.py
 from .config import ALPHA, R1_LIST, SEUIL_COUVERTURE, PENAL_LAMBDA, R_CRIT
+from .metriques import chrono, iterer
 
 
 def precompute_masques(r1_vals=None, alpha=ALPHA):
@@ -35,48 +38,347 @@ def precompute_masques(r1_vals=None, alpha=ALPHA):
         cache[r1] = (masque_ext, masque_int)
     return cache
 
-# Pour chaque rayon r1, calcul du ratio moyen intérieur / extérieur pondéré et pénalisé.
-def calc_index_optim(chla, r1_vals=R1_LIST, alpha=ALPHA, seuil_couv=SEUIL_COUVERTURE, masques_cache=None):
+def precompute_spectres(shape, r1_vals=None, alpha=ALPHA, masques_cache=None, dtype=np.float64):
     """
-    Calcule l'indice spatial optimisé pixel-par-pixel sur une mappe de chlorophylle.
-    Optimise le ratio entre enrichissement intérieur et enrichissement extérieur sur différents rayons r1.
+    Pré-calcule les spectres des disques intérieurs (r1) et extérieurs (r2 = alpha * r1)
+    à la taille de FFT complétée d'une grille de forme `shape`.
+    Chaque disque est centré sur l'origine (repliement périodique) : son spectre est réel,
+    ce qui divise par deux la mémoire du cache. L'anneau n'a pas de spectre propre,
+    il est obtenu par différence disque(r2) - disque(r1).
+    `dtype` fixe la précision des FFT qui utiliseront ces spectres (float32 ou float64).
+    Un disque discret commun à plusieurs rayons (ou couples (r1, alpha), clés de `masques_cache`)
+    n'a qu'un spectre, partagé : _convolutions_spectrales ne le calcule alors qu'une fois.
     """
-
+    if r1_vals is None:
+        r1_vals = R1_LIST
     if masques_cache is None:
         masques_cache = precompute_masques(r1_vals, alpha)
 
-    nlat, nlon = chla.shape
-    masque_valide = ~np.isnan(chla)
-    chla0 = np.where(masque_valide, chla, 0)
-    M1 = np.where(masque_valide, 1, np.nan)
+    # Complétion par des zéros d'au moins un demi-noyau : pas de repliement circulaire
+    demi = max(masques_cache[r1][0].shape[0] // 2 for r1 in r1_vals)
+    shape_fft = tuple(sp_fft.next_fast_len(int(n) + demi, real=True) for n in shape)
 
-    n_cand = len(r1_vals)
-    indices = np.full((n_cand, nlat, nlon), np.nan, dtype=chla.dtype)
-    moy_int_cand = np.full((n_cand, nlat, nlon), np.nan, dtype=chla.dtype)
-    moy_ext_cand = np.full((n_cand, nlat, nlon), np.nan, dtype=chla.dtype)
+    def spectre(masque):
+        centre = masque.shape[0] // 2
+        noyau = np.zeros(shape_fft, dtype=np.float64)
+        noyau[:masque.shape[0], :masque.shape[1]] = masque
+        noyau = np.roll(noyau, (-centre, -centre), axis=(0, 1))
+        return sp_fft.rfft2(noyau).real.astype(dtype)
+
+    communs = {}  # Disque (décomposé en cordes) -> spectre
+
+    def spectre_commun(masque):
+        cle = tuple(_cordes(masque))
+        if cle not in communs:
+            communs[cle] = spectre(masque)
+        return communs[cle]
+
+    spectres = OrderedDict()
+    for r1 in r1_vals:
+        masq_ext, masq_int = masques_cache[r1]
+        spectres[r1] = (spectre_commun(masq_int), spectre_commun(masq_int + masq_ext),
+                        float(np.sum(masq_int)), float(np.sum(masq_ext)))
+    return {"shape": tuple(shape), "shape_fft": shape_fft, "dtype": np.dtype(dtype), "spectres": spectres}
+
+
+def dtype_fft(dtype, precision=None):
+    """
+    Type réel des FFT et des spectres pour une donnée de type `dtype` et une option `precision`.
+    """
+    if precision == "float32":
+        return np.dtype(np.float32)
+    if precision == "float64":
+        return np.dtype(np.float64)
+    return np.result_type(dtype, np.float32)
+
+
+def _convolutions_fft(chla0, valide, r1_vals, masques_cache):
+    """
+    Sommes et effectifs intérieurs/extérieurs par rayon, via quatre fftconvolve par rayon.
+    Les effectifs sont arrondis à l'entier, comme ceux des autres moteurs : le bruit des FFT
+    ne fait pas basculer les pixels dont la couverture est au seuil.
+    """
+    # Noyaux étendus aux dimensions de tête éventuelles (pile de jours)
+    tete = (1,) * (chla0.ndim - 2)
+    for r1 in r1_vals:
+        masq_ext, masq_int = masques_cache[r1]
+        masq_ext, masq_int = masq_ext.reshape(tete + masq_ext.shape), masq_int.reshape(tete + masq_int.shape)
+        conv_int = fftconvolve(chla0, masq_int, mode='same', axes=(-2, -1))
+        norm_int = np.rint(fftconvolve(valide, masq_int, mode='same', axes=(-2, -1)))
+        conv_ext = fftconvolve(chla0, masq_ext, mode='same', axes=(-2, -1))
+        norm_ext = np.rint(fftconvolve(valide, masq_ext, mode='same', axes=(-2, -1)))
+        yield r1, conv_int, norm_int, conv_ext, norm_ext, np.sum(masq_int), np.sum(masq_ext)
 
-    for i, r1 in enumerate(r1_vals):
+
+def _convolutions_spectrales(chla0, valide, r1_vals, spectres_cache):
+    """
+    Sommes et effectifs intérieurs/extérieurs par rayon, à partir des spectres en cache.
+    Les données et le masque de validité ne sont transformés qu'une fois ; chaque disque
+    ne coûte qu'un produit et deux FFT inverses. Les effectifs sont arrondis à l'entier.
+    Un disque au spectre partagé par plusieurs rayons n'est calculé qu'une fois, et gardé
+    jusqu'à sa dernière utilisation. Les tableaux produits ne doivent pas être modifiés sur place.
+    """
+    nlat, nlon = chla0.shape[-2:]
+    shape_fft = spectres_cache["shape_fft"]
+    f_chla = sp_fft.rfft2(chla0, s=shape_fft)
+    f_valide = sp_fft.rfft2(valide, s=shape_fft)
+
+    def disque(spectre):
+        somme = sp_fft.irfft2(f_chla * spectre, s=shape_fft, overwrite_x=True)[..., :nlat, :nlon]
+        effectif = np.rint(sp_fft.irfft2(f_valide * spectre, s=shape_fft, overwrite_x=True)[..., :nlat, :nlon])
+        return somme, effectif
+
+    derniere = {id(spectre): k for k, r1 in enumerate(r1_vals) for spectre in spectres_cache["spectres"][r1][:2]}
+    calcules = {}
+
+    for k, r1 in enumerate(r1_vals):
+        spec_int, spec_r2, n_int, n_ext = spectres_cache["spectres"][r1]
+        for spectre in (spec_int, spec_r2):
+            if id(spectre) not in calcules:
+                calcules[id(spectre)] = disque(spectre)
+        conv_int, norm_int = calcules[id(spec_int)]
+        conv_ext, norm_ext = calcules[id(spec_r2)]
+        for cle in {id(spec_int), id(spec_r2)}:
+            if derniere[cle] == k:
+                del calcules[cle]
+        # Anneau = disque(r2) - disque(r1), soustrait sur place si le disque r2 ne resert pas
+        # (ni n'est le disque r1 lui-même : alpha proche de 1, anneau vide)
+        if id(spec_r2) in calcules or spec_r2 is spec_int:
+            conv_ext, norm_ext = conv_ext - conv_int, norm_ext - norm_int
+        else:
+            conv_ext -= conv_int
+            norm_ext -= norm_int
+        yield r1, conv_int, norm_int, conv_ext, norm_ext, n_int, n_ext
+
+
+def _cordes(masque):
+    """
+    Décompose un disque centré en cordes horizontales : liste de (décalage en ligne, demi-largeur).
+    """
+    centre = masque.shape[0] // 2
+    cordes = []
+    for i, ligne in enumerate(masque):
+        n = int(np.count_nonzero(ligne))
+        if n:
+            cordes.append((i - centre, (n - 1) // 2))
+    return cordes
+
+
+def _cumul_lignes(x, dtype, demi):
+    """
+    Sommes cumulées par ligne, grille complétée de `demi` zéros et d'une colonne nulle en tête :
+    la somme de la corde de demi-largeur w centrée en (i, j) vaut
+    c[i + demi, j + demi + w + 1] - c[i + demi, j + demi - w].
+    """
+    *tete, nlat, nlon = x.shape
+    pad = np.zeros(tuple(tete) + (nlat + 2 * demi, nlon + 2 * demi + 1), dtype=dtype)
+    np.cumsum(x, axis=-1, dtype=dtype, out=pad[..., demi:demi + nlat, demi + 1:demi + 1 + nlon])
+    pad[..., demi:demi + nlat, demi + 1 + nlon:] = pad[..., demi:demi + nlat, demi + nlon, None]
+    return pad
+
+
+def _convolutions_cordes(chla0, masque_valide, r1_vals, masques_cache):
+    """
+    Sommes et effectifs intérieurs/extérieurs par rayon, par sommes de cordes horizontales.
+    Les sommes cumulées par ligne donnent la somme d'une corde en deux lectures : un disque
+    de rayon r coûte O(N * r), sans complétion à une grille FFT. Les effectifs sont des
+    entiers exacts (sommes cumulées entières).
+    Un disque discret commun à plusieurs rayons (disque r2 d'un rayon égal au disque r1 d'un
+    autre, rayons voisins d'une grille fine) n'est calculé qu'une fois, et gardé jusqu'à sa
+    dernière utilisation. Les tableaux produits ne doivent pas être modifiés sur place.
+    """
+    *tete, nlat, nlon = chla0.shape
+    tete = tuple(tete)  # Dimensions de tête éventuelles (pile de jours)
+    demi = max(masques_cache[r1][0].shape[0] // 2 for r1 in r1_vals)
+
+    cumul_chla = _cumul_lignes(chla0, np.float64, demi)
+    cumul_valide = _cumul_lignes(masque_valide, np.int32, demi)
+
+    # Sommes de cordes et accumulateurs dans la précision de l'entrée ; effectifs (<= 32767) en int16.
+    # Tampons réutilisés : pas d'allocation par corde.
+    dtype = np.result_type(chla0.dtype, np.float32)
+    corde_chla = np.empty(tete + (nlat + 2 * demi, nlon), dtype=dtype)
+    corde_valide = np.empty(tete + (nlat + 2 * demi, nlon), dtype=np.int16)
+
+    # Disques (décomposés en cordes) de chaque rayon et dernière utilisation de chacun
+    disques = []
+    for r1 in r1_vals:
         masq_ext, masq_int = masques_cache[r1]
-        conv_int = fftconvolve(chla0, masq_int, mode='same')
-        norm_int = fftconvolve(masque_valide.astype(float), masq_int, mode='same')
+        disques.append((tuple(_cordes(masq_int)), tuple(_cordes(masq_int + masq_ext))))
+    derniere = {cle: k for k, paire in enumerate(disques) for cle in paire}
+    calcules = {}
+
+    for k, r1 in enumerate(r1_vals):
+        masq_ext, masq_int = masques_cache[r1]
+        nouveaux = [cle for cle in dict.fromkeys(disques[k]) if cle not in calcules]
+        for cle in nouveaux:
+            calcules[cle] = (np.zeros(tete + (nlat, nlon), dtype=dtype), np.zeros(tete + (nlat, nlon), dtype=np.int16))
+
+        # Chaque demi-largeur w n'est calculée qu'une fois pour tous les nouveaux disques du rayon
+        for w in sorted({w for cle in nouveaux for _, w in cle}):
+            # Somme de la corde de demi-largeur w centrée sur chaque pixel, pour toutes les lignes
+            np.subtract(cumul_chla[..., demi + w + 1:demi + w + 1 + nlon],
+                        cumul_chla[..., demi - w:demi - w + nlon], out=corde_chla, casting="same_kind")
+            np.subtract(cumul_valide[..., demi + w + 1:demi + w + 1 + nlon],
+                        cumul_valide[..., demi - w:demi - w + nlon], out=corde_valide, casting="same_kind")
+            for cle in nouveaux:
+                somme, effectif = calcules[cle]
+                for dy, w_dy in cle:
+                    if w_dy == w:
+                        somme += corde_chla[..., demi + dy:demi + dy + nlat, :]
+                        effectif += corde_valide[..., demi + dy:demi + dy + nlat, :]
+
+        conv_int, norm_int = calcules[disques[k][0]]
+        conv_r2, norm_r2 = calcules[disques[k][1]]
+        for cle in set(disques[k]):
+            if derniere[cle] == k:
+                del calcules[cle]
+        # Anneau = disque(r2) - disque(r1)
+        yield r1, conv_int, norm_int, conv_r2 - conv_int, norm_r2 - norm_int, np.sum(masq_int), np.sum(masq_ext)
+
+
+def _convolutions_pixels(chla0, masque_valide, rayons_pixels, masques_cache):
+    """
+    Sommes et effectifs intérieurs/extérieurs aux seuls pixels demandés pour chaque rayon :
+    `rayons_pixels` est une liste de (r1, indices à plat dans la grille). Chaque corde est lue
+    dans les sommes cumulées par ligne en deux accès indexés : le coût est proportionnel au
+    nombre de pixels, pas à la taille de la grille. Produit des tableaux 1D, un par rayon.
+    """
+    shape = chla0.shape
+    demi = max(masques_cache[r1][0].shape[0] // 2 for r1, _ in rayons_pixels)
+    cumul_chla = _cumul_lignes(chla0, np.float64, demi)
+    cumul_valide = _cumul_lignes(masque_valide, np.int32, demi)
+    largeur = cumul_chla.shape[-1]
+    dtype = np.result_type(chla0.dtype, np.float32)
+
+    def disque(base, cordes):
+        somme = np.zeros(base.shape, dtype=np.float64)
+        effectif = np.zeros(base.shape, dtype=np.int32)
+        for dy, w in cordes:
+            droite, gauche = base + dy * largeur + w + 1, base + dy * largeur - w
+            somme += cumul_chla.ravel()[droite] - cumul_chla.ravel()[gauche]
+            effectif += cumul_valide.ravel()[droite] - cumul_valide.ravel()[gauche]
+        return somme.astype(dtype), effectif.astype(np.int16)
+
+    for r1, pixels in rayons_pixels:
+        *tete, i, j = np.unravel_index(pixels, shape)
+        base = np.ravel_multi_index(tuple(tete) + (i + demi, j + demi), cumul_chla.shape)
+        masq_ext, masq_int = masques_cache[r1]
+        conv_int, norm_int = disque(base, _cordes(masq_int))
+        conv_r2, norm_r2 = disque(base, _cordes(masq_int + masq_ext))
+        yield r1, conv_int, norm_int, conv_r2 - conv_int, norm_r2 - norm_int, np.sum(masq_int), np.sum(masq_ext)
+
+
+# Coût d'une FFT inverse de la grille complétée (produit et arrondi compris), en opérations
+# de cordes sur la même grille : ~10 de 240x480 à 2160x4320 (benchmarks/bench_moteurs.py).
+COUT_FFT_EN_CORDES = 10
+
+
+def choix_moteur(r1_vals=R1_LIST, alpha=ALPHA, masques_cache=None):
+    """
+    Choisit entre les moteurs "cordes" et "spectral" selon le nombre d'opérations sur grille
+    entière de chacun. Le rapport des coûts dépend peu de la taille de la grille : le choix
+    ne dépend que des rayons. Les deux moteurs ne calculent qu'une fois un disque commun à
+    plusieurs rayons : seuls les disques distincts sont comptés.
+    """
+    if masques_cache is None:
+        masques_cache = precompute_masques(r1_vals, alpha)
+    ops_cordes = 0
+    deja = set()
+    for r1 in r1_vals:
+        masq_ext, masq_int = masques_cache[r1]
+        # Disques partagés entre rayons : comptés une seule fois
+        nouveaux = {tuple(_cordes(m)) for m in (masq_int, masq_int + masq_ext)} - deja
+        deja |= nouveaux
+        cordes = [c for cle in nouveaux for c in cle]
+        ops_cordes += len(cordes) + len({w for _, w in cordes})
+    ops_spectral = COUT_FFT_EN_CORDES * (2 + 2 * len(deja))
+    return "cordes" if ops_cordes <= ops_spectral else "spectral"
+
+
+def rayons_utiles(r1_vals=R1_LIST, alpha=ALPHA, masques_cache=None, penal_lambda=PENAL_LAMBDA, r_crit=R_CRIT):
+    """
+    Rayons de `r1_vals` pouvant l'emporter. Un rayon dont les masques discrets (disque et anneau)
+    sont ceux d'un rayon précédent de la liste, de pénalité au moins égale, a les mêmes moyennes
+    et un indice au plus égal : le rayon précédent l'emporte toujours (premier maximum).
+    L'écarter ne change pas le résultat ; c'est fréquent sur une grille de rayons fine.
+    """
+    if masques_cache is None:
+        masques_cache = precompute_masques(r1_vals, alpha)
+    r1_vals = np.asarray(r1_vals)
+    penalites = {}  # Masques -> plus forte pénalité des rayons gardés
+    garder = []
+    for r1 in r1_vals:
+        masq_ext, masq_int = masques_cache[r1]
+        cle = (masq_int.shape, masq_int.tobytes(), masq_ext.tobytes())
+        penalite = np.exp(- penal_lambda * np.maximum(0, r1 - r_crit))
+        domine = cle in penalites and penalites[cle] >= penalite
+        if not domine:
+            penalites[cle] = max(penalites.get(cle, -np.inf), penalite)
+        garder.append(not domine)
+    return r1_vals[garder]
+
+
+def _moyennes(convolutions, M1, dtype_calcul=None):
+    """
+    Moyennes intérieure/extérieure et effectifs (NaN si nuls) pour chaque rayon r1.
+    Avec `dtype_calcul`, sommes, effectifs et intermédiaires sont tenus dans ce type
+    (sinon ils suivent la promotion NumPy habituelle, en float64).
+    """
+    for r1, conv_int, norm_int, conv_ext, norm_ext, n_int, n_ext in convolutions:
+        if dtype_calcul is not None:
+            conv_int, norm_int, conv_ext, norm_ext = (x.astype(dtype_calcul, copy=False)
+                                                      for x in (conv_int, norm_int, conv_ext, norm_ext))
+
         norm_int = np.where(norm_int == 0, np.nan, norm_int)
         moy_int = (conv_int / norm_int) * M1
 
-        conv_ext = fftconvolve(chla0, masq_ext, mode='same')
-        norm_ext = fftconvolve(masque_valide.astype(float), masq_ext, mode='same')
         norm_ext = np.where(norm_ext == 0, np.nan, norm_ext)
         moy_ext = (conv_ext / norm_ext) * M1
 
-        with np.errstate(divide='ignore', invalid='ignore'):
-            ratio = moy_int / moy_ext
-            ratio[np.isinf(ratio)] = np.nan
-            idx_cand = ratio * np.exp(- PENAL_LAMBDA * np.maximum(0, r1 - R_CRIT))# Pénalisation exponentielle appliquée pour limiter l'optimisation vers des grands rayons r1 > R_CRIT.
+        yield r1, moy_int, moy_ext, norm_int, norm_ext, n_int, n_ext
+
+
+def indice_rayon(r1, moy_int, moy_ext, norm_int, norm_ext, n_int, n_ext, seuil_couv=SEUIL_COUVERTURE,
+                 penal_lambda=PENAL_LAMBDA, r_crit=R_CRIT):
+    """
+    Indice candidat pénalisé d'un rayon r1 à partir de ses moyennes et de ses effectifs valides
+    (`n_int`, `n_ext` : nombres de pixels des masques). NaN où la couverture est insuffisante.
+    """
+    # Pénalité dans le type des moyennes : le calcul float32 reste en float32
+    penalite = moy_int.dtype.type(np.exp(- penal_lambda * np.maximum(0, r1 - r_crit)))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = moy_int / moy_ext
+        ratio[np.isinf(ratio)] = np.nan
+        idx_cand = ratio * penalite# Pénalisation exponentielle appliquée pour limiter l'optimisation vers des grands rayons r1 > R_CRIT.
+
+
+    cov_int = norm_int / n_int
+    cov_ext = norm_ext / n_ext
+    idx_cand[(cov_int < seuil_couv) | (cov_ext < seuil_couv)] = np.nan
+    return idx_cand
+
 
+def _candidats(moyennes, seuil_couv, penal_lambda=PENAL_LAMBDA, r_crit=R_CRIT):
+    """
+    Indice candidat pénalisé et moyennes intérieure/extérieure pour chaque rayon r1.
+    """
+    for r1, moy_int, moy_ext, norm_int, norm_ext, n_int, n_ext in moyennes:
+        idx_cand = indice_rayon(r1, moy_int, moy_ext, norm_int, norm_ext, n_int, n_ext,
+                                seuil_couv, penal_lambda, r_crit)
+        yield idx_cand, moy_int, moy_ext
 
-        cov_int = norm_int / np.sum(masq_int)
-        cov_ext = norm_ext / np.sum(masq_ext)
-        idx_cand[(cov_int < seuil_couv) | (cov_ext < seuil_couv)] = np.nan
 
+def _reduction_pile(candidats, r1_vals, shape, dtype):
+    """
+    Empile les candidats de tous les rayons puis sélectionne le meilleur r1 par argmax.
+    """
+    n_cand = len(r1_vals)
+    indices = np.full((n_cand,) + tuple(shape), np.nan, dtype=dtype)
+    moy_int_cand = np.full((n_cand,) + tuple(shape), np.nan, dtype=dtype)
+    moy_ext_cand = np.full((n_cand,) + tuple(shape), np.nan, dtype=dtype)
+
+    for i, (idx_cand, moy_int, moy_ext) in enumerate(candidats):
         indices[i] = idx_cand
         moy_int_cand[i] = moy_int
         moy_ext_cand[i] = moy_ext
@@ -89,15 +391,412 @@ def calc_index_optim(chla, r1_vals=R1_LIST, alpha=ALPHA, seuil_couv=SEUIL_COUVER
     meilleur_r1 = r1_vals[idx_best]
     meilleur_r1[tous_nan] = np.nan
 
-    i_y, i_x = np.indices((nlat, nlon))
-    moy_int_best = moy_int_cand[idx_best, i_y, i_x]
-    moy_ext_best = moy_ext_cand[idx_best, i_y, i_x]
+    moy_int_best = np.take_along_axis(moy_int_cand, idx_best[None], axis=0)[0]
+    moy_ext_best = np.take_along_axis(moy_ext_cand, idx_best[None], axis=0)[0]
     moy_int_best[tous_nan] = np.nan
     moy_ext_best[tous_nan] = np.nan
 
     return index_max, meilleur_r1, moy_int_best, moy_ext_best
 
 
+def _etat_flux(shape, dtype, r1_vals):
+    """
+    Maximum courant initial : index à -inf, r1 et moyennes à NaN.
+    """
+    return [np.full(shape, -np.inf, dtype=dtype),
+            np.full(shape, np.nan, dtype=np.asarray(r1_vals).dtype),
+            np.full(shape, np.nan, dtype=dtype),
+            np.full(shape, np.nan, dtype=dtype)]
+
+
+def _maj_flux(etat, r1, idx_cand, moy_int, moy_ext):
+    """
+    Met à jour sur place le maximum courant avec les candidats d'un rayon r1.
+    """
+    index_max, meilleur_r1, moy_int_best, moy_ext_best = etat
+    # Conversion préalable au type de sortie : comparaisons faites sur les mêmes valeurs que la pile
+    cand = idx_cand.astype(index_max.dtype, copy=False)
+    mieux = cand > index_max  # NaN > x est toujours faux
+    np.copyto(index_max, cand, where=mieux)
+    meilleur_r1[mieux] = r1
+    np.copyto(moy_int_best, moy_int, where=mieux, casting="same_kind")
+    np.copyto(moy_ext_best, moy_ext, where=mieux, casting="same_kind")
+
+
+def _fin_flux(etat):
+    """
+    Sorties du maximum courant : index NaN là où aucun rayon n'a de candidat.
+    """
+    index_max, meilleur_r1, moy_int_best, moy_ext_best = etat
+    index_max[index_max == -np.inf] = np.nan
+    return index_max, meilleur_r1, moy_int_best, moy_ext_best
+
+
+def _reduction_flux(candidats, r1_vals, shape, dtype):
+    """
+    Maximum courant mis à jour sur place après chaque rayon : quelques grilles en mémoire,
+    quel que soit le nombre de rayons. Résultat identique bit à bit à `_reduction_pile`
+    (le premier rayon maximal l'emporte en cas d'égalité, comme np.argmax).
+    """
+    etat = _etat_flux(shape, dtype, r1_vals)
+    for r1, (idx_cand, moy_int, moy_ext) in zip(r1_vals, candidats):
+        _maj_flux(etat, r1, idx_cand, moy_int, moy_ext)
+    return _fin_flux(etat)
+
+
+def _reduction_alphas(moyennes, alphas, r1_vals, shape, dtype, seuil_couv, penal_lambda, r_crit):
+    """
+    Maximum courant de chaque alpha, mis à jour avec les moyennes des couples (r1, alpha) dans
+    l'ordre des rayons : mêmes sorties que `_reduction_flux` sur chaque alpha séparément.
+    """
+    etats = {a: _etat_flux(shape, dtype, r1_vals) for a in alphas}
+    for (r1, a), moy_int, moy_ext, norm_int, norm_ext, n_int, n_ext in moyennes:
+        idx_cand = indice_rayon(r1, moy_int, moy_ext, norm_int, norm_ext, n_int, n_ext,
+                                seuil_couv, penal_lambda, r_crit)
+        _maj_flux(etats[a], r1, idx_cand, moy_int, moy_ext)
+    return {a: _fin_flux(etat) for a, etat in etats.items()}
+
+
+PAS_GROSSIER = 4  # Recherche "grossiere" : un rayon sur PAS_GROSSIER évalué sur toute la grille
+FRACTION_PIXELS = 0.1  # Au-delà de cette fraction de pixels à affiner, un rayon est calculé sur toute la grille
+
+
+def _recherche_grossiere(chla0, masque_valide, M1, r1_vals, masques_cache, convoluer, seuil_couv, penal_lambda,
+                         r_crit, pas, dtype_calcul, dtype):
+    """
+    Recherche du meilleur rayon en deux temps : un rayon sur `pas` est évalué partout, puis chaque
+    pixel n'évalue que les rayons compris entre les voisins grossiers de son meilleur rayon.
+    Un rayon demandé par plus de FRACTION_PIXELS des pixels est calculé sur toute la grille (et
+    met à jour tous les pixels), sinon aux seuls pixels concernés. Approché : un maximum loin
+    du meilleur rayon grossier peut être manqué (voir benchmarks/bench_recherche.py).
+    Pour une pile de jours, les rayons grossiers sont évalués sur toute la pile, puis l'affinage
+    (et ce choix) se fait jour par jour : même résultat que chaque jour calculé seul.
+    `convoluer(rayons, jour)` convolue la pile, ou le seul `jour` (indice de tête) s'il est donné.
+    """
+    n = len(r1_vals)
+    grossiers = list(range(0, n, pas))
+    if grossiers[-1] != n - 1:
+        grossiers.append(n - 1)
+
+    etat = _etat_flux(chla0.shape, dtype, r1_vals)
+    moyennes = _moyennes(convoluer(r1_vals[grossiers]), M1, dtype_calcul)
+    for r1, candidat in zip(r1_vals[grossiers], _candidats(moyennes, seuil_couv, penal_lambda, r_crit)):
+        _maj_flux(etat, r1, *candidat)
+
+    # Vues de chaque jour (la grille elle-même pour une carte 2D), mises à jour sur place
+    for jour in np.ndindex(chla0.shape[:-2]):
+        _affiner(chla0[jour], masque_valide[jour], M1[jour], [e[jour] for e in etat], r1_vals, grossiers,
+                 masques_cache, partial(convoluer, jour=jour), seuil_couv, penal_lambda, r_crit, dtype_calcul)
+    return _fin_flux(etat)
+
+
+def _affiner(chla0, masque_valide, M1, etat, r1_vals, grossiers, masques_cache, convoluer, seuil_couv,
+             penal_lambda, r_crit, dtype_calcul):
+    """
+    Affinage de la recherche grossière sur une carte 2D : met à jour `etat` sur place avec les
+    rayons compris entre les voisins grossiers du meilleur rayon de chaque pixel.
+    """
+    # Rang du meilleur rayon grossier de chaque pixel (-1 : aucun candidat)
+    rang = np.full(chla0.shape, -1, dtype=np.int32)
+    for g in grossiers:
+        rang[etat[1] == r1_vals[g]] = g
+
+    pleins, ponctuels = [], []
+    for g_avant, g_apres in zip(grossiers[:-1], grossiers[1:]):
+        besoin = (rang == g_avant) | (rang == g_apres)
+        n_besoin = np.count_nonzero(besoin)
+        for k in range(g_avant + 1, g_apres):
+            if n_besoin > FRACTION_PIXELS * besoin.size:
+                pleins.append(k)
+            elif n_besoin:
+                ponctuels.append((r1_vals[k], np.flatnonzero(besoin)))
+
+    moyennes = _moyennes(convoluer(r1_vals[pleins]), M1, dtype_calcul)
+    for r1, candidat in zip(r1_vals[pleins], _candidats(moyennes, seuil_couv, penal_lambda, r_crit)):
+        _maj_flux(etat, r1, *candidat)
+
+    M1_plat = M1.ravel()
+    convolutions = iterer(_convolutions_pixels(chla0, masque_valide, ponctuels, masques_cache), "convolution",
+                          par_rayon=True)
+    for (r1, pixels), conv in zip(ponctuels, convolutions):
+        for candidat in _candidats(_moyennes([conv], M1_plat[pixels], dtype_calcul), seuil_couv, penal_lambda, r_crit):
+            sous_etat = [e.ravel()[pixels] for e in etat]
+            _maj_flux(sous_etat, r1, *candidat)
+            for e, sous in zip(etat, sous_etat):
+                e.ravel()[pixels] = sous
+
+
+def _compresser(convolutions, pixels):
+    """
+    Restreint les sommes et effectifs de chaque rayon aux `pixels` (indices à plat dans la grille).
+    """
+    for r1, conv_int, norm_int, conv_ext, norm_ext, n_int, n_ext in convolutions:
+        yield (r1,) + tuple(x.reshape(x.shape[:-2] + (-1,))[..., pixels]
+                            for x in (conv_int, norm_int, conv_ext, norm_ext)) + (n_int, n_ext)
+
+
+def _decompresser(sorties, pixels, shape):
+    """
+    Replace des sorties calculées aux seuls `pixels` dans des grilles de forme `shape`, NaN ailleurs.
+    """
+    pleines = []
+    for sortie in sorties:
+        pleine = np.full(shape[:-2] + (shape[-2] * shape[-1],), np.nan, dtype=sortie.dtype)
+        pleine[..., pixels] = sortie
+        pleines.append(pleine.reshape(shape))
+    return tuple(pleines)
+
+
+def fenetres_masque(masque, halo):
+    """
+    Fenêtres (tranche lat, tranche lon) couvrant les pixels vrais de `masque` : les groupes de
+    colonnes séparés de plus de deux halos sont calculés à part (deux régions éloignées ne
+    coûtent pas la bande qui les sépare).
+    """
+    colonnes = np.flatnonzero(masque.any(axis=0))
+    if len(colonnes) == 0:
+        return []
+    coupures = np.flatnonzero(np.diff(colonnes) > 2 * halo + 1) + 1
+    fenetres = []
+    for groupe in np.split(colonnes, coupures):
+        lignes = np.flatnonzero(masque[:, groupe[0]:groupe[-1] + 1].any(axis=1))
+        fenetres.append((slice(lignes[0], lignes[-1] + 1), slice(groupe[0], groupe[-1] + 1)))
+    return fenetres
+
+
+def _calc_index_masque(chla, masque, parametres):
+    """
+    calc_index_optim restreint aux fenêtres du masque, chacune étendue du halo des rayons :
+    au cœur de chaque fenêtre, le résultat est celui du calcul sur la grille entière.
+    Sorties NaN hors du masque (un jeu de sorties par alpha si `parametres["alpha"]` est une liste).
+    """
+    masque = np.asarray(masque, dtype=bool)
+    if masque.shape != chla.shape[-2:]:
+        raise ValueError(f" Masque de forme {masque.shape} pour une grille {chla.shape[-2:]}")
+    alpha = parametres["alpha"]
+    halo = int(np.ceil(np.max(alpha) * np.max(parametres["r1_vals"])))
+    nlat, nlon = masque.shape
+    sorties = {a: (np.full(chla.shape, np.nan, dtype=chla.dtype),
+                   np.full(chla.shape, np.nan, dtype=np.asarray(parametres["r1_vals"]).dtype),
+                   np.full(chla.shape, np.nan, dtype=chla.dtype),
+                   np.full(chla.shape, np.nan, dtype=chla.dtype))
+               for a in ([float(a) for a in alpha] if np.ndim(alpha) else [alpha])}
+    for sl_lat, sl_lon in fenetres_masque(masque, halo):
+        i0, i1 = max(sl_lat.start - halo, 0), min(sl_lat.stop + halo, nlat)
+        j0, j1 = max(sl_lon.start - halo, 0), min(sl_lon.stop + halo, nlon)
+        coeur = (slice(sl_lat.start - i0, sl_lat.stop - i0), slice(sl_lon.start - j0, sl_lon.stop - j0))
+        masque_fenetre = np.zeros((i1 - i0, j1 - j0), dtype=bool)
+        masque_fenetre[coeur] = masque[sl_lat, sl_lon]
+        resultats = calc_index_optim(chla[..., i0:i1, j0:j1], pixels=np.flatnonzero(masque_fenetre), **parametres)
+        for a, res_alpha in (resultats.items() if np.ndim(alpha) else [(alpha, resultats)]):
+            for sortie, res in zip(sorties[a], res_alpha):
+                sortie[..., sl_lat, sl_lon] = res[(Ellipsis,) + coeur]
+    return sorties if np.ndim(alpha) else sorties[alpha]
+
+
+# Pour chaque rayon r1, calcul du ratio moyen intérieur / extérieur pondéré et pénalisé.
+def calc_index_optim(chla, r1_vals=R1_LIST, alpha=ALPHA, seuil_couv=SEUIL_COUVERTURE, masques_cache=None,
+                     moteur="fft", spectres_cache=None, reduction="pile", precision=None, workers=None,
+                     penal_lambda=PENAL_LAMBDA, r_crit=R_CRIT, cache_rayons=None, date=None,
+                     recherche="exhaustive", pas_grossier=PAS_GROSSIER, masque=None, pixels=None):
+    """
+    Calcule l'indice spatial optimisé pixel-par-pixel sur une mappe de chlorophylle.
+    Optimise le ratio entre enrichissement intérieur et enrichissement extérieur sur différents rayons r1.
+    Le moteur "fft" convolue chaque masque avec fftconvolve ; le moteur "spectral" réutilise
+    les spectres de `precompute_spectres` et ne transforme les données qu'une fois ; le moteur
+    "cordes" somme des cordes horizontales (rapide pour les petits rayons, effectifs exacts) ;
+    "auto" choisit entre les deux derniers avec `choix_moteur`. Les trois moteurs arrondissent les
+    effectifs à l'entier : même test de couverture, même résultat au bruit des FFT près sur les sommes
+    (égalités d'indice entre rayons).
+    La réduction "pile" empile les candidats de tous les rayons ; la réduction "flux"
+    garde un maximum courant et borne la mémoire à quelques grilles.
+    `precision="float32"` tient la donnée, les FFT et tous les intermédiaires en float32 ;
+    `precision="float64"` force le float64 partout (référence). Par défaut, les convolutions
+    suivent la précision de l'entrée et les intermédiaires sont promus en float64.
+    `workers` fixe le nombre de threads des FFT (scipy.fft) pour une journée.
+    Avec `cache_rayons` (CacheRayons) et `date`, les moyennes et effectifs de chaque rayon sont
+    mis en cache ; seuls les rayons absents du cache sont calculés.
+    La recherche "exhaustive" évalue tous les rayons ; "exacte" écarte les rayons qui ne peuvent
+    pas l'emporter (rayons_utiles), même résultat ; "grossiere" évalue un rayon sur `pas_grossier`
+    puis affine autour du meilleur de chaque pixel (approché, réduction en flux, sans cache).
+    Avec `masque` (nlat, nlon), seules les fenêtres couvrant le masque (plus le halo des rayons)
+    sont calculées ; les sorties sont NaN hors du masque.
+    Avec `pixels` (indices à plat dans la grille nlat x nlon), les convolutions portent sur toute
+    la grille mais les moyennes, candidats et la réduction sur ces seuls pixels (privés de ceux
+    sans donnée) ; sorties NaN ailleurs, identiques au calcul complet sur ces pixels.
+    Avec une liste d'`alpha`, tous les alpha sont évalués en une passe : intérieur et extérieur
+    étant des différences de disques, les sommes sur disques des rayons r1 et alpha * r1 ne sont
+    calculées qu'une fois (moteurs "cordes" et "spectral"), puis chaque anneau en est déduit ;
+    fftconvolve ne partageant rien, le moteur "fft" (défaut) est alors remplacé par "auto".
+    `masques_cache` est alors {alpha: precompute_masques(r1_vals, alpha)}, la réduction se fait
+    en flux et la sortie est {alpha: (index, r1_best, moy_int, moy_ext)}, identique, à moteur
+    égal, au calcul de chaque alpha seul (au bruit des FFT près pour le moteur "spectral",
+    dont la taille de FFT suit le plus grand alpha). Ni cache par rayon, ni recherche grossière.
+    """
+
+    alphas = [float(a) for a in alpha] if np.ndim(alpha) else None
+    if masques_cache is None:
+        masques_cache = ({a: precompute_masques(r1_vals, a) for a in alphas} if alphas is not None
+                         else precompute_masques(r1_vals, alpha))
+
+    if masque is not None:
+        if cache_rayons is not None:
+            raise ValueError(" Le cache par rayon porte sur la grille entière, pas sur un masque")
+        if pixels is not None:
+            raise ValueError(" `masque` et `pixels` ne peuvent pas être donnés ensemble")
+        parametres = dict(r1_vals=r1_vals, alpha=alpha, seuil_couv=seuil_couv, masques_cache=masques_cache,
+                          moteur=moteur, reduction=reduction, precision=precision, workers=workers,
+                          penal_lambda=penal_lambda, r_crit=r_crit, recherche=recherche, pas_grossier=pas_grossier)
+        return _calc_index_masque(chla, masque, parametres)
+
+    r1_tous = r1_vals
+    if recherche not in ("exhaustive", "exacte", "grossiere"):
+        raise ValueError(f" Recherche inconnue : {recherche}")
+    if alphas is None:
+        if recherche != "exhaustive":
+            r1_vals = rayons_utiles(r1_vals, alpha, masques_cache, penal_lambda, r_crit)
+        cles_tous, cles = r1_tous, r1_vals
+    else:
+        if cache_rayons is not None or recherche == "grossiere":
+            raise ValueError(" Plusieurs alpha : ni cache par rayon, ni recherche grossière")
+        utiles = {a: set(rayons_utiles(r1_vals, a, masques_cache[a], penal_lambda, r_crit)
+                         if recherche == "exacte" else r1_vals) for a in alphas}
+        # Masques des couples (r1, alpha), rayon par rayon : le disque intérieur d'un r1 sert à tous les alpha
+        masques_cache = OrderedDict(((r1, a), masques_cache[a][r1]) for r1 in r1_tous for a in alphas)
+        cles_tous = list(masques_cache)
+        cles = [(r1, a) for r1, a in cles_tous if r1 in utiles[a]]
+
+    dtype_calcul = None
+    if precision == "float32":
+        chla = chla.astype(np.float32, copy=False)
+        dtype_calcul = np.float32
+    elif precision == "float64":
+        chla = chla.astype(np.float64, copy=False)
+    elif precision is not None:
+        raise ValueError(f" Précision inconnue : {precision}")
+
+    with chrono("preparation"):
+        masque_valide = ~np.isnan(chla)
+        chla0 = np.where(masque_valide, chla, 0)
+        M1 = np.where(masque_valide, 1, np.nan)
+        if dtype_calcul is not None:
+            M1 = M1.astype(dtype_calcul)
+        if pixels is not None:
+            if cache_rayons is not None:
+                raise ValueError(" Le cache par rayon porte sur la grille entière, pas sur des pixels")
+            # Sans donnée (dans aucun jour de la pile), l'indice d'un pixel est NaN : inutile de l'évaluer
+            pixels = np.asarray(pixels, dtype=np.intp)
+            valide_plat = masque_valide.reshape((-1,) + (chla.shape[-2] * chla.shape[-1],)).any(axis=0)
+            pixels = pixels[valide_plat[pixels]]
+
+    # Rayons (ou couples) à convoluer : tous, ou seulement ceux absents du cache
+    a_calculer = cles
+    if cache_rayons is not None:
+        if date is None or chla.ndim != 2:
+            raise ValueError(" Le cache par rayon demande une carte 2D et sa date")
+        if recherche == "grossiere":
+            raise ValueError(" La recherche grossière n'utilise pas le cache par rayon")
+        a_calculer = [r1 for r1 in r1_vals if not cache_rayons.contient(date, alpha, r1)]
+
+    # Choix sur la liste complète : même moteur, donc mêmes valeurs, quelle que soit la recherche
+    if moteur == "auto" or (alphas is not None and moteur == "fft"):
+        moteur = choix_moteur(cles_tous, alpha, masques_cache)
+
+    if moteur == "spectral":
+        # FFT dans la précision de la donnée d'entrée (float32 -> complex64), comme fftconvolve
+        dtype = dtype_fft(chla.dtype)
+        if (spectres_cache is None or spectres_cache["shape"] != chla.shape[-2:]
+                or spectres_cache["dtype"] != dtype or any(r1 not in spectres_cache["spectres"] for r1 in a_calculer)):
+            # Spectres sur tous les rayons : la taille de FFT dépend du plus grand
+            spectres_cache = precompute_spectres(chla.shape[-2:], cles_tous, alpha, masques_cache, dtype)
+    elif moteur not in ("fft", "cordes"):
+        raise ValueError(f" Moteur de convolution inconnu : {moteur}")
+
+    def convoluer(rayons, jour=()):
+        if len(rayons) == 0:
+            return iter(())
+        chla0, masque_valide = chla0_pile[jour], masque_valide_pile[jour]
+        if moteur == "fft":
+            convolutions = _convolutions_fft(chla0, masque_valide.astype(dtype_calcul or float), rayons, masques_cache)
+        elif moteur == "spectral":
+            convolutions = _convolutions_spectrales(chla0, masque_valide.astype(dtype), rayons, spectres_cache)
+        else:
+            convolutions = _convolutions_cordes(chla0, masque_valide, rayons, masques_cache)
+        return iterer(convolutions, "convolution", par_rayon=True)
+
+    chla0_pile, masque_valide_pile = chla0, masque_valide
+
+    if recherche == "grossiere":
+        with sp_fft.set_workers(workers or 1), chrono("reduction"):
+            sorties = _recherche_grossiere(chla0, masque_valide, M1, r1_vals, masques_cache, convoluer, seuil_couv,
+                                           penal_lambda, r_crit, pas_grossier, dtype_calcul, chla.dtype)
+        if pixels is None:
+            return sorties
+        return _decompresser([s.reshape(s.shape[:-2] + (-1,))[..., pixels] for s in sorties], pixels, chla.shape)
+
+    convolutions, shape = convoluer(a_calculer), chla.shape
+    if pixels is not None:
+        convolutions = _compresser(convolutions, pixels)
+        M1 = M1.reshape(M1.shape[:-2] + (-1,))[..., pixels]
+        shape = chla.shape[:-2] + (len(pixels),)
+    moyennes = iterer(_moyennes(convolutions, M1, dtype_calcul), "moyennes")
+    if alphas is not None:
+        with sp_fft.set_workers(workers or 1), chrono("reduction"):
+            sorties = _reduction_alphas(moyennes, alphas, np.asarray(r1_tous), shape, chla.dtype, seuil_couv,
+                                        penal_lambda, r_crit)
+        return sorties if pixels is None else {a: _decompresser(s, pixels, chla.shape) for a, s in sorties.items()}
+    if cache_rayons is not None:
+        moyennes = iterer(cache_rayons.completer(moyennes, r1_vals, a_calculer, date, alpha, masques_cache),
+                          "cache_rayons")
+
+    if reduction == "pile":
+        reduire = _reduction_pile
+    elif reduction == "flux":
+        reduire = _reduction_flux
+    else:
+        raise ValueError(f" Réduction inconnue : {reduction}")
+
+    # Les convolutions sont évaluées paresseusement pendant la réduction
+    candidats = iterer(_candidats(moyennes, seuil_couv, penal_lambda, r_crit), "candidats")
+    with sp_fft.set_workers(workers or 1), chrono("reduction"):
+        sorties = reduire(candidats, r1_vals, shape, chla.dtype)
+    return sorties if pixels is None else _decompresser(sorties, pixels, chla.shape)
+
+
+def calc_index_optim_batch(chla_stack, r1_vals=R1_LIST, alpha=ALPHA, seuil_couv=SEUIL_COUVERTURE,
+                           masques_cache=None, moteur="fft", spectres_cache=None, reduction="pile",
+                           precision=None, workers=None, recherche="exhaustive", pas_grossier=PAS_GROSSIER):
+    """
+    Calcule l'indice spatial optimisé d'un bloc de jours (ntime, nlat, nlon) en un seul appel :
+    les convolutions portent sur toute la pile à la fois (transformées, sommes cumulées et
+    spectres des noyaux partagés par les jours). Mêmes valeurs par défaut que calc_index_optim :
+    résultats identiques à calc_index_optim jour par jour avec les mêmes `moteur` et `reduction`
+    (la réduction "flux" borne la mémoire, pour le même résultat).
+    Retourne les quatre sorties empilées (ntime, nlat, nlon).
+    """
+    if chla_stack.ndim != 3:
+        raise ValueError(f" Bloc attendu de forme (ntime, nlat, nlon), reçu : {chla_stack.shape}")
+    return calc_index_optim(chla_stack, r1_vals=r1_vals, alpha=alpha, seuil_couv=seuil_couv,
+                            masques_cache=masques_cache, moteur=moteur, spectres_cache=spectres_cache,
+                            reduction=reduction, precision=precision, workers=workers,
+                            recherche=recherche, pas_grossier=pas_grossier)
+
+
+def remplacer_atomique(temporaire, chemin):
+    """
+    Synchronise le fichier `temporaire` sur disque, le renomme en `chemin` puis synchronise le
+    dossier : après un arrêt brutal, `chemin` est l'ancien fichier ou le nouveau complet.
+    """
+    with open(temporaire, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(temporaire, chemin)
+    dossier = os.open(os.path.dirname(os.path.abspath(chemin)), os.O_RDONLY)
+    try:
+        os.fsync(dossier)
+    finally:
+        os.close(dossier)
+
+
 def sauvegarde_index_netcdf_standard(idx_max, r1_best, moy_int, moy_ext, lat, lon, file, output_dir, verbose=False):
     """
     Sauvegarde standardisée du fichier NetCDF journalier contenant l'indice spatial.
@@ -124,9 +823,11 @@ def sauvegarde_index_netcdf_standard(idx_max, r1_best, moy_int, moy_ext, lat, lo
     os.makedirs(output_dir, exist_ok=True)
     output_path = os.path.join(output_dir, f"Word_index_r1_{date_str}.nc")
 
-    ds.to_netcdf(output_path, format="NETCDF4", encoding={
+    # Fichier temporaire renommé une fois complet : jamais de fichier final tronqué
+    ds.to_netcdf(output_path + ".tmp", format="NETCDF4", encoding={
         var: {"zlib": True, "complevel": 4} for var in ds.data_vars
     })
+    remplacer_atomique(output_path + ".tmp", output_path)
 
     if verbose:
         print(f" Fichier NetCDF sauvegardé : {output_path}")
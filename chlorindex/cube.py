@@ -0,0 +1,239 @@
+# cube.py
+"""
+Cube d'entrée prétraité : l'archive L3m chlor_a convertie une fois en fichiers .npy annuels non
+compressés (un pas par jour de l'année), projetables en mémoire, avec un index des dates écrites
+et les coordonnées lat/lon communes stockées une seule fois. Les retraitements lisent alors des
+tranches journalières sans décompression zlib ni décodage xarray : en float32, la tranche est
+une vue du fichier (aucune copie) et les valeurs sont celles du fichier L3m ; en uint16, le log10
+de la chlorophylle est codé au pas de 1e-4 (erreur relative < 1.2e-4, volume divisé par deux).
+Volume d'une année : 13,6 Go en float32 à 9 km, 54 Go à 4 km (fichiers creux tant que
+l'archive n'est pas complète). Le cube est créé et complété par run_index.py --cube.
+Auteur : Marc Francescon
+Date : Avril 2025
+"""
+
+import os
+import json
+from datetime import date as _date
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import xarray as xr
+
+FICHIER_INDEX = "index_cube.json"
+FICHIER_COORDONNEES = "coordonnees.npz"
+CODAGES = ("float32", "uint16")
+# Codage uint16 : q = 1 + arrondi((log10(chla) - DECALAGE_LOG) / PAS_LOG), 0 pour NaN.
+# Plage 1e-3 à 3,5e3 mg m-3 ; valeurs hors plage écrêtées.
+PAS_LOG = 1e-4
+DECALAGE_LOG = -3.0
+TAILLE_LECTURE = 1 << 24  # Octets lus par appel pour précharger un jour
+
+
+def chemin_annee(dossier, annee):
+    return os.path.join(dossier, f"chla_{annee}.npy")
+
+
+def position_jour(date_str):
+    """
+    (année, rang du jour dans l'année) d'une date YYYYMMDD.
+    """
+    jour = _date(int(date_str[:4]), int(date_str[4:6]), int(date_str[6:]))
+    return jour.year, jour.timetuple().tm_yday - 1
+
+
+def encoder(chla, codage):
+    if codage == "float32":
+        return chla.astype(np.float32, copy=False)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        q = np.rint((np.log10(chla) - DECALAGE_LOG) / PAS_LOG) + 1
+    return np.where(np.isnan(chla), 0, np.clip(np.nan_to_num(q, neginf=1), 1, 65535)).astype(np.uint16)
+
+
+def decoder(brut, codage):
+    if codage == "float32":
+        return brut
+    chla = np.power(np.float32(10), (brut.astype(np.float32) - 1) * np.float32(PAS_LOG) + np.float32(DECALAGE_LOG))
+    chla[brut == 0] = np.nan
+    return chla
+
+
+def lire_index(dossier):
+    with open(os.path.join(dossier, FICHIER_INDEX)) as f:
+        return json.load(f)
+
+
+def _ecrire_index(dossier, index):
+    chemin = os.path.join(dossier, FICHIER_INDEX)
+    with open(chemin + ".tmp", "w") as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(chemin + ".tmp", chemin)
+
+
+def _creer_annee(path, annee, shape, codage):
+    """
+    Crée le fichier d'une année : un pas par jour, non initialisé (fichier creux).
+    """
+    n_jours = (_date(annee + 1, 1, 1) - _date(annee, 1, 1)).days
+    cube = np.lib.format.open_memmap(path + ".tmp", mode="w+", dtype=codage, shape=(n_jours,) + tuple(shape))
+    del cube
+    os.replace(path + ".tmp", path)
+
+
+def _ingerer_jour(dossier, chemin, date_str, variable, codage, shape):
+    """
+    Lit un fichier L3m et écrit sa carte codée à sa place dans le fichier de son année.
+    """
+    with xr.open_dataset(chemin, engine="netcdf4") as ds:
+        if variable not in ds:
+            raise KeyError(f"La variable '{variable}' est absente du fichier {os.path.basename(chemin)}")
+        chla = ds[variable].squeeze().values.astype(np.float32)
+    if chla.shape != tuple(shape):
+        raise ValueError(f" Grille {chla.shape} différente de celle du cube {tuple(shape)}")
+    annee, k = position_jour(date_str)
+    cube = np.load(chemin_annee(dossier, annee), mmap_mode="r+")
+    cube[k] = encoder(chla, codage)
+    cube.flush()
+    return date_str
+
+
+def ingerer(chemin_chla, dossier, jours, variable="chlor_a", codage=None, workers=None):
+    """
+    Complète le cube `dossier` avec les `jours` [(date, fichier)] de `chemin_chla` qu'il ne
+    contient pas encore (un processus par fichier). Un jour n'entre dans l'index qu'une fois écrit
+    et synchronisé ; l'index est réécrit tous les 32 jours. `codage` : celui d'un nouveau cube
+    ("float32" par défaut) ; un cube existant garde le sien. Retourne l'index du cube.
+    """
+    os.makedirs(dossier, exist_ok=True)
+    if os.path.exists(os.path.join(dossier, FICHIER_INDEX)):
+        index = lire_index(dossier)
+        if index["variable"] != variable or codage not in (None, index["codage"]):
+            raise ValueError(f" Cube {dossier} en {index['variable']} / {index['codage']}, "
+                             f"demandé : {variable} / {codage}")
+        codage = index["codage"]
+    else:
+        codage = codage or "float32"
+        if codage not in CODAGES:
+            raise ValueError(f" Codage inconnu : {codage}")
+        with xr.open_dataset(os.path.join(chemin_chla, jours[0][1])) as ds:
+            lat, lon = ds["lat"].values, ds["lon"].values
+        np.savez(os.path.join(dossier, FICHIER_COORDONNEES), lat=lat, lon=lon)
+        index = {"variable": variable, "codage": codage, "shape": [len(lat), len(lon)], "jours": {}}
+        _ecrire_index(dossier, index)
+
+    nouveaux = [(d, f) for d, f in jours if d not in index["jours"]]
+    if not nouveaux:
+        return index
+    for annee in sorted({position_jour(d)[0] for d, _ in nouveaux}):
+        if not os.path.exists(chemin_annee(dossier, annee)):
+            _creer_annee(chemin_annee(dossier, annee), annee, index["shape"], codage)
+
+    fichiers = dict(nouveaux)
+    workers = min(workers or os.cpu_count() or 1, len(nouveaux))
+    n_erreurs = 0
+    with ProcessPoolExecutor(workers) as pool:
+        futurs = [pool.submit(_ingerer_jour, dossier, os.path.join(chemin_chla, f), d, variable, codage,
+                              index["shape"]) for d, f in nouveaux]
+        for n, futur in enumerate(futurs, 1):
+            try:
+                date_str = futur.result()
+                index["jours"][date_str] = fichiers[date_str]
+            except Exception as e:
+                n_erreurs += 1
+                print(f" Cube : erreur sur {nouveaux[n - 1][1]} : {e}")
+            if n % 32 == 0:
+                _ecrire_index(dossier, index)
+    _ecrire_index(dossier, index)
+    print(f" Cube : {len(nouveaux) - n_erreurs} jours ajoutés ({n_erreurs} erreurs), "
+          f"{len(index['jours'])} jours au total")
+    return index
+
+
+class CubeChla:
+    """
+    Lecture d'un cube : tranches journalières en float32 (vues du fichier projeté en mémoire
+    pour le codage float32), fenêtres régionales, et préchargement des jours à venir.
+    """
+
+    def __init__(self, dossier):
+        self.dossier = dossier
+        index = lire_index(dossier)
+        self.codage = index["codage"]
+        self.variable = index["variable"]
+        self.shape = tuple(index["shape"])
+        self.jours = index["jours"]
+        with np.load(os.path.join(dossier, FICHIER_COORDONNEES)) as z:
+            self.lat, self.lon = z["lat"], z["lon"]
+        self._annees = {}
+
+    def contient(self, date_str):
+        return date_str in self.jours
+
+    def dates(self):
+        return sorted(self.jours)
+
+    def _brut(self, date_str):
+        """
+        Tranche codée d'un jour : vue du fichier de son année, sans lecture.
+        """
+        if date_str not in self.jours:
+            raise KeyError(f" Jour {date_str} absent du cube {self.dossier}")
+        annee, k = position_jour(date_str)
+        if annee not in self._annees:
+            self._annees[annee] = np.load(chemin_annee(self.dossier, annee), mmap_mode="r")
+        return self._annees[annee][k]
+
+    def octets_jour(self):
+        return int(np.prod(self.shape)) * np.dtype(self.codage).itemsize
+
+    def precharger(self, date_str):
+        """
+        Amène la tranche d'un jour dans le cache de pages du système (lecture séquentielle par
+        blocs, sans copie conservée) : son calcul ne sera pas ralenti par des défauts de page.
+        """
+        self._brut(date_str)
+        annee, k = position_jour(date_str)
+        debut = self._annees[annee].offset + k * self.octets_jour()  # En-tête .npy, puis jours précédents
+        tampon = bytearray(min(TAILLE_LECTURE, self.octets_jour()))
+        with open(chemin_annee(self.dossier, annee), "rb", buffering=0) as f:
+            f.seek(debut)
+            reste = self.octets_jour()
+            while reste > 0:
+                n = f.readinto(memoryview(tampon)[:min(reste, len(tampon))])
+                if not n:
+                    break
+                reste -= n
+
+    def jour(self, date_str):
+        """
+        Carte (nlat, nlon) float32 d'un jour, en lecture seule : vue du fichier en float32,
+        décodée en uint16.
+        """
+        return decoder(self._brut(date_str), self.codage)
+
+    def fenetre(self, date_str, i, j):
+        """
+        Fenêtre (i, j) de fenetre_boite d'un jour : seules ses lignes et colonnes sont lues et
+        décodées ; colonnes repliées en longitude, NaN au-delà des pôles.
+        """
+        nlat, nlon = self.shape
+        i_ok = np.flatnonzero((i >= 0) & (i < nlat))
+        bande = self._brut(date_str)[i[i_ok[0]]:i[i_ok[-1]] + 1]
+        chla = np.full((len(i), len(j)), np.nan, dtype=np.float32)
+        chla[i_ok] = decoder(bande[:, j % nlon], self.codage)
+        return chla
+
+    def iterer_jours(self, dates, avance=2):
+        """
+        Produit (date, carte) pour chaque date, les `avance` jours suivants étant préchargés
+        en tâche de fond pendant le traitement du jour courant.
+        """
+        with ThreadPoolExecutor(max_workers=1) as lecteur:
+            prechargements = [lecteur.submit(self.precharger, d) for d in dates[:avance]]
+            for k, date_str in enumerate(dates):
+                prechargements.pop(0).result()
+                if k + avance < len(dates):
+                    prechargements.append(lecteur.submit(self.precharger, dates[k + avance]))
+                yield date_str, self.jour(date_str)
@@ -0,0 +1,245 @@
+# extraction.py
+"""
+Extraction de séries temporelles de l'indice spatial en des points (lat, lon) ou sur des boîtes,
+depuis l'archive journalière (Word_index_r1_YYYYMMDD.nc) ou annuelle (Word_index_r1_YYYY.nc).
+Seuls les chunks utiles sont lus, un fichier par processus ; copie « temps majeur » de l'archive
+pour les requêtes ponctuelles sur toute la période.
+Auteur : Marc Francescon
+Date : Avril 2025
+"""
+
+import os
+import re
+from datetime import date as _date, timedelta
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import netCDF4
+import xarray as xr
+
+from .config import R1_LIST
+from .stockage import VARIABLES, code_r1, chemin_annuel, _creer_annuel
+
+CHUNKS_TEMPS_MAJEUR = (366, 36, 36)  # Une année d'un carré de 36 x 36 pixels par chunk (~1,9 Mo en float32)
+BLOC_COPIE = (180, 1080)  # Bloc spatial recopié d'un coup (multiple des chunks, ~1 Go pour une année)
+
+
+def lister_sources(archive_dir, debut=None, fin=None):
+    """
+    Fichiers de l'archive couvrant [debut, fin] (YYYYMMDD, inclus), triés :
+    [(chemin, [(date YYYYMMDD, indice temps), ...])]. Les fichiers annuels ne listent que
+    les jours effectivement écrits.
+    """
+    sources = []
+    for f in sorted(os.listdir(archive_dir)):
+        m = re.fullmatch(r"Word_index_r1_(\d{8}|\d{4})\.nc", f)
+        if not m:
+            continue
+        chemin = os.path.join(archive_dir, f)
+        if len(m.group(1)) == 8:
+            jours = [(m.group(1), 0)]
+        else:
+            annee = int(m.group(1))
+            if (debut and f"{annee}1231" < debut) or (fin and f"{annee}0101" > fin):
+                continue
+            with netCDF4.Dataset(chemin) as nc:
+                ecrit = np.asarray(nc["jour_ecrit"][:]).astype(bool)
+            jours = [((_date(annee, 1, 1) + timedelta(days=int(k))).strftime("%Y%m%d"), int(k))
+                     for k in np.flatnonzero(ecrit)]
+        jours = [(d, k) for d, k in jours if not ((debut and d < debut) or (fin and d > fin))]
+        if jours:
+            sources.append((chemin, jours))
+    return sources
+
+
+def _decoder(var, brut):
+    """
+    Valeurs physiques en float32 : _FillValue -> NaN, codes de r1_best -> rayons, scale/offset.
+    """
+    fill = getattr(var, "_FillValue", None)
+    manquant = (np.isnan(brut) if brut.dtype.kind == "f" else
+                (brut == fill) if fill is not None else np.zeros(brut.shape, dtype=bool))
+    if hasattr(var, "valeurs_r1"):
+        valeurs = np.append(np.asarray(var.valeurs_r1, dtype=np.float32), np.nan)
+        out = valeurs[np.where(manquant, len(valeurs) - 1, brut)]
+    elif hasattr(var, "scale_factor"):
+        out = (brut * np.float64(var.scale_factor) + np.float64(getattr(var, "add_offset", 0.0))).astype(np.float32)
+    else:
+        out = brut.astype(np.float32)
+    out[manquant] = np.nan
+    return out
+
+
+def _fenetres_points(ii, jj, chunk):
+    """
+    Regroupe les points par chunk spatial : [(i0, i1, j0, j1, indices des points)].
+    Une seule lecture (la plus petite fenêtre couvrante) par chunk touché.
+    """
+    cles = np.stack([ii // chunk[0], jj // chunk[1]], axis=1)
+    groupes = []
+    for cle in np.unique(cles, axis=0):
+        sel = np.flatnonzero((cles == cle).all(axis=1))
+        groupes.append((ii[sel].min(), ii[sel].max() + 1, jj[sel].min(), jj[sel].max() + 1, sel))
+    return groupes
+
+
+def _lire_source(chemin, jours, variables, ii=None, jj=None, boites=None):
+    """
+    Lit un fichier : séries aux points (ii, jj) -> {var: (n_jours, n_points)}, ou sous-grilles des
+    boîtes [(i0, i1, [(j0, j1), ...])] -> [{var: (n_jours, ni, nj)}]. Les jours d'un fichier
+    annuel sont lus en une seule plage de temps.
+    """
+    k = np.array([kt for _, kt in jours])
+    k0, k1 = k.min(), k.max() + 1
+    with netCDF4.Dataset(chemin) as nc:
+        nc.set_auto_maskandscale(False)
+        if boites is None:
+            sortie = {}
+            for nom in variables:
+                var = nc[nom]
+                chunk = var.chunking()
+                chunk = var.shape[1:] if chunk == "contiguous" else chunk[1:]
+                valeurs = np.empty((len(k), len(ii)), dtype=np.float32)
+                for i0, i1, j0, j1, sel in _fenetres_points(ii, jj, chunk):
+                    bloc = _decoder(var, var[k0:k1, i0:i1, j0:j1])[k - k0]
+                    valeurs[:, sel] = bloc[:, ii[sel] - i0, jj[sel] - j0]
+                sortie[nom] = valeurs
+            return sortie
+
+        sortie = []
+        for i0, i1, plages in boites:
+            sortie.append({nom: np.concatenate([_decoder(nc[nom], nc[nom][k0:k1, i0:i1, j0:j1])[k - k0]
+                                                for j0, j1 in plages], axis=-1)
+                           for nom in variables})
+        return sortie
+
+
+def _indices_plus_proches(grille, valeurs, periodique=False):
+    if periodique:
+        ecart = np.abs((np.asarray(valeurs)[:, None] - grille[None, :] + 180) % 360 - 180)
+    else:
+        ecart = np.abs(np.asarray(valeurs)[:, None] - grille[None, :])
+    return ecart.argmin(axis=1)
+
+
+def _coordonnees(sources):
+    with netCDF4.Dataset(sources[0][0]) as nc:
+        return nc["lat"][:].data, nc["lon"][:].data
+
+
+def _executer(fonction, sources, args, workers):
+    """
+    Applique `fonction(chemin, jours, *args)` à chaque source, en parallèle sur `workers` processus
+    (la bibliothèque netCDF-C n'étant pas thread-safe). Résultats dans l'ordre des sources.
+    """
+    if workers == 1 or len(sources) == 1:
+        return [fonction(chemin, jours, *args) for chemin, jours in sources]
+    with ProcessPoolExecutor(workers) as pool:
+        futurs = [pool.submit(fonction, chemin, jours, *args) for chemin, jours in sources]
+        return [f.result() for f in futurs]
+
+
+def _temps(sources):
+    return pd.to_datetime([d for _, jours in sources for d, _ in jours], format="%Y%m%d")
+
+
+def extraire_points(archive_dir, points, debut=None, fin=None, variables=VARIABLES, workers=None):
+    """
+    Séries temporelles au pixel le plus proche de chaque point [(lat, lon), ...].
+    Retourne un Dataset (time, point) ; `.to_dataframe()` pour un tableau pandas.
+    """
+    sources = lister_sources(archive_dir, debut, fin)
+    if not sources:
+        raise FileNotFoundError(f" Aucun fichier d'indice entre {debut} et {fin} dans {archive_dir}")
+    lat, lon = _coordonnees(sources)
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    ii = _indices_plus_proches(lat, points[:, 0])
+    jj = _indices_plus_proches(lon, points[:, 1], periodique=True)
+
+    resultats = _executer(_lire_source, sources, (variables, ii, jj), workers or os.cpu_count() or 1)
+    donnees = {nom: (("time", "point"), np.concatenate([r[nom] for r in resultats])) for nom in variables}
+    return xr.Dataset(donnees, coords={
+        "time": _temps(sources),
+        "lat": ("point", lat[ii]), "lon": ("point", lon[jj]),
+        "lat_demandee": ("point", points[:, 0]), "lon_demandee": ("point", points[:, 1]),
+    })
+
+
+def _plages_boite(lat, lon, boite):
+    """
+    (i0, i1, [(j0, j1), ...]) d'une boîte (lat_min, lat_max, lon_min, lon_max) ;
+    lon_min > lon_max désigne une boîte à cheval sur le méridien ±180° (deux plages).
+    """
+    lat_min, lat_max, lon_min, lon_max = boite
+    i = np.flatnonzero((lat >= lat_min) & (lat <= lat_max))
+    if lon_min <= lon_max:
+        plages = [np.flatnonzero((lon >= lon_min) & (lon <= lon_max))]
+    else:
+        plages = [np.flatnonzero(lon >= lon_min), np.flatnonzero(lon <= lon_max)]
+    plages = [(j[0], j[-1] + 1) for j in plages if len(j)]
+    if len(i) == 0 or not plages:
+        raise ValueError(f" Boîte vide sur la grille : {boite}")
+    return i[0], i[-1] + 1, plages
+
+
+def extraire_boites(archive_dir, boites, debut=None, fin=None, variables=VARIABLES, workers=None):
+    """
+    Sous-grilles (time, lat, lon) de chaque boîte (lat_min, lat_max, lon_min, lon_max).
+    Retourne une liste de Datasets, un par boîte.
+    """
+    sources = lister_sources(archive_dir, debut, fin)
+    if not sources:
+        raise FileNotFoundError(f" Aucun fichier d'indice entre {debut} et {fin} dans {archive_dir}")
+    lat, lon = _coordonnees(sources)
+    plages = [_plages_boite(lat, lon, b) for b in boites]
+
+    resultats = _executer(_lire_source, sources, (variables, None, None, plages), workers or os.cpu_count() or 1)
+    temps = _temps(sources)
+    sorties = []
+    for b, (i0, i1, plages_j) in enumerate(plages):
+        lon_b = np.concatenate([lon[j0:j1] for j0, j1 in plages_j])
+        donnees = {nom: (("time", "lat", "lon"), np.concatenate([r[b][nom] for r in resultats]))
+                   for nom in variables}
+        sorties.append(xr.Dataset(donnees, coords={"time": temps, "lat": lat[i0:i1], "lon": lon_b}))
+    return sorties
+
+
+def copie_temps_majeur(archive_dir, destination, debut=None, fin=None, r1_vals=R1_LIST,
+                       chunks=CHUNKS_TEMPS_MAJEUR, bloc=BLOC_COPIE, workers=None):
+    """
+    Recopie l'archive (journalière ou annuelle) en fichiers annuels chunkés par année entière
+    sur de petits carrés : une série ponctuelle sur dix ans ne lit alors qu'un chunk par an et
+    par variable. La copie est elle-même une archive annuelle lisible par extraire_points.
+    """
+    sources = lister_sources(archive_dir, debut, fin)
+    if not sources:
+        raise FileNotFoundError(f" Aucun fichier d'indice entre {debut} et {fin} dans {archive_dir}")
+    lat, lon = _coordonnees(sources)
+    os.makedirs(destination, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+
+    for annee in sorted({int(d[:4]) for _, jours in sources for d, _ in jours}):
+        sources_annee = [(c, [(d, k) for d, k in jours if int(d[:4]) == annee]) for c, jours in sources]
+        sources_annee = [(c, jours) for c, jours in sources_annee if jours]
+        path = chemin_annuel(destination, annee)
+        _creer_annuel(path, annee, lat, lon, r1_vals, False, chunks)
+        k_annee = np.array([(_date(int(d[:4]), int(d[4:6]), int(d[6:])) - _date(annee, 1, 1)).days
+                            for _, jours in sources_annee for d, _ in jours])
+
+        for i0 in range(0, len(lat), bloc[0]):
+            for j0 in range(0, len(lon), bloc[1]):
+                i1, j1 = min(i0 + bloc[0], len(lat)), min(j0 + bloc[1], len(lon))
+                resultats = _executer(_lire_source, sources_annee, (VARIABLES, None, None, [(i0, i1, [(j0, j1)])]),
+                                      workers)
+                with netCDF4.Dataset(path, "a") as nc:
+                    nc.set_auto_maskandscale(False)
+                    for nom in VARIABLES:
+                        # Année complète du bloc : chunks écrits en entier, jours absents au _FillValue
+                        valeurs = np.full((nc.dimensions["time"].size, i1 - i0, j1 - j0), np.nan, dtype=np.float32)
+                        valeurs[k_annee] = np.concatenate([r[0][nom] for r in resultats])
+                        if nom == "r1_best":
+                            valeurs = code_r1(valeurs, r1_vals)
+                        nc[nom][:, i0:i1, j0:j1] = valeurs
+        with netCDF4.Dataset(path, "a") as nc:
+            nc["jour_ecrit"][k_annee] = 1
@@ -0,0 +1,83 @@
+# journal.py
+"""
+Journal des jours calculés (JSON Lines, une ligne par jour écrit) : date, fichier de sortie,
+taille et paramètres du calcul. Une ligne n'est ajoutée qu'une fois le fichier de sortie écrit
+en entier ; une reprise ne refait donc que les jours absents du journal ou calculés avec d'autres
+paramètres, sans relire l'archive, et ne fait jamais confiance à un fichier qu'il ne cite pas.
+Auteur : Marc Francescon
+Date : Avril 2025
+"""
+
+import os
+import json
+import time
+import fcntl
+
+FICHIER_JOURNAL = "journal_index.jsonl"
+
+
+def chemin_journal(output_dir):
+    return os.path.join(output_dir, FICHIER_JOURNAL)
+
+
+def _normaliser(parametres):
+    # Tuples, tableaux numpy convertis en amont : comparaison sur la forme relue du JSON
+    return json.loads(json.dumps(parametres, sort_keys=True))
+
+
+def enregistrer(chemin, date, fichier, parametres, **autres):
+    """
+    Ajoute la ligne d'un jour terminé, sous verrou (plusieurs processus écrivent le même
+    journal) et synchronisée sur disque avant de rendre la main. Si le journal se termine par
+    une ligne tronquée (arrêt pendant un ajout), elle est d'abord close : la nouvelle ligne
+    ne s'y colle pas.
+    """
+    ligne = json.dumps(dict(date=date, fichier=fichier, parametres=parametres,
+                            fin=time.strftime("%Y-%m-%dT%H:%M:%S"), **autres), sort_keys=True)
+    with open(chemin, "ab+") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        fin = f.seek(0, os.SEEK_END)
+        if fin:
+            f.seek(fin - 1)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+        f.write((ligne + "\n").encode())
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def lire_journal(chemin):
+    """
+    Dernière ligne de chaque date : {date: entrée}. Une ligne tronquée (arrêt pendant l'ajout)
+    est ignorée.
+    """
+    entrees = {}
+    if not os.path.exists(chemin):
+        return entrees
+    with open(chemin) as f:
+        for ligne in f:
+            try:
+                entree = json.loads(ligne)
+            except json.JSONDecodeError:
+                continue
+            entrees[entree["date"]] = entree
+    return entrees
+
+
+def jours_termines(chemin, parametres, output_dir):
+    """
+    Dates terminées avec `parametres` : citées par le journal, avec un fichier de sortie présent
+    (et de la taille notée pour un fichier journalier). Un simple `stat` par jour, aucune lecture.
+    """
+    parametres = _normaliser(parametres)
+    termines = set()
+    for date, entree in lire_journal(chemin).items():
+        if entree["parametres"] != parametres:
+            continue
+        try:
+            taille = os.path.getsize(os.path.join(output_dir, entree["fichier"]))
+        except OSError:
+            continue
+        if entree.get("taille") in (None, taille):
+            termines.add(date)
+    return termines
@@ -0,0 +1,80 @@
+# masque_ocean.py
+"""
+Masque statique des pixels « jamais valides » (terres, glaces permanentes) : union des pixels
+valides de tous les jours de l'archive L3m, dérivée une fois puis enregistrée en NetCDF avec
+la liste des jours déjà pris en compte (les jours nouveaux la complètent sans tout relire).
+Le calcul, l'écriture annuelle et les vérifications se restreignent ensuite à ces pixels
+(voir l'option --masque-ocean de run_index.py).
+Auteur : Marc Francescon
+Date : Avril 2025
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import netCDF4
+import xarray as xr
+
+FICHIER_MASQUE = "masque_ocean.nc"
+
+
+def _valides(chemin, variable):
+    with xr.open_dataset(chemin, engine="netcdf4") as ds:
+        return np.isfinite(ds[variable].squeeze().values)
+
+
+def lire_masque_ocean(path):
+    """
+    Masque (nlat, nlon) booléen et ensemble des dates (YYYYMMDD) dont il est l'union.
+    """
+    with netCDF4.Dataset(path) as nc:
+        masque = np.asarray(nc["ocean"][:]).astype(bool)
+        dates = {str(d) for d in np.asarray(nc["date"][:])}
+    return masque, dates
+
+
+def sauver_masque_ocean(path, masque, lat, lon, dates):
+    """
+    Écrit le masque et la liste des dates dans un fichier temporaire, renommé une fois complet.
+    """
+    with netCDF4.Dataset(path + ".tmp", "w", format="NETCDF4") as nc:
+        nc.createDimension("lat", len(lat))
+        nc.createDimension("lon", len(lon))
+        nc.createDimension("jour", len(dates))
+        nc.createVariable("lat", np.asarray(lat).dtype, ("lat",))[:] = lat
+        nc.createVariable("lon", np.asarray(lon).dtype, ("lon",))[:] = lon
+        v = nc.createVariable("ocean", "u1", ("lat", "lon"), zlib=True)
+        v.comment = "1 : pixel valide au moins un jour de l'archive ; 0 : jamais valide"
+        v[:] = masque.astype(np.uint8)
+        nc.createVariable("date", "i4", ("jour",))[:] = np.array(sorted(int(d) for d in dates), dtype=np.int32)
+    os.replace(path + ".tmp", path)
+
+
+def deriver_masque_ocean(chemin_chla, jours, path, variable="chlor_a", workers=None):
+    """
+    Masque des pixels valides au moins un jour parmi les `jours` [(date, fichier)] de `chemin_chla` :
+    relu depuis `path` et complété des seuls jours absents (un processus par fichier), réécrit si
+    des jours ont été ajoutés. Retourne le masque (nlat, nlon) booléen.
+    """
+    masque, dates = lire_masque_ocean(path) if os.path.exists(path) else (None, set())
+    nouveaux = [(d, f) for d, f in jours if d not in dates]
+    if not nouveaux:
+        return masque
+
+    chemins = [os.path.join(chemin_chla, f) for _, f in nouveaux]
+    workers = min(workers or os.cpu_count() or 1, len(chemins))
+    if workers == 1:
+        for v in map(_valides, chemins, [variable] * len(chemins)):
+            masque = v if masque is None else masque | v
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            for v in pool.map(_valides, chemins, [variable] * len(chemins), chunksize=8):
+                masque = v if masque is None else masque | v
+
+    with xr.open_dataset(chemins[0]) as ds:
+        lat, lon = ds["lat"].values, ds["lon"].values
+    sauver_masque_ocean(path, masque, lat, lon, dates | {d for d, _ in nouveaux})
+    print(f" Masque océan : {len(nouveaux)} jours ajoutés, {100 * masque.mean():.1f} % des pixels retenus")
+    return masque
+
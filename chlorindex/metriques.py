@@ -0,0 +1,226 @@
+# metriques.py
+"""
+Instrumentation optionnelle du calcul : chronomètres par étape (temps exclusif, les étapes
+imbriquées sont déduites de l'étape englobante), temps de convolution par rayon, octets lus
+et écrits, pic de mémoire. Inactive par défaut (aucun coût) ; activée pour un jour avec
+`collecte`, dans le fil d'exécution courant. Un fichier JSON par jour, puis `rapport`
+agrège un dossier de métriques : débit en jours par heure et répartition du temps.
+
+Exemple :
+    python chlorindex/metriques.py ~/Monde_IE_2003_2013/metriques
+Auteur : Marc Francescon
+Date : Avril 2025
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import threading
+from contextlib import contextmanager
+
+_LOCAL = threading.local()  # Collecte active et pile des chronomètres, propres à chaque fil
+
+
+def nouvelle_mesure(date=None, execution=None):
+    """
+    Enregistrement vide des métriques d'un jour.
+    """
+    return {"date": date, "execution": execution, "debut": time.time(), "fin": None,
+            "temps": {}, "rayons": {}, "octets": {}, "pic_memoire_mo": None}
+
+
+@contextmanager
+def collecte(mesure):
+    """
+    Active `mesure` (voir nouvelle_mesure) dans le fil courant : chrono, iterer et compter
+    y accumulent leurs résultats jusqu'à la sortie du bloc.
+    """
+    precedente = getattr(_LOCAL, "mesure", None), getattr(_LOCAL, "pile", None)
+    _LOCAL.mesure, _LOCAL.pile = mesure, []
+    try:
+        yield mesure
+    finally:
+        _LOCAL.mesure, _LOCAL.pile = precedente
+
+
+def active():
+    return getattr(_LOCAL, "mesure", None) is not None
+
+
+@contextmanager
+def chrono(etape):
+    """
+    Ajoute au temps exclusif de `etape` la durée du bloc, diminuée de celle des chronomètres
+    imbriqués. Produit un dictionnaire où ce temps exclusif est noté ("duree") en sortie.
+    Sans collecte active : ne fait rien.
+    """
+    mesure = getattr(_LOCAL, "mesure", None)
+    resultat = {}
+    if mesure is None:
+        yield resultat
+        return
+    pile = _LOCAL.pile
+    pile.append(0.0)  # Durée des étapes imbriquées
+    t0 = time.perf_counter()
+    try:
+        yield resultat
+    finally:
+        duree = time.perf_counter() - t0
+        resultat["duree"] = duree - pile.pop()
+        if pile:
+            pile[-1] += duree
+        mesure["temps"][etape] = mesure["temps"].get(etape, 0.0) + resultat["duree"]
+
+
+def iterer(iterable, etape, par_rayon=False):
+    """
+    Chronomètre chaque élément produit par un générateur (évalué paresseusement) sous `etape`.
+    Avec `par_rayon`, le temps est aussi attribué au rayon, premier champ de chaque élément
+    (ou premier terme de ce champ, pour un couple (r1, alpha)).
+    Sans collecte active, retourne l'itérable tel quel.
+    """
+    if not active():
+        return iterable
+
+    def generateur():
+        iterateur = iter(iterable)
+        while True:
+            with chrono(etape) as resultat:
+                try:
+                    element = next(iterateur)
+                except StopIteration:
+                    return
+            if par_rayon:
+                rayons = _LOCAL.mesure["rayons"]
+                rayon = element[0][0] if isinstance(element[0], tuple) else element[0]
+                cle = f"{float(rayon):g}"
+                rayons[cle] = rayons.get(cle, 0.0) + resultat["duree"]
+            yield element
+
+    return generateur()
+
+
+def compter(cle, octets):
+    """
+    Ajoute `octets` au compteur `cle` ("lus", "ecrits"...) de la collecte active.
+    """
+    mesure = getattr(_LOCAL, "mesure", None)
+    if mesure is not None:
+        mesure["octets"][cle] = mesure["octets"].get(cle, 0) + int(octets)
+
+
+def pic_memoire_mo():
+    """
+    Pic de mémoire résidente du processus en Mo : depuis la dernière remise à zéro sous Linux
+    (VmHWM), depuis le démarrage ailleurs (ru_maxrss, en octets sous macOS).
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for ligne in f:
+                if ligne.startswith("VmHWM:"):
+                    return int(ligne.split()[1]) / 1e3
+    except OSError:
+        pass
+    pic = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pic / 1e6 if sys.platform == "darwin" else pic / 1e3
+
+
+def reinitialiser_pic_memoire():
+    """
+    Remet le pic de mémoire du processus à la mémoire actuelle (Linux seulement).
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def ecrire_mesure(dossier, mesure):
+    """
+    Écrit les métriques d'un jour dans `dossier/metriques_<date>.json` (remplace un calcul précédent
+    du même jour).
+    """
+    os.makedirs(dossier, exist_ok=True)
+    chemin = os.path.join(dossier, f"metriques_{mesure['date']}.json")
+    with open(chemin + ".tmp", "w") as f:
+        json.dump(mesure, f, indent=1)
+    os.replace(chemin + ".tmp", chemin)
+    return chemin
+
+
+def lire_mesures(dossier, execution=None):
+    mesures = []
+    for f in sorted(os.listdir(dossier)):
+        if f.startswith("metriques_") and f.endswith(".json"):
+            with open(os.path.join(dossier, f)) as fichier:
+                mesure = json.load(fichier)
+            if execution is None or mesure.get("execution") == execution:
+                mesures.append(mesure)
+    return mesures
+
+
+def rapport(dossier, execution=None, n_rayons=5):
+    """
+    Agrège les métriques journalières d'un dossier (d'une seule `execution` si donnée) : débit
+    en jours par heure (temps écoulé de chaque exécution, processus parallèles compris),
+    répartition du temps par étape, rayons les plus coûteux, volumes et pic de mémoire.
+    Retourne le dictionnaire agrégé.
+    """
+    mesures = lire_mesures(dossier, execution)
+    if not mesures:
+        print(f" Aucune métrique dans {dossier}")
+        return {}
+
+    # Temps écoulé : du premier début à la dernière fin de chaque exécution
+    executions = {}
+    for m in mesures:
+        debut, fin = executions.get(m.get("execution"), (m["debut"], m["fin"]))
+        executions[m.get("execution")] = (min(debut, m["debut"]), max(fin, m["fin"]))
+    ecoule = sum(fin - debut for debut, fin in executions.values())
+
+    temps, rayons, octets = {}, {}, {}
+    for m in mesures:
+        for source, cumul in ((m["temps"], temps), (m["rayons"], rayons), (m["octets"], octets)):
+            for cle, valeur in source.items():
+                cumul[cle] = cumul.get(cle, 0) + valeur
+    total = sum(temps.values())
+    agregat = {
+        "jours": len(mesures),
+        "executions": len(executions),
+        "temps_ecoule_s": ecoule,
+        "jours_par_heure": 3600 * len(mesures) / max(ecoule, 1e-9),
+        "temps_s": temps,
+        "rayons_s": rayons,
+        "octets": octets,
+        "pic_memoire_mo": max((m["pic_memoire_mo"] or 0) for m in mesures),
+        "jour_le_plus_lent": max(mesures, key=lambda m: m["fin"] - m["debut"])["date"],
+    }
+
+    print(f" {agregat['jours']} jours, {agregat['executions']} exécution(s), {ecoule:.0f} s écoulées : "
+          f"{agregat['jours_par_heure']:.0f} jours/heure")
+    print(f" Temps cumulé des étapes : {total:.1f} s ({total / len(mesures):.2f} s par jour)")
+    for etape, duree in sorted(temps.items(), key=lambda e: -e[1]):
+        print(f"   {etape:>14} {duree:10.1f} s {100 * duree / max(total, 1e-9):6.1f} %")
+    if rayons:
+        print(" Rayons les plus coûteux (convolutions) :")
+        for r1, duree in sorted(rayons.items(), key=lambda e: -e[1])[:n_rayons]:
+            print(f"   r1 = {r1:>5} {duree:10.1f} s")
+    for cle, n in octets.items():
+        debit = n / 1e6 / max(temps.get({"lus": "lecture", "ecrits": "ecriture"}.get(cle, cle), 0), 1e-9)
+        volume = f"{n / 1e9:.2f} Go" if n >= 1e9 else f"{n / 1e6:.1f} Mo"
+        print(f" Octets {cle} : {volume} ({debit:.0f} Mo/s pendant l'étape)")
+    print(f" Pic de mémoire d'un processus : {agregat['pic_memoire_mo']:.0f} Mo ; "
+          f"jour le plus lent : {agregat['jour_le_plus_lent']}")
+    return agregat
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rapport agrégé des métriques journalières.")
+    parser.add_argument("dossier", help="Dossier des fichiers metriques_YYYYMMDD.json")
+    parser.add_argument("--execution", help="Restreint le rapport à une exécution")
+    args = parser.parse_args()
+    rapport(args.dossier, args.execution)
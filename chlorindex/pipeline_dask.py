@@ -0,0 +1,186 @@
+# pipeline_dask.py
+"""
+Calcul paresseux de l'indice spatial sur l'archive complète avec xarray et dask : ouverture
+multi-fichiers des L3m, blocs (jours x tuiles) étendus du halo des rayons, écriture paresseuse
+des fichiers annuels (même format que stockage.py). La mémoire est bornée par les blocs
+en cours, le parallélisme est celui de l'ordonnanceur dask.
+
+Exemple :
+    python chlorindex/pipeline_dask.py --entree ~/chla_2003_2013 --sortie ~/Monde_IE_2003_2013 \
+        --debut 20030101 --fin 20131231 --workers 8 --memoire-worker 4GB
+Auteur : Marc Francescon
+Date : Avril 2025
+"""
+
+import os
+import sys
+import argparse
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+import dask
+import dask.array as da
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chlorindex.core import calc_index_optim_batch, choix_moteur, precompute_masques
+from chlorindex.tuiles import TAILLE_TUILE, halo_rayons
+from chlorindex.run_index import lister_jours, VARIABLE
+from chlorindex.stockage import VARIABLES, chemin_annuel, encoder, fichier_annuel
+from chlorindex.config import ALPHA, R1_LIST, SEUIL_COUVERTURE
+
+JOURS_PAR_BLOC = 4  # Jours empilés dans un bloc dask (convolutions partagées, cf. calc_index_optim_batch)
+
+
+def ouvrir_chla(chemin_chla, debut=None, fin=None, variable=VARIABLE, jours_par_bloc=JOURS_PAR_BLOC,
+                taille_tuile=TAILLE_TUILE):
+    """
+    Ouvre paresseusement les fichiers L3m de [debut, fin] en un DataArray (time, lat, lon)
+    découpé en blocs de `jours_par_bloc` jours et de tuiles `taille_tuile`.
+    """
+    jours = lister_jours(chemin_chla, debut, fin)
+    if not jours:
+        raise FileNotFoundError(f" Aucun fichier L3m entre {debut} et {fin} dans {chemin_chla}")
+    ds = xr.open_mfdataset([os.path.join(chemin_chla, f) for _, f in jours], combine="nested",
+                           concat_dim="time", engine="netcdf4", data_vars=[variable], coords="minimal",
+                           compat="override", chunks={"lat": taille_tuile[0], "lon": taille_tuile[1]})
+    chla = ds[variable].astype(np.float32)
+    chla = chla.assign_coords(time=pd.to_datetime([d for d, _ in jours], format="%Y%m%d"))
+    return chla.chunk({"time": jours_par_bloc})
+
+
+def _indice_bloc(bloc, halo, **kwargs):
+    """
+    Indice d'un bloc (ntime, nlat + 2 halo, nlon + 2 halo) ; retourne les quatre sorties empilées
+    (4, ntime, nlat, nlon) rognées du halo. Un bloc sans pixel valide n'est pas calculé.
+    """
+    coeur = (Ellipsis, slice(halo, bloc.shape[-2] - halo), slice(halo, bloc.shape[-1] - halo))
+    if not np.any(~np.isnan(bloc[coeur])):
+        return np.full((4,) + bloc[coeur].shape, np.nan, dtype=bloc.dtype)
+    resultats = calc_index_optim_batch(bloc, reduction="flux", **kwargs)
+    return np.stack([np.asarray(r[coeur], dtype=bloc.dtype) for r in resultats])
+
+
+def _indice_dask(chla, r1_vals, alpha, seuil_couv, masques_cache, moteur, precision, periodique):
+    """
+    Sur un tableau dask (time, lat, lon) : recouvrement du halo entre tuiles (longitude périodique,
+    NaN au-delà des pôles), calcul bloc par bloc, puis séparation des quatre sorties.
+    """
+    halo = halo_rayons(r1_vals, alpha)
+    etendu = da.overlap.overlap(chla, depth={0: 0, 1: halo, 2: halo},
+                                boundary={0: "none", 1: np.nan, 2: "periodic" if periodique else np.nan})
+    sorties = etendu.map_blocks(_indice_bloc, halo, r1_vals=r1_vals, alpha=alpha, seuil_couv=seuil_couv,
+                                masques_cache=masques_cache, moteur=moteur, precision=precision, workers=1,
+                                new_axis=0, chunks=((4,),) + chla.chunks, dtype=chla.dtype)
+    return tuple(sorties[k] for k in range(4))
+
+
+def calc_index_dask(chla, r1_vals=R1_LIST, alpha=ALPHA, seuil_couv=SEUIL_COUVERTURE, moteur="auto",
+                    precision=None, periodique=True):
+    """
+    Indice spatial optimisé paresseux d'un DataArray (time, lat, lon) découpé en blocs dask
+    (voir ouvrir_chla), par xarray.apply_ufunc. Chaque bloc est calculé avec son halo de
+    ceil(alpha * max(r1)) pixels : le résultat est celui du calcul global, jour par jour.
+    Retourne un Dataset paresseux (index, r1_best, moy_int, moy_ext).
+    """
+    if chla.chunks is None:
+        chla = chla.chunk({"time": JOURS_PAR_BLOC, "lat": TAILLE_TUILE[0], "lon": TAILLE_TUILE[1]})
+    masques_cache = precompute_masques(r1_vals, alpha)
+    if moteur == "auto":
+        moteur = choix_moteur(r1_vals, alpha, masques_cache)
+
+    sorties = xr.apply_ufunc(
+        _indice_dask, chla.transpose("time", "lat", "lon"),
+        kwargs=dict(r1_vals=r1_vals, alpha=alpha, seuil_couv=seuil_couv, masques_cache=masques_cache,
+                    moteur=moteur, precision=precision, periodique=periodique),
+        input_core_dims=[["time", "lat", "lon"]], output_core_dims=[["time", "lat", "lon"]] * 4,
+        dask="allowed",
+    )
+    return xr.Dataset(dict(zip(VARIABLES, sorties)))
+
+
+class _CibleAnnuelle:
+    """
+    Cible de dask.array.store pour une variable d'un fichier annuel : chaque bloc calculé
+    (jours, lat, lon) est encodé puis écrit à la place de ses jours dans l'année.
+    """
+
+    def __init__(self, path, nom, k_jours, lat, lon, r1_vals, entiers):
+        self.path, self.nom, self.k_jours = path, nom, k_jours
+        self.lat, self.lon, self.r1_vals, self.entiers = lat, lon, r1_vals, entiers
+
+    def __setitem__(self, cle, bloc):
+        t, sl_lat, sl_lon = cle
+        k = self.k_jours[t]
+        donnees = encoder(self.nom, bloc, self.r1_vals, self.entiers)
+        with fichier_annuel(self.path, self.lat, self.lon, self.r1_vals, self.entiers) as nc:
+            if np.all(np.diff(k) == 1):
+                nc[self.nom][k[0]:k[-1] + 1, sl_lat, sl_lon] = donnees
+            else:
+                for kk, d in zip(k, donnees):
+                    nc[self.nom][kk, sl_lat, sl_lon] = d
+
+
+def _marquer_jours(_, path, k_jours, lat, lon, r1_vals, entiers):
+    with fichier_annuel(path, lat, lon, r1_vals, entiers) as nc:
+        nc["jour_ecrit"][k_jours] = 1
+
+
+def ecrire_annuel_dask(ds, output_dir, r1_vals=R1_LIST, entiers=False):
+    """
+    Prépare l'écriture paresseuse du Dataset dans les fichiers annuels Word_index_r1_YYYY.nc
+    de stockage.py : seuls les jours calculés sont écrits, bloc par bloc, puis marqués dans
+    jour_ecrit. Retourne l'objet dask à calculer.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    lat, lon = ds["lat"].values, ds["lon"].values
+    jours = pd.DatetimeIndex(ds["time"].values)
+    ecritures = []
+    for annee in sorted(set(jours.year)):
+        sel = np.flatnonzero(jours.year == annee)
+        k_jours = np.asarray(jours[sel].dayofyear - 1)
+        path = chemin_annuel(output_dir, annee)
+        with fichier_annuel(path, lat, lon, r1_vals, entiers):
+            pass  # Création du fichier avant les écritures concurrentes
+        sources = [ds[nom].data[sel] for nom in VARIABLES]
+        cibles = [_CibleAnnuelle(path, nom, k_jours, lat, lon, r1_vals, entiers) for nom in VARIABLES]
+        stockage = da.store(sources, cibles, lock=False, compute=False)
+        ecritures.append(dask.delayed(_marquer_jours)(stockage, path, k_jours, lat, lon, r1_vals, entiers))
+    return dask.delayed(list)(ecritures)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Calcul paresseux (dask) de l'indice spatial sur une archive L3m.")
+    parser.add_argument("--entree", required=True, help="Dossier des fichiers L3m chlor_a")
+    parser.add_argument("--sortie", required=True, help="Dossier des fichiers annuels Word_index_r1_YYYY.nc")
+    parser.add_argument("--debut", help="Première date traitée (YYYYMMDD)")
+    parser.add_argument("--fin", help="Dernière date traitée (YYYYMMDD)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processus dask")
+    parser.add_argument("--memoire-worker", default="4GB", help="Mémoire par processus (dask.distributed)")
+    parser.add_argument("--moteur", default="auto", choices=["auto", "cordes", "spectral", "fft"])
+    parser.add_argument("--precision", choices=["float32", "float64"])
+    parser.add_argument("--entiers", action="store_true", help="Index et moyennes compactés en int16")
+    args = parser.parse_args(argv)
+
+    chla = ouvrir_chla(args.entree, args.debut, args.fin)
+    ds = calc_index_dask(chla, moteur=args.moteur, precision=args.precision)
+    ecriture = ecrire_annuel_dask(ds, args.sortie, entiers=args.entiers)
+
+    try:
+        from dask.distributed import Client, LocalCluster, progress
+    except ImportError:
+        # Sans dask.distributed : ordonnanceur local multi-processus
+        with dask.config.set(scheduler="processes", num_workers=args.workers):
+            ecriture.compute()
+        return
+    with LocalCluster(n_workers=args.workers, threads_per_worker=1, memory_limit=args.memoire_worker) as cluster, \
+            Client(cluster) as client:
+        print(f" Tableau de bord dask : {client.dashboard_link}")
+        futur = client.compute(ecriture)
+        progress(futur)
+        futur.result()
+
+
+if __name__ == "__main__":
+    main()
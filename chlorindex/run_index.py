@@ -1,91 +1,565 @@
 # run_index.py
 """
 Script de traitement des fichiers NetCDF de chlorophylle pour le calcul de l’indice spatial optimisé.
+Les jours sont répartis par lots sur un pool de processus dimensionné selon un budget mémoire ;
+dans chaque processus, la lecture du jour suivant et l'écriture du jour précédent se font
+en tâche de fond pendant le calcul du jour courant. Avec --cube, les jours sont lus dans un cube
+prétraité (cube.py, complété au besoin depuis --entree) plutôt que dans les fichiers L3m.
+
+Exemple :
+    python chlorindex/run_index.py --entree ~/chla_2003_2013 --sortie ~/Monde_IE_2003_2013 \
+        --debut 20030101 --fin 20131231
 Auteur : Marc Francescon
 Date : Avril 2025
 """
 
 import os
+import argparse
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor
 import xarray as xr
 import numpy as np
 import re
 import sys
+import time
+import hashlib
+from functools import partial
 from tqdm import tqdm
 
-sys.path.append(os.path.abspath(".."))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from chlorindex.core import (
-    calc_index_optim,
     sauvegarde_index_netcdf_standard,
-    precompute_masques
+    precompute_masques,
+    precompute_spectres,
+    choix_moteur,
+    dtype_fft,
+)
+from chlorindex.tuiles import (
+    calc_index_tuiles,
+    shape_bloc,
+    halo_rayons,
+    boite_masque,
+    fenetre_boite,
+    extrait_fenetre,
+    TAILLE_TUILE,
 )
-from chlorindex.config import ALPHA, R1_LIST, SEUIL_COUVERTURE
-
-# === Chemins ===
-chemin_chla = "/Users/marcfrancescon/Desktop/chla_2003_2013"
-output_dir = "/Users/marcfrancescon/Desktop/Monde_IE_2003_2013"
-variable = "chlor_a"
-
-# === Lister les fichiers à traiter ===
-files = sorted([
-    f for f in os.listdir(chemin_chla)
-    if f.endswith(".nc") and "L3m" in f
-])
-
-# === Lire un fichier pour récupérer les coordonnées ===
-sample = xr.open_dataset(os.path.join(chemin_chla, files[0]))
-lat = sample["lat"].values
-lon = sample["lon"].values
-sample.close()
-
-# === Pré-calcul des masques ===
-masques_cache = precompute_masques(R1_LIST, ALPHA)
-
-# === Traitement principal ===
-for file in tqdm(files, desc="Traitement fichiers", unit="fichier"):
-    input_path = os.path.join(chemin_chla, file)
-    
-    # Générer le nom de sortie basé sur la date
-    date_match = re.search(r"\d{8}", file)
-    if not date_match:
-        print(f"⏭️  Fichier ignoré (pas de date trouvée) : {file}")
-        continue
-
-    date_str = date_match.group(0)
-    output_name = f"Word_index_r1_{date_str}.nc"
-    output_path = os.path.join(output_dir, output_name)
-
-    # Sauter si le fichier de sortie existe déjà
-    if os.path.exists(output_path):
-        print(f" Déjà traité : {output_name}")
-        continue
-
-    try:
-        ds = xr.open_dataset(input_path, engine="netcdf4")
+from chlorindex.stockage import sauvegarde_index_annuel, chemin_annuel, jours_annuels_valides
+from chlorindex.journal import chemin_journal, enregistrer, jours_termines
+from chlorindex.metriques import (
+    collecte,
+    chrono,
+    compter,
+    nouvelle_mesure,
+    ecrire_mesure,
+    pic_memoire_mo,
+    reinitialiser_pic_memoire,
+    rapport,
+)
+from chlorindex.masque_ocean import deriver_masque_ocean
+from chlorindex.cube import CubeChla, ingerer, lire_index
+from chlorindex.config import ALPHA, R1_LIST, SEUIL_COUVERTURE, PENAL_LAMBDA, R_CRIT
+
+VARIABLE = "chlor_a"
+TAILLE_LOT = 8  # Jours consécutifs par tâche : la lecture anticipée se fait à l'intérieur d'un lot
+
+# Octets par pixel de la grille globale pour un processus : entrée float32 du jour courant et du
+# jour lu d'avance (2 x 4), sorties du jour courant et du jour en cours d'écriture (2 x 20).
+OCTETS_PIXEL_GRILLE = 48
+# Octets par pixel d'un bloc tuile + halo : sommes, effectifs, moyennes et candidats du rayon courant.
+OCTETS_PIXEL_BLOC = 200
+
+# État partagé par les processus de calcul, installé une fois par `_init_worker`
+_PARTAGE = {}
+
+
+def lister_jours(chemin_chla, debut=None, fin=None):
+    """
+    Liste triée des (date YYYYMMDD, nom de fichier) des fichiers L3m de `chemin_chla`
+    dont la date est comprise entre `debut` et `fin` (inclus).
+    """
+    jours = []
+    for f in sorted(os.listdir(chemin_chla)):
+        if not (f.endswith(".nc") and "L3m" in f):
+            continue
+        date_match = re.search(r"\d{8}", f)
+        if not date_match:
+            print(f"⏭️  Fichier ignoré (pas de date trouvée) : {f}")
+            continue
+        date_str = date_match.group(0)
+        if (debut and date_str < debut) or (fin and date_str > fin):
+            continue
+        jours.append((date_str, f))
+    return jours
+
+
+def memoire_par_worker(shape, taille_tuile=TAILLE_TUILE, r1_vals=R1_LIST, alpha=ALPHA):
+    """
+    Estimation (octets) de la mémoire d'un processus de calcul pour une grille de forme `shape`.
+    """
+    nlat, nlon = shape
+    blat, blon = shape_bloc(taille_tuile, r1_vals, alpha)
+    return nlat * nlon * OCTETS_PIXEL_GRILLE + blat * blon * OCTETS_PIXEL_BLOC
+
+
+def nombre_workers(shape, memoire_max, taille_tuile=TAILLE_TUILE, r1_vals=R1_LIST, alpha=ALPHA):
+    """
+    Nombre de processus tenant dans `memoire_max` octets, borné par le nombre de cœurs.
+    """
+    par_worker = memoire_par_worker(shape, taille_tuile, r1_vals, alpha)
+    return max(1, min(os.cpu_count() or 1, int(memoire_max // par_worker)))
+
+
+def preparer_partage(moteur="auto", taille_tuile=TAILLE_TUILE, r1_vals=R1_LIST, alpha=ALPHA,
+                     precision=None, threads_fft=1, recherche="exhaustive"):
+    """
+    Construit une seule fois les masques (et les spectres du bloc tuile si le moteur est spectral).
+    """
+    masques_cache = precompute_masques(r1_vals, alpha)
+    if moteur == "auto":
+        moteur = choix_moteur(r1_vals, alpha, masques_cache)
+    spectres_cache = None
+    if moteur == "spectral":
+        spectres_cache = precompute_spectres(shape_bloc(taille_tuile, r1_vals, alpha), r1_vals, alpha,
+                                             masques_cache, dtype_fft(np.float32, precision))
+    return {
+        "masques_cache": masques_cache,
+        "spectres_cache": spectres_cache,
+        "moteur": moteur,
+        "taille_tuile": taille_tuile,
+        "r1_vals": r1_vals,
+        "alpha": alpha,
+        "seuil_couv": SEUIL_COUVERTURE,
+        "precision": precision,
+        "threads_fft": threads_fft,
+        "recherche": recherche,
+    }
 
+
+def parametres_calcul(partage, format_sortie, entiers, variable, boite=None, masque=None, codage=None):
+    """
+    Paramètres dont dépendent les fichiers de sortie, notés dans le journal : un jour calculé
+    avec d'autres paramètres est refait. Le découpage en tuiles, le nombre de processus et le
+    masque océan ne changent pas les sorties et n'y figurent pas, ni la lecture dans un cube
+    float32 (mêmes valeurs que les fichiers L3m) ; le `codage` uint16, approché, y figure.
+    """
+    parametres = {
+        "moteur": partage["moteur"],
+        "precision": partage["precision"],
+        "recherche": partage["recherche"],
+        "r1_vals": [float(r) for r in partage["r1_vals"]],
+        "alpha": float(partage["alpha"]),
+        "seuil_couv": float(partage["seuil_couv"]),
+        "penal_lambda": PENAL_LAMBDA,
+        "r_crit": R_CRIT,
+        "variable": variable,
+        "format": format_sortie,
+        "entiers": entiers,
+        "boite": None if boite is None else [float(b) for b in boite],
+        "masque": None if masque is None else hashlib.blake2b(np.packbits(masque).tobytes(), digest_size=8).hexdigest(),
+    }
+    if codage not in (None, "float32"):
+        parametres["codage_entree"] = codage
+    if partage["moteur"] == "fft":
+        # Effectifs FFT arrondis : les jours notés sans cette clé (effectifs bruts) sont refaits
+        parametres["effectifs"] = "arrondis"
+    return parametres
+
+
+def _init_worker(partage):
+    """
+    Installe l'état partagé dans le processus. Avec le démarrage "fork", `partage` est hérité
+    sans sérialisation ; sinon il n'est sérialisé qu'une fois par processus, pas par tâche.
+    L'état d'une exécution précédente dans le même processus (région, cube ouvert) est effacé.
+    """
+    _PARTAGE.clear()
+    _PARTAGE.update(partage)
+
+
+def lire_chla(input_path, variable=VARIABLE):
+    """
+    Lit la carte de chlorophylle (float32) d'un fichier L3m.
+    """
+    with xr.open_dataset(input_path, engine="netcdf4") as ds:
+        if variable not in ds:
+            raise KeyError(f"La variable '{variable}' est absente du fichier {os.path.basename(input_path)}")
+        return ds[variable].squeeze().values.astype(np.float32)
+
+
+def lire_fenetre(input_path, i, j, variable=VARIABLE):
+    """
+    Lit la fenêtre (i, j) de fenetre_boite d'un fichier L3m sans charger la grille entière :
+    bande de lignes dans la grille, colonnes repliées en longitude (lues par plages contiguës),
+    NaN au-delà des pôles.
+    """
+    with xr.open_dataset(input_path, engine="netcdf4") as ds:
         if variable not in ds:
-            raise KeyError(f"La variable '{variable}' est absente du fichier {file}")
-        chla = ds[variable].squeeze().values.astype(np.float32)
-        ds.close()
-    except Exception as e:
-        print(f" Erreur à l’ouverture de {file} : {e}")
-        continue
-
-    # Calcul de l'indice spatial optimisé
-    idx_max, r1_best, moy_int, moy_ext = calc_index_optim(
+            raise KeyError(f"La variable '{variable}' est absente du fichier {os.path.basename(input_path)}")
+        var = ds[variable].squeeze()
+        nlat, nlon = var.shape
+        i_ok = np.flatnonzero((i >= 0) & (i < nlat))
+        colonnes = j % nlon
+        plages = np.split(colonnes, np.flatnonzero(np.diff(colonnes) != 1) + 1)
+        bande = slice(i[i_ok[0]], i[i_ok[-1]] + 1)
+        valeurs = np.concatenate([var.isel(lat=bande, lon=slice(p[0], p[-1] + 1)).values for p in plages], axis=1)
+    chla = np.full((len(i), len(j)), np.nan, dtype=np.float32)
+    chla[i_ok] = valeurs
+    return chla
+
+
+def _lire_jour(input_path, variable, mesure, fenetre=None):
+    """
+    Lecture d'un jour (de la fenêtre (i, j) seulement si donnée), chronométrée et comptée
+    dans `mesure` (None : sans métriques).
+    """
+    with collecte(mesure), chrono("lecture"):
+        chla = lire_chla(input_path, variable) if fenetre is None else lire_fenetre(input_path, *fenetre, variable)
+        compter("lus", os.path.getsize(input_path))
+    return chla
+
+
+def _lire_jour_cube(date_str, mesure, fenetre=None):
+    """
+    Lecture d'un jour dans le cube partagé, ouvert une fois par processus : la tranche est
+    préchargée dans le cache de pages (en tâche de fond, voir _traiter_lot) puis rendue sans copie.
+    """
+    if "cube_ouvert" not in _PARTAGE:
+        _PARTAGE["cube_ouvert"] = CubeChla(_PARTAGE["cube"])
+    cube = _PARTAGE["cube_ouvert"]
+    with collecte(mesure), chrono("lecture"):
+        if fenetre is None:
+            cube.precharger(date_str)
+            chla = cube.jour(date_str)
+        else:
+            chla = cube.fenetre(date_str, *fenetre)
+        compter("lus", cube.octets_jour() if fenetre is None else chla.size * np.dtype(cube.codage).itemsize)
+    return chla
+
+
+def _ecrire_jour(fonction, args, output_path, mesure):
+    """
+    Écriture d'un jour par `fonction(*args)` ; les octets écrits sont la croissance du fichier
+    de sortie (fichier journalier créé, ou fichier annuel complété).
+    """
+    with collecte(mesure), chrono("ecriture"):
+        avant = os.path.getsize(output_path) if os.path.exists(output_path) else 0
+        fonction(*args)
+        compter("ecrits", max(os.path.getsize(output_path) - avant, 0))
+
+
+def masque_jour(chla):
+    """
+    Pixels à calculer pour une journée (None : tous) : masque océan statique, complété des
+    pixels valides ce jour qu'il ne contiendrait pas (résultat toujours celui du calcul complet),
+    et restreint au masque de la région s'il y en a un.
+    """
+    ocean, region = _PARTAGE.get("masque_ocean"), _PARTAGE.get("masque_fenetre")
+    if ocean is not None:
+        hors_masque = np.isfinite(chla) & ~ocean
+        if hors_masque.any():
+            ocean = ocean | hors_masque
+    if region is None or ocean is None:
+        return region if ocean is None else ocean
+    return region & ocean
+
+
+def calculer_jour(chla, masque=None):
+    """
+    Indice spatial optimisé d'une journée avec les masques et spectres partagés
+    (d'une fenêtre régionale, rognée à sa boîte, si `fenetre` est partagée), aux seuls
+    pixels de `masque` (voir masque_jour) s'il est donné.
+    """
+    resultats = calc_index_tuiles(
         chla,
-        r1_vals=R1_LIST,
-        alpha=ALPHA,
-        seuil_couv=SEUIL_COUVERTURE,
-        masques_cache=masques_cache
+        r1_vals=_PARTAGE["r1_vals"],
+        alpha=_PARTAGE["alpha"],
+        seuil_couv=_PARTAGE["seuil_couv"],
+        masques_cache=_PARTAGE["masques_cache"],
+        taille_tuile=_PARTAGE["taille_tuile"],
+        moteur=_PARTAGE["moteur"],
+        spectres_cache=_PARTAGE["spectres_cache"],
+        precision=_PARTAGE["precision"],
+        workers=_PARTAGE["threads_fft"],
+        recherche=_PARTAGE["recherche"],
+        periodique=_PARTAGE.get("periodique", True),
+        masque=masque,
     )
+    coeur = _PARTAGE.get("coeur")
+    if coeur is None:
+        return resultats
+    return tuple(r[coeur] for r in resultats)
+
+
+def _traiter_lot(lot):
+    """
+    Traite un lot de jours dans un processus : lecture du jour suivant et écriture du jour
+    précédent en arrière-plan pendant le calcul. Retourne la liste des (date, statut, message).
+    """
+    chemin_chla, output_dir, lat, lon, variable = (
+        _PARTAGE[k] for k in ("chemin_chla", "output_dir", "lat", "lon", "variable"))
+    fenetre = _PARTAGE.get("fenetre")
+    annuel = _PARTAGE["format_sortie"] == "annuel"
+    dossier_metriques = _PARTAGE.get("dossier_metriques")
+    journal = _PARTAGE.get("journal")
+    cube = _PARTAGE.get("cube")
+    bilan = []
+
+    def lire(lecteur, date_str, file, mesure):
+        if cube:
+            return lecteur.submit(_lire_jour_cube, date_str, mesure, fenetre)
+        return lecteur.submit(_lire_jour, os.path.join(chemin_chla, file), variable, mesure, fenetre)
+
+    def mesure_jour(date_str):
+        return nouvelle_mesure(date_str, _PARTAGE["execution"]) if dossier_metriques else None
+
+    def attendre(ecriture):
+        date_str, output_name, futur, mesure = ecriture
+        try:
+            futur.result()
+            if journal:
+                # Après l'écriture complète seulement : un jour interrompu n'est jamais noté terminé
+                taille = None if annuel else os.path.getsize(os.path.join(output_dir, output_name))
+                enregistrer(journal, date_str, output_name, _PARTAGE["parametres"], taille=taille,
+                            execution=_PARTAGE["execution"])
+            bilan.append((date_str, "ok", f" Sauvegardé : {output_name}"))
+        except Exception as e:
+            bilan.append((date_str, "erreur", f" Erreur lors de la sauvegarde de {output_name} : {e}"))
+            return
+        if mesure is not None:
+            mesure["fin"] = time.time()
+            ecrire_mesure(dossier_metriques, mesure)
+
+    with ThreadPoolExecutor(max_workers=1) as lecteur, ThreadPoolExecutor(max_workers=1) as ecrivain:
+        mesure_suivante = mesure_jour(lot[0][0]) if lot else None
+        lecture = lire(lecteur, *lot[0], mesure_suivante) if lot else None
+        ecriture = None
+        for k, (date_str, file) in enumerate(lot):
+            mesure = mesure_suivante
+            try:
+                chla = lecture.result()
+            except Exception as e:
+                chla = None
+                bilan.append((date_str, "erreur", f" Erreur à l’ouverture de {file} : {e}"))
+            # Lecture anticipée du jour suivant pendant le calcul
+            if k + 1 < len(lot):
+                mesure_suivante = mesure_jour(lot[k + 1][0])
+                lecture = lire(lecteur, *lot[k + 1], mesure_suivante)
+            if chla is None:
+                continue
+
+            reinitialiser_pic_memoire()
+            with collecte(mesure):
+                masque = masque_jour(chla)
+                idx_max, r1_best, moy_int, moy_ext = calculer_jour(chla, masque)
+            del chla
+            if masque is not None and _PARTAGE.get("coeur") is not None:
+                masque = masque[_PARTAGE["coeur"]]
+            if mesure is not None:
+                # Pic du processus pendant le calcul (lecture et écriture voisines comprises)
+                mesure["pic_memoire_mo"] = pic_memoire_mo()
+
+            # Une seule écriture en cours : la mémoire reste bornée si l'écriture est plus lente que le calcul
+            if ecriture is not None:
+                attendre(ecriture)
+            if annuel:
+                output_name = os.path.basename(chemin_annuel(output_dir, date_str[:4]))
+                args = (idx_max, r1_best, moy_int, moy_ext, lat, lon, date_str, output_dir,
+                        _PARTAGE["r1_vals"], _PARTAGE["entiers"])
+                # Chunks hors du masque jamais écrits
+                futur = ecrivain.submit(_ecrire_jour, partial(sauvegarde_index_annuel, masque=masque), args,
+                                        os.path.join(output_dir, output_name), mesure)
+            else:
+                output_name = f"Word_index_r1_{date_str}.nc"
+                args = (idx_max, r1_best, moy_int, moy_ext, lat, lon, output_name, output_dir)
+                futur = ecrivain.submit(_ecrire_jour, sauvegarde_index_netcdf_standard, args,
+                                        os.path.join(output_dir, output_name), mesure)
+            ecriture = (date_str, output_name, futur, mesure)
+            del idx_max, r1_best, moy_int, moy_ext, args, masque
+
+        if ecriture is not None:
+            attendre(ecriture)
+    return bilan
+
+
+def traiter_jours(chemin_chla, output_dir, jours, lat, lon, workers=None, memoire_max=None,
+                  moteur="auto", taille_tuile=TAILLE_TUILE, taille_lot=TAILLE_LOT, partage=None,
+                  variable=VARIABLE, precision=None, threads_fft=1, format_sortie="journalier", entiers=False,
+                  recherche="exhaustive", dossier_metriques=None, boite=None, masque=None, masque_ocean=None,
+                  journal=None, cube=None):
+    """
+    Calcule et sauvegarde l'indice des `jours` [(date, fichier)] sur un pool de processus.
+    Les masques et spectres (`partage`, construit si absent) sont préparés une seule fois.
+    `format_sortie` : "journalier" (un fichier par jour) ou "annuel" (stockage.py, avec
+    `entiers` pour compacter index et moyennes en int16). `recherche` : voir calc_index_optim.
+    Avec `dossier_metriques`, les métriques de chaque jour (temps par étape et par rayon, octets
+    lus et écrits, pic de mémoire) y sont écrites en JSON, puis agrégées en fin d'exécution.
+    Avec `boite` (lat_min, lat_max, lon_min, lon_max ; lon_min > lon_max à cheval sur ±180°) ou
+    `masque` (nlat, nlon, booléen), seule la fenêtre de la boîte (par défaut celle du masque),
+    étendue du halo des rayons, est lue et calculée ; les sorties couvrent la boîte (NaN hors
+    du masque) et valent, sur celle-ci, le calcul global.
+    `masque_ocean` (nlat, nlon, voir masque_ocean.py) restreint le calcul et l'écriture annuelle
+    aux pixels valides au moins un jour ; les sorties sont inchangées.
+    Avec `journal` (voir journal.py), les jours que le journal donne pour terminés avec les mêmes
+    paramètres sont sautés, et chaque jour écrit y est noté. En format annuel, ils ne sont sautés
+    que si leur fichier annuel est lisible et les marque écrits (stockage.jours_annuels_valides).
+    Avec `cube` (dossier de cube.py contenant les `jours`), les cartes y sont lues sans décompression.
+    Retourne la liste des (date, statut, message).
+    """
+    region = {}
+    if boite is not None or masque is not None:
+        if masque is not None and np.shape(masque) != (len(lat), len(lon)):
+            raise ValueError(f" Masque de forme {np.shape(masque)} pour une grille {(len(lat), len(lon))}")
+        if boite is None:
+            boite = boite_masque(masque, lat, lon)
+        halo = halo_rayons(partage["r1_vals"], partage["alpha"]) if partage else halo_rayons()
+        i, j, coeur = fenetre_boite(lat, lon, boite, halo)
+        masque_fenetre = np.zeros((len(i), len(j)), dtype=bool)
+        masque_fenetre[coeur] = True
+        if masque is not None:
+            masque_fenetre &= extrait_fenetre(np.asarray(masque, dtype=np.float32), i, j) == 1
+        region = dict(fenetre=(i, j), coeur=coeur, masque_fenetre=masque_fenetre, periodique=False)
+        if masque_ocean is not None:
+            masque_ocean = extrait_fenetre(np.asarray(masque_ocean, dtype=np.float32), i, j) == 1
+        lat, lon = lat[i[coeur[0]]], lon[j[coeur[1]] % len(lon)]
+        taille_tuile = (min(taille_tuile[0], len(i)), min(taille_tuile[1], len(j)))
+        print(f" Région {boite} : fenêtre de {len(i)} x {len(j)} pixels (halo compris)")
+    shape = (len(i), len(j)) if region else (len(lat), len(lon))
+    if workers is None:
+        workers = nombre_workers(shape, memoire_max, taille_tuile) if memoire_max else (os.cpu_count() or 1)
+    if partage is None:
+        partage = preparer_partage(moteur, taille_tuile, precision=precision, threads_fft=threads_fft,
+                                   recherche=recherche)
+    partage = dict(partage, chemin_chla=chemin_chla, output_dir=output_dir, lat=lat, lon=lon, variable=variable,
+                   format_sortie=format_sortie, entiers=entiers, dossier_metriques=dossier_metriques,
+                   execution=time.strftime("%Y%m%dT%H%M%S"), masque_ocean=masque_ocean, journal=journal, cube=cube,
+                   parametres=parametres_calcul(partage, format_sortie, entiers, variable, boite, masque,
+                                                lire_index(cube)["codage"] if cube else None), **region)
+
+    if journal:
+        termines = jours_termines(journal, partage["parametres"], output_dir)
+        if format_sortie == "annuel":
+            # Fichier annuel modifié sur place : un jour du journal ne compte que si son fichier est lisible
+            termines = jours_annuels_valides(output_dir, termines, {d[:4] for d, _ in jours})
+        a_traiter = [(d, f) for d, f in jours if d not in termines]
+        print(f" Journal : {len(jours) - len(a_traiter)} jours déjà traités, {len(a_traiter)} à traiter")
+        jours = a_traiter
+        if not jours:
+            return []
+
+    # Lots plus petits si peu de jours, pour occuper tous les processus
+    taille_lot = max(1, min(taille_lot, -(-len(jours) // workers)))
+    lots = [jours[i:i + taille_lot] for i in range(0, len(jours), taille_lot)]
+
+    bilan = []
+    t0 = time.perf_counter()
+    with tqdm(total=len(jours), desc="Traitement fichiers", unit="fichier") as barre:
+        if workers == 1:
+            _init_worker(partage)
+            for res in map(_traiter_lot, lots):
+                bilan.extend(res)
+                barre.update(len(res))
+        else:
+            with mp.Pool(workers, initializer=_init_worker, initargs=(partage,)) as pool:
+                for res in pool.imap_unordered(_traiter_lot, lots):
+                    bilan.extend(res)
+                    barre.update(len(res))
+    duree = time.perf_counter() - t0
+    n_ok = sum(statut == "ok" for _, statut, _ in bilan)
+    print(f" {n_ok}/{len(jours)} jours traités en {duree:.0f} s "
+          f"({3600 * n_ok / max(duree, 1e-9):.0f} jours/heure, {workers} processus)")
+    if dossier_metriques:
+        rapport(dossier_metriques, partage["execution"])
+    return bilan
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Calcul de l'indice spatial optimisé journalier.")
+    parser.add_argument("--entree", required=True, help="Dossier des fichiers L3m chlor_a")
+    parser.add_argument("--sortie", required=True, help="Dossier des fichiers Word_index_r1_*.nc")
+    parser.add_argument("--debut", help="Première date traitée (YYYYMMDD)")
+    parser.add_argument("--fin", help="Dernière date traitée (YYYYMMDD)")
+    parser.add_argument("--workers", type=int, help="Nombre de processus (défaut : budget mémoire ou nombre de cœurs)")
+    parser.add_argument("--memoire-max", type=float, help="Budget mémoire total en Go")
+    parser.add_argument("--moteur", default="auto", choices=["auto", "cordes", "spectral", "fft"])
+    parser.add_argument("--variable", default=VARIABLE)
+    parser.add_argument("--precision", choices=["float32", "float64"],
+                        help="Précision du calcul (défaut : convolutions en float32, intermédiaires en float64)")
+    parser.add_argument("--threads-fft", type=int, default=1, help="Threads FFT par processus")
+    parser.add_argument("--format", default="journalier", choices=["journalier", "annuel"],
+                        help="Un fichier par jour, ou un fichier Word_index_r1_YYYY.nc par an")
+    parser.add_argument("--entiers", action="store_true",
+                        help="Format annuel : index et moyennes compactés en int16")
+    parser.add_argument("--recherche", default="exhaustive", choices=["exhaustive", "exacte", "grossiere"],
+                        help="Recherche du meilleur rayon : tous les rayons, rayons utiles (même résultat), "
+                             "ou grossière puis fine (approchée)")
+    parser.add_argument("--metriques", help="Dossier des métriques par jour (temps par étape, octets, mémoire)")
+    parser.add_argument("--boite", nargs=4, type=float, metavar=("LAT_MIN", "LAT_MAX", "LON_MIN", "LON_MAX"),
+                        help="Région calculée seule (LON_MIN > LON_MAX : à cheval sur le méridien ±180°)")
+    parser.add_argument("--masque-ocean", help="Masque océan statique (NetCDF de masque_ocean.py, créé ou complété "
+                                               "depuis les fichiers d'entrée ; ou .npy pris tel quel)")
+    parser.add_argument("--masque", help="Masque de la région (.npy, ou NetCDF d'une seule variable), "
+                                         "sur la grille des fichiers L3m")
+    parser.add_argument("--cube", help="Cube d'entrée prétraité (cube.py) : créé ou complété une fois depuis "
+                                       "--entree, puis lu sans décompression")
+    parser.add_argument("--codage-cube", choices=["float32", "uint16"],
+                        help="Codage d'un nouveau cube : float32 (défaut, valeurs exactes) ou uint16 (log10, approché)")
+    args = parser.parse_args(argv)
+
+    # === Lister les fichiers à traiter ===
+    jours = lister_jours(args.entree, args.debut, args.fin)
+    if not jours:
+        print(" Aucun fichier à traiter.")
+        return []
+
+    # === Lire un fichier (ou le cube) pour récupérer les coordonnées ===
+    if args.cube:
+        # Jours absents du cube convertis une fois ; seuls ceux qu'il contient sont traités
+        contenu = ingerer(args.entree, args.cube, jours, args.variable, args.codage_cube, args.workers)["jours"]
+        jours = [(d, f) for d, f in jours if d in contenu]
+        cube = CubeChla(args.cube)
+        lat, lon = cube.lat, cube.lon
+    else:
+        with xr.open_dataset(os.path.join(args.entree, jours[0][1])) as sample:
+            lat = sample["lat"].values
+            lon = sample["lon"].values
+
+    masque = None
+    if args.masque:
+        if args.masque.endswith(".npy"):
+            masque = np.load(args.masque)
+        else:
+            with xr.open_dataarray(args.masque) as da:
+                masque = da.values
+        masque = np.nan_to_num(masque) != 0
+
+    ocean = None
+    if args.masque_ocean:
+        if args.masque_ocean.endswith(".npy"):
+            ocean = np.load(args.masque_ocean).astype(bool)
+        else:
+            # Union des pixels valides de toute l'archive d'entrée (jours déjà pris en compte non relus)
+            ocean = deriver_masque_ocean(args.entree, lister_jours(args.entree), args.masque_ocean, args.variable,
+                                         args.workers)
+
+    # === Fichiers temporaires d'une exécution interrompue : jamais repris ===
+    os.makedirs(args.sortie, exist_ok=True)
+    for f in os.listdir(args.sortie):
+        if f.startswith("Word_index_r1_") and f.endswith(".tmp"):
+            os.remove(os.path.join(args.sortie, f))
+
+    # Les jours déjà traités (d'après le journal, avec les mêmes paramètres) sont sautés
+    memoire_max = args.memoire_max * 1e9 if args.memoire_max else None
+    bilan = traiter_jours(args.entree, args.sortie, jours, lat, lon,
+                          workers=args.workers, memoire_max=memoire_max, moteur=args.moteur,
+                          variable=args.variable, precision=args.precision, threads_fft=args.threads_fft,
+                          format_sortie=args.format, entiers=args.entiers, recherche=args.recherche,
+                          dossier_metriques=args.metriques, boite=args.boite, masque=masque,
+                          masque_ocean=ocean, journal=chemin_journal(args.sortie), cube=args.cube)
+    for date_str, statut, message in bilan:
+        if statut != "ok":
+            print(message)
+    return bilan
+
 
-    # Sauvegarde du fichier de sortie
-    try:
-        sauvegarde_index_netcdf_standard(
-            idx_max, r1_best, moy_int, moy_ext,
-            lat, lon, output_name, output_dir,verbose=False 
-        )
-        print(f" Sauvegardé : {output_name}")
-    except Exception as e:
-        print(f" Erreur lors de la sauvegarde de {output_name} : {e}")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+# stockage.py
+"""
+Archive annuelle de l'indice spatial : un fichier NetCDF4 Word_index_r1_YYYY.nc par an, axe
+temps complet (un pas par jour de l'année), chunks explicites, r1_best codé en uint8 et, en option,
+les autres variables compactées en int16 (scale_factor / add_offset, décodés par xarray).
+Auteur : Marc Francescon
+Date : Avril 2025
+"""
+
+import os
+import glob
+import fcntl
+import importlib.util
+from contextlib import contextmanager
+from datetime import datetime, timedelta, date as _date
+
+import numpy as np
+import netCDF4
+import xarray as xr
+from xarray.backends.locks import HDF5_LOCK
+
+from .config import R1_LIST
+
+CHUNKS = (1, 540, 1080)  # (temps, lat, lon) : un jour par chunk, 8 x 8 chunks sur la grille 4 km
+NIVEAU_ZLIB = 1  # Avec shuffle, presque aussi compact que le niveau 4 et nettement plus rapide
+FILL_R1 = 255
+FILL_INT16 = -32768
+# (scale_factor, add_offset) des variables compactées en int16 : valeurs hors plage écrêtées.
+# index dans [-0.38, 32.38] au pas de 5e-4 ; moyennes (mg m-3) dans [0, 65.5] au pas de 1e-3.
+ENCODAGE_INT16 = {
+    "index": (5e-4, 16.0),
+    "moy_int": (1e-3, 32.767),
+    "moy_ext": (1e-3, 32.767),
+}
+VARIABLES = ("index", "r1_best", "moy_int", "moy_ext")
+
+
+def chemin_annuel(output_dir, annee):
+    return os.path.join(output_dir, f"Word_index_r1_{annee}.nc")
+
+
+def _creer_annuel(path, annee, lat, lon, r1_vals, entiers, chunks):
+    """
+    Crée le fichier d'une année : axe temps complet, variables vides (aucun chunk alloué).
+    """
+    debut = _date(annee, 1, 1)
+    n_jours = (_date(annee + 1, 1, 1) - debut).days
+    chunks = (min(chunks[0], n_jours), min(chunks[1], len(lat)), min(chunks[2], len(lon)))
+
+    with netCDF4.Dataset(path + ".tmp", "w", format="NETCDF4") as nc:
+        nc.createDimension("time", n_jours)
+        nc.createDimension("lat", len(lat))
+        nc.createDimension("lon", len(lon))
+
+        t = nc.createVariable("time", "i4", ("time",))
+        t.units = "days since 1970-01-01"
+        t.calendar = "proleptic_gregorian"
+        t[:] = np.arange(n_jours) + (debut - _date(1970, 1, 1)).days
+        nc.createVariable("lat", lat.dtype, ("lat",))[:] = lat
+        nc.createVariable("lon", lon.dtype, ("lon",))[:] = lon
+        # Jours effectivement écrits (les autres restent au _FillValue)
+        nc.createVariable("jour_ecrit", "u1", ("time",), fill_value=False)[:] = 0
+
+        options = dict(zlib=True, complevel=NIVEAU_ZLIB, shuffle=True, chunksizes=chunks)
+        dims = ("time", "lat", "lon")
+        for nom in ("index", "moy_int", "moy_ext"):
+            if entiers:
+                v = nc.createVariable(nom, "i2", dims, fill_value=FILL_INT16, **options)
+                v.scale_factor, v.add_offset = ENCODAGE_INT16[nom]
+            else:
+                v = nc.createVariable(nom, "f4", dims, fill_value=np.float32(np.nan), **options)
+
+        v = nc.createVariable("r1_best", "u1", dims, fill_value=FILL_R1, **options)
+        r1_vals = np.asarray(r1_vals, dtype=np.float64)
+        v.valeurs_r1 = r1_vals
+        v.comment = "Code k du rayon r1_best = valeurs_r1[k]"
+        pas = np.diff(r1_vals)
+        if len(r1_vals) > 1 and np.allclose(pas, pas[0]):
+            # Rayons régulièrement espacés : décodage CF direct en rayon (pixels)
+            v.scale_factor, v.add_offset = pas[0], r1_vals[0]
+    os.replace(path + ".tmp", path)
+
+
+def code_r1(r1_best, r1_vals=R1_LIST):
+    """
+    Code uint8 du rayon retenu : indice dans `r1_vals`, FILL_R1 là où r1_best est NaN.
+    """
+    codes = np.full(r1_best.shape, FILL_R1, dtype=np.uint8)
+    for k, r1 in enumerate(r1_vals):
+        codes[r1_best == r1] = k
+    return codes
+
+
+def _int16(data, nom):
+    """
+    Compactage int16 (arrondi, écrêtage) selon ENCODAGE_INT16 ; NaN -> FILL_INT16.
+    """
+    scale, offset = ENCODAGE_INT16[nom]
+    with np.errstate(invalid="ignore"):
+        q = np.rint((data - offset) / scale)
+        np.clip(q, FILL_INT16 + 1, 32767, out=q)
+    q[np.isnan(q)] = FILL_INT16
+    return q.astype(np.int16)
+
+
+def encoder(nom, data, r1_vals=R1_LIST, entiers=False):
+    """
+    Valeurs brutes stockées pour une variable : code uint8 pour r1_best, int16 compacté
+    ou float32 pour les autres.
+    """
+    if nom == "r1_best":
+        return code_r1(data, r1_vals)
+    return _int16(data, nom) if entiers else data.astype(np.float32, copy=False)
+
+
+@contextmanager
+def fichier_annuel(path, lat, lon, r1_vals=R1_LIST, entiers=False, chunks=CHUNKS):
+    """
+    Ouvre en écriture le fichier annuel `path` (créé au besoin), valeurs brutes (sans décodage).
+    Plusieurs processus peuvent écrire dans la même année : l'accès est sérialisé par un verrou
+    fichier. Dans un processus, le verrou HDF5 de xarray sérialise l'écriture avec les lectures
+    xarray d'autres threads (la bibliothèque netCDF-C n'est pas thread-safe).
+    """
+    annee = int(os.path.basename(path)[14:18])
+    with open(path + ".lock", "w") as verrou:
+        fcntl.flock(verrou, fcntl.LOCK_EX)
+        with HDF5_LOCK:
+            if not os.path.exists(path):
+                _creer_annuel(path, annee, np.asarray(lat), np.asarray(lon), r1_vals, entiers, chunks)
+            with netCDF4.Dataset(path, "a") as nc:
+                nc.set_auto_maskandscale(False)
+                if entiers != (nc["index"].dtype == np.int16):
+                    raise ValueError(f" {os.path.basename(path)} n'a pas l'encodage demandé (entiers={entiers})")
+                yield nc
+
+
+def blocs_chunks(shape, chunks, masque=None):
+    """
+    Tranches (lat, lon) des chunks spatiaux d'une grille ; avec `masque`, seulement celles des
+    chunks contenant au moins un pixel du masque.
+    """
+    blocs = [(slice(i0, min(i0 + chunks[0], shape[0])), slice(j0, min(j0 + chunks[1], shape[1])))
+             for i0 in range(0, shape[0], chunks[0]) for j0 in range(0, shape[1], chunks[1])]
+    return blocs if masque is None else [b for b in blocs if masque[b].any()]
+
+
+def sauvegarde_index_annuel(idx_max, r1_best, moy_int, moy_ext, lat, lon, date_str, output_dir,
+                            r1_vals=R1_LIST, entiers=False, chunks=CHUNKS, verbose=False, masque=None):
+    """
+    Écrit une journée dans le fichier annuel (créé au besoin, voir fichier_annuel).
+    Réécrire un jour remplace ses valeurs.
+    Avec `masque` (masque océan statique, voir masque_ocean.py), les chunks sans aucun pixel du
+    masque ne sont pas écrits : jamais alloués, ils se lisent au _FillValue (NaN une fois décodés).
+    """
+    jour = datetime.strptime(date_str, "%Y%m%d").date()
+    os.makedirs(output_dir, exist_ok=True)
+    path = chemin_annuel(output_dir, jour.year)
+
+    # Encodage hors verrou : seule l'écriture est sérialisée
+    donnees = {nom: encoder(nom, data, r1_vals, entiers)
+               for nom, data in zip(VARIABLES, (idx_max, r1_best, moy_int, moy_ext))}
+
+    with fichier_annuel(path, lat, lon, r1_vals, entiers, chunks) as nc:
+        k = jour.timetuple().tm_yday - 1
+        for nom, data in donnees.items():
+            if masque is None:
+                nc[nom][k] = data
+                continue
+            chunks_fichier = nc[nom].chunking()[1:]
+            for bloc in blocs_chunks(data.shape, chunks_fichier, masque):
+                nc[nom][(k,) + bloc] = data[bloc]
+        # Données sur disque avant la marque : un jour interrompu reste non écrit
+        nc.sync()
+        nc["jour_ecrit"][k] = 1
+
+    if verbose:
+        print(f" Jour {date_str} sauvegardé dans : {path}")
+
+
+def jours_ecrits(output_dir):
+    """
+    Ensemble des dates (YYYYMMDD) déjà présentes dans les fichiers annuels de `output_dir`.
+    """
+    dates = set()
+    for path in sorted(glob.glob(os.path.join(output_dir, "Word_index_r1_[0-9][0-9][0-9][0-9].nc"))):
+        with HDF5_LOCK, netCDF4.Dataset(path) as nc:
+            ecrit = np.asarray(nc["jour_ecrit"][:]).astype(bool)
+        debut = _date(int(os.path.basename(path)[14:18]), 1, 1)
+        dates.update((debut + timedelta(days=int(k))).strftime("%Y%m%d") for k in np.flatnonzero(ecrit))
+    return dates
+
+
+def verifier_annuel(path):
+    """
+    Dates (YYYYMMDD) marquées écrites d'un fichier annuel, après relecture de la marque et du
+    dernier jour marqué de chaque variable ; None si le fichier est absent ou illisible (écriture
+    d'un jour interrompue en plein milieu : le fichier HDF5 est modifié sur place, pas remplacé).
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        with HDF5_LOCK, netCDF4.Dataset(path) as nc:
+            nc.set_auto_maskandscale(False)
+            ecrit = np.flatnonzero(np.asarray(nc["jour_ecrit"][:]).astype(bool))
+            if len(ecrit):
+                for nom in VARIABLES:
+                    nc[nom][ecrit[-1]]
+    except (OSError, RuntimeError, KeyError, IndexError):
+        return None
+    debut = _date(int(os.path.basename(path)[14:18]), 1, 1)
+    return {(debut + timedelta(days=int(k))).strftime("%Y%m%d") for k in ecrit}
+
+
+def jours_annuels_valides(output_dir, dates, annees=()):
+    """
+    Parmi `dates` (données pour terminées par le journal), celles marquées écrites dans un fichier
+    annuel lisible (voir verifier_annuel). Les fichiers des `annees` (YYYY) à compléter sont aussi
+    vérifiés. Un fichier illisible est renommé en .corrompu : tous les jours de son année sont recalculés.
+    """
+    valides = set()
+    for annee in sorted({d[:4] for d in dates} | set(annees)):
+        path = chemin_annuel(output_dir, annee)
+        ecrites = verifier_annuel(path)
+        if ecrites is None:
+            if os.path.exists(path):
+                os.replace(path, path + ".corrompu")
+                print(f" {os.path.basename(path)} illisible : renommé en .corrompu, année {annee} recalculée")
+            continue
+        valides |= {d for d in dates if d[:4] == annee} & ecrites
+    return valides
+
+
+def ouvrir_archive(output_dir, annees=None):
+    """
+    Ouvre les fichiers annuels comme un seul Dataset xarray (un fichier par an).
+    Paresseux avec dask (open_mfdataset), sinon concaténation des fichiers ouverts.
+    """
+    chemins = sorted(glob.glob(os.path.join(output_dir, "Word_index_r1_[0-9][0-9][0-9][0-9].nc")))
+    if annees is not None:
+        chemins = [p for p in chemins if int(os.path.basename(p)[14:18]) in set(annees)]
+    if not chemins:
+        raise FileNotFoundError(f" Aucun fichier annuel dans {output_dir}")
+    if importlib.util.find_spec("dask") is None:
+        return xr.concat([xr.open_dataset(p) for p in chemins], dim="time")
+    return xr.open_mfdataset(chemins, combine="by_coords")
@@ -0,0 +1,190 @@
+# tuiles.py
+"""
+Exécution tuilée de calc_index_optim avec halo, longitude périodique et saut des tuiles vides.
+Auteur : Marc Francescon
+Date : Avril 2025
+"""
+
+import numpy as np
+
+from .core import PAS_GROSSIER, calc_index_optim, choix_moteur, dtype_fft, precompute_masques, precompute_spectres
+from .config import ALPHA, R1_LIST, SEUIL_COUVERTURE
+from .metriques import chrono
+
+TAILLE_TUILE = (480, 960)  # Divise exactement la grille L3m 4 km (4320 x 8640) en 9 x 9 tuiles
+
+
+def halo_rayons(r1_vals=R1_LIST, alpha=ALPHA):
+    """
+    Largeur du halo (en pixels) nécessaire autour d'une tuile : le plus grand rayon extérieur.
+    """
+    return int(np.ceil(alpha * np.max(r1_vals)))
+
+
+def shape_bloc(taille_tuile=TAILLE_TUILE, r1_vals=R1_LIST, alpha=ALPHA):
+    """
+    Forme d'un bloc de calcul : tuile plus halo de chaque côté.
+    """
+    halo = halo_rayons(r1_vals, alpha)
+    return (taille_tuile[0] + 2 * halo, taille_tuile[1] + 2 * halo)
+
+
+def decoupe_tuiles(shape, taille_tuile=TAILLE_TUILE):
+    """
+    Liste des tuiles (tranche lat, tranche lon) couvrant une grille de forme `shape`.
+    """
+    nlat, nlon = shape
+    tlat, tlon = taille_tuile
+    return [(slice(i0, min(i0 + tlat, nlat)), slice(j0, min(j0 + tlon, nlon)))
+            for i0 in range(0, nlat, tlat)
+            for j0 in range(0, nlon, tlon)]
+
+
+def extrait_tuile(chla, tuile, halo, taille_tuile=TAILLE_TUILE, periodique=True):
+    """
+    Extrait une tuile avec son halo, complétée par des NaN à la forme fixe
+    (taille_tuile + 2 * halo) pour que toutes les tuiles partagent les mêmes spectres.
+    En longitude périodique, le halo est prélevé de l'autre côté du méridien ±180°.
+    Au-delà des pôles (et en longitude non périodique), le halo est NaN.
+    Les dimensions de tête éventuelles (pile de jours) sont conservées.
+    """
+    *tete, nlat, nlon = chla.shape
+    sl_lat, sl_lon = tuile
+    bloc = np.full(tuple(tete) + (taille_tuile[0] + 2 * halo, taille_tuile[1] + 2 * halo), np.nan, dtype=chla.dtype)
+
+    i = np.arange(sl_lat.start - halo, sl_lat.stop + halo)
+    j = np.arange(sl_lon.start - halo, sl_lon.stop + halo)
+    i_ok = (i >= 0) & (i < nlat)
+    if periodique:
+        j = j % nlon
+        j_ok = np.ones(j.shape, dtype=bool)
+    else:
+        j_ok = (j >= 0) & (j < nlon)
+
+    bloc[..., np.flatnonzero(i_ok)[:, None], np.flatnonzero(j_ok)] = chla[..., i[i_ok][:, None], j[j_ok]]
+    return bloc
+
+
+def boite_masque(masque, lat, lon):
+    """
+    Boîte (lat_min, lat_max, lon_min, lon_max) englobant les pixels vrais de `masque` (nlat, nlon).
+    En longitude, l'arc le plus court est retenu : lon_min > lon_max si la boîte passe le méridien ±180°.
+    """
+    lignes = np.flatnonzero(masque.any(axis=1))
+    colonnes = np.flatnonzero(masque.any(axis=0))
+    if len(lignes) == 0:
+        raise ValueError(" Masque vide")
+    # Le plus grand écart entre colonnes consécutives (repliement compris) est laissé hors de la boîte
+    ecarts = np.diff(np.append(colonnes, colonnes[0] + len(lon)))
+    g = int(np.argmax(ecarts))
+    debut, fin = colonnes[(g + 1) % len(colonnes)], colonnes[g]
+    return (float(min(lat[lignes[0]], lat[lignes[-1]])), float(max(lat[lignes[0]], lat[lignes[-1]])),
+            float(lon[debut]), float(lon[fin]))
+
+
+def fenetre_boite(lat, lon, boite, halo, periodique=True):
+    """
+    Fenêtre de la grille couvrant une boîte (lat_min, lat_max, lon_min, lon_max), étendue du halo.
+    lon_min > lon_max désigne une boîte à cheval sur le méridien ±180°.
+    Retourne (i, j, coeur) : indices de lignes et de colonnes de la fenêtre, non repliés (i hors
+    de [0, nlat) au-delà des pôles, j à replier modulo nlon en longitude périodique), et tranches
+    de la boîte dans la fenêtre.
+    """
+    lat_min, lat_max, lon_min, lon_max = boite
+    nlon = len(lon)
+    lignes = np.flatnonzero((lat >= lat_min) & (lat <= lat_max))
+    if lon_min <= lon_max:
+        colonnes = np.flatnonzero((lon >= lon_min) & (lon <= lon_max))
+        j0, j1 = (colonnes[0], colonnes[-1] + 1) if len(colonnes) else (0, 0)
+    else:
+        est, ouest = np.flatnonzero(lon >= lon_min), np.flatnonzero(lon <= lon_max)
+        j0, j1 = (est[0] if len(est) else nlon), (ouest[-1] + 1 + nlon if len(ouest) else nlon)
+    if len(lignes) == 0 or j1 <= j0:
+        raise ValueError(f" Boîte vide sur la grille : {boite}")
+    if not periodique:
+        j0, j1 = j0 % nlon, (j1 - 1) % nlon + 1
+        if j1 <= j0:
+            raise ValueError(f" Boîte à cheval sur le bord d'une grille non périodique : {boite}")
+
+    i = np.arange(lignes[0] - halo, lignes[-1] + 1 + halo)
+    j = np.arange(j0 - halo, j1 + halo)
+    coeur = (slice(halo, len(i) - halo), slice(halo, len(j) - halo))
+    return i, j, coeur
+
+
+def extrait_fenetre(chla, i, j, periodique=True):
+    """
+    Extrait la fenêtre (i, j) de fenetre_boite d'une grille en mémoire : NaN au-delà des pôles,
+    colonnes repliées en longitude périodique (NaN hors grille sinon).
+    """
+    *tete, nlat, nlon = chla.shape
+    bloc = np.full(tuple(tete) + (len(i), len(j)), np.nan, dtype=chla.dtype)
+    i_ok = (i >= 0) & (i < nlat)
+    j_ok = np.ones(j.shape, dtype=bool) if periodique else (j >= 0) & (j < nlon)
+    bloc[..., np.flatnonzero(i_ok)[:, None], np.flatnonzero(j_ok)] = chla[..., i[i_ok][:, None], j[j_ok] % nlon]
+    return bloc
+
+
+def calc_index_tuiles(chla, r1_vals=R1_LIST, alpha=ALPHA, seuil_couv=SEUIL_COUVERTURE, masques_cache=None,
+                      taille_tuile=TAILLE_TUILE, periodique=True, moteur="auto", reduction="flux",
+                      spectres_cache=None, precision=None, workers=None, recherche="exhaustive",
+                      pas_grossier=PAS_GROSSIER, masque=None):
+    """
+    Calcule l'indice spatial optimisé tuile par tuile.
+    Chaque tuile est étendue d'un halo de ceil(alpha * max(r1)) pixels, de sorte que le
+    résultat au cœur de la tuile est celui du calcul global : identique avec le moteur "cordes",
+    au bruit des FFT près (égalités d'indice entre rayons) avec "fft" et "spectral", dont les
+    effectifs arrondis gardent le même test de couverture. Les tuiles sans aucun pixel
+    valide (terre ou nuages) sont sautées : leur sortie est NaN, comme dans le calcul global.
+    La mémoire de travail est bornée par la taille d'une tuile.
+    `chla` peut être une pile de jours (ntime, nlat, nlon), calculée en bloc comme par
+    calc_index_optim_batch.
+    `spectres_cache` (moteur spectral) doit avoir été calculé à la forme `shape_bloc`.
+    `precision`, `workers`, `recherche` et `pas_grossier` sont transmis à calc_index_optim :
+    en recherche "grossiere", l'affinage aux seuls pixels concernés se fait tuile par tuile.
+    Avec `masque` (nlat, nlon), seules les tuiles contenant des pixels du masque sont calculées,
+    et dans chacune seuls ces pixels sont évalués (voir `pixels` de calc_index_optim) ; les
+    sorties sont NaN hors du masque.
+    """
+    if masques_cache is None:
+        masques_cache = precompute_masques(r1_vals, alpha)
+    if moteur == "auto":
+        moteur = choix_moteur(r1_vals, alpha, masques_cache)
+
+    halo = halo_rayons(r1_vals, alpha)
+    if moteur == "spectral" and spectres_cache is None:
+        spectres_cache = precompute_spectres(shape_bloc(taille_tuile, r1_vals, alpha), r1_vals, alpha,
+                                             masques_cache, dtype_fft(chla.dtype, precision))
+
+    index_max = np.full(chla.shape, np.nan, dtype=chla.dtype)
+    meilleur_r1 = np.full(chla.shape, np.nan, dtype=np.asarray(r1_vals).dtype)
+    moy_int = np.full(chla.shape, np.nan, dtype=chla.dtype)
+    moy_ext = np.full(chla.shape, np.nan, dtype=chla.dtype)
+
+    for tuile in decoupe_tuiles(chla.shape[-2:], taille_tuile):
+        tuile = (Ellipsis,) + tuile
+        if not np.any(~np.isnan(chla[tuile])) or (masque is not None and not masque[tuile[1:]].any()):
+            continue
+
+        _, sl_lat, sl_lon = tuile
+        coeur = (Ellipsis, slice(halo, halo + sl_lat.stop - sl_lat.start),
+                 slice(halo, halo + sl_lon.stop - sl_lon.start))
+        with chrono("tuiles"):
+            bloc = extrait_tuile(chla, tuile[1:], halo, taille_tuile, periodique)
+            pixels = None
+            if masque is not None:
+                # Pixels du masque au cœur de la tuile : ni le halo ni la terre ne sont évalués
+                masque_bloc = np.zeros(bloc.shape[-2:], dtype=bool)
+                masque_bloc[coeur[1:]] = masque[tuile[1:]]
+                pixels = np.flatnonzero(masque_bloc)
+        resultats = calc_index_optim(bloc, r1_vals=r1_vals, alpha=alpha, seuil_couv=seuil_couv,
+                                     masques_cache=masques_cache, moteur=moteur,
+                                     spectres_cache=spectres_cache, reduction=reduction,
+                                     precision=precision, workers=workers, recherche=recherche,
+                                     pas_grossier=pas_grossier, pixels=pixels)
+
+        with chrono("tuiles"):
+            for sortie, res in zip((index_max, meilleur_r1, moy_int, moy_ext), resultats):
+                sortie[tuile] = res[coeur]
+
+    return index_max, meilleur_r1, moy_int, moy_ext